@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""Benchmarks for loading and concatenating the appliance type catalogue
+and for converting datasets.
+
+Each benchmark reports its best wall-clock time over `--repeat` runs and
+its peak memory allocation (measured with tracemalloc on a separate run).
+Results are compared against a stored baseline; the script exits with
+status 1 if any benchmark is slower than `--tolerance` times its baseline.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --buildings 100 --meters 50
+    python benchmarks/run_benchmarks.py --save-baseline
+"""
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from copy import deepcopy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from nilm_metadata.convert_yaml_to_hdf5 import (
+    convert_yaml_to_hdf5, _load_file, _find_building_filenames,
+    _sanity_check_appliances)
+from nilm_metadata.file_management import get_appliance_types_from_disk
+from nilm_metadata.object_concatenation import (
+    _concatenate_all_appliance_types, recursively_update_dict,
+    get_appliance_type_registry)
+from synthetic import write_dataset, write_catalogue
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+
+
+def benchmarks(args, directory):
+    """
+    Returns
+    -------
+    list of (name, setup, function) tuples.  `setup()` is called once and
+    its return value is passed to `function` for every run.
+    """
+    yaml_dir = os.path.join(directory, 'dataset')
+    write_dataset(yaml_dir, args.buildings, args.meters, args.appliances)
+    catalogue_filenames = write_catalogue(
+        os.path.join(directory, 'catalogue'),
+        n_types_per_file=args.catalogue_types, n_files=args.catalogue_files)
+    hdf_filename = os.path.join(directory, 'dataset.h5')
+
+    def load_buildings():
+        get_appliance_type_registry().names()  # warm the registry
+        return [_load_file(yaml_dir, fname)
+                for fname in _find_building_filenames(yaml_dir)]
+
+    def sanity_check_appliances(buildings):
+        for building in buildings:
+            _sanity_check_appliances(building)
+
+    def update_dicts(appliance_types):
+        merged = {}
+        for appliance_type in appliance_types.values():
+            recursively_update_dict(merged, appliance_type)
+
+    def convert(_):
+        if os.path.exists(hdf_filename):
+            os.remove(hdf_filename)
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, workers=args.workers)
+
+    return [
+        ('get_appliance_types_from_disk', lambda: catalogue_filenames,
+         get_appliance_types_from_disk),
+        ('concatenate_all_appliance_types',
+         lambda: get_appliance_types_from_disk(catalogue_filenames),
+         _concatenate_all_appliance_types),
+        ('recursively_update_dict',
+         lambda: _concatenate_all_appliance_types(
+             get_appliance_types_from_disk(catalogue_filenames)),
+         update_dicts),
+        ('sanity_check_appliances', load_buildings, sanity_check_appliances),
+        ('convert_yaml_to_hdf5', lambda: None, convert),
+    ]
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, setup, function in benchmarks(args, directory):
+            if args.only and name not in args.only:
+                continue
+            arg = setup()
+            # Functions may modify their argument, so each run gets its own
+            # copy.  The copies are made up front so that copying is
+            # neither timed nor traced.
+            copies = [deepcopy(arg) for _ in range(args.repeat + 1)]
+            times = []
+            for copied_arg in copies[:-1]:
+                start = timeit.default_timer()
+                function(copied_arg)
+                times.append(timeit.default_timer() - start)
+            tracemalloc.start()
+            function(copies[-1])
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del copies
+            results[name] = {'time': min(times), 'peak_memory': peak_memory}
+            print("{:<35s} {:10.4f} s {:10.2f} MB".format(
+                name, min(times), peak_memory / 1E6), file=sys.stderr)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns
+    -------
+    list of strings describing each regression.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric in ['time', 'peak_memory']:
+            ratio = result[metric] / max(baseline[name][metric], 1E-9)
+            if ratio > tolerance:
+                regressions.append(
+                    "{} {}: {:.4g} is {:.2f}x baseline {:.4g}".format(
+                        name, metric, result[metric], ratio,
+                        baseline[name][metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--buildings', type=int, default=20)
+    parser.add_argument('--meters', type=int, default=20,
+                        help='ElecMeters per building')
+    parser.add_argument('--appliances', type=int, default=30,
+                        help='appliances per building')
+    parser.add_argument('--catalogue-files', type=int, default=10,
+                        help='synthetic appliance type files to add to'
+                        ' the central catalogue')
+    parser.add_argument('--catalogue-types', type=int, default=100,
+                        help='synthetic appliance types per file')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='names of benchmarks')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='maximum ratio to baseline before a result'
+                        ' counts as a regression')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    scale = {key: getattr(args, key) for key in [
+        'buildings', 'meters', 'appliances', 'catalogue_files',
+        'catalogue_types', 'workers']}
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump({'scale': scale, 'results': results}, fh, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh:
+            json.dump({'scale': scale, 'results': results}, fh, indent=2,
+                      sort_keys=True)
+        print("Saved baseline to", args.baseline, file=sys.stderr)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("No baseline found at", args.baseline, file=sys.stderr)
+        return 0
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    if baseline['scale'] != scale:
+        print("Not comparing with baseline because it was recorded at a"
+              " different scale:", baseline['scale'], file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print("REGRESSION:", regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
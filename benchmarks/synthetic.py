@@ -0,0 +1,96 @@
+"""Generators for synthetic NILM Metadata datasets and appliance type
+catalogues of configurable size, used by the benchmarks."""
+from __future__ import print_function, division
+import os
+import random
+import yaml
+from nilm_metadata.file_management import get_appliance_types_from_disk
+
+
+def write_dataset(yaml_dir, n_buildings, n_meters, n_appliances, seed=0):
+    """Writes dataset.yaml, meter_devices.yaml and `n_buildings` building
+    files, each with `n_meters` ElecMeters and `n_appliances` appliances,
+    to `yaml_dir`."""
+    rng = random.Random(seed)
+    appliance_types = sorted(get_appliance_types_from_disk())
+    if not os.path.isdir(yaml_dir):
+        os.makedirs(yaml_dir)
+
+    _dump(yaml_dir, 'dataset.yaml', {'name': 'SYNTHETIC'})
+    _dump(yaml_dir, 'meter_devices.yaml', {
+        'EnviR': {'model': 'EnviR', 'sample_period': 6,
+                  'max_sample_period': 50,
+                  'measurements': [{'physical_quantity': 'power',
+                                    'type': 'apparent',
+                                    'upper_limit': 25000,
+                                    'lower_limit': 0}]},
+        'SiteMeter': {'model': 'SiteMeter', 'sample_period': 1,
+                      'max_sample_period': 10}})
+
+    for building_i in range(1, n_buildings+1):
+        elec_meters = {1: {'site_meter': True, 'device_model': 'SiteMeter',
+                           'timeframe': {'start': '2013-01-01',
+                                         'end': '2014-01-01'}}}
+        for meter_i in range(2, n_meters+1):
+            elec_meters[meter_i] = {
+                'submeter_of': 1,
+                'device_model': 'EnviR',
+                'timeframe': {'start': '2013-0{:d}-01'.format(
+                    rng.randint(1, 9)), 'end': '2014-01-01'}}
+
+        appliances = []
+        instances = {}
+        for appliance_i in range(n_appliances):
+            appliance_type = rng.choice(appliance_types)
+            instance = instances.get(appliance_type, 0) + 1
+            instances[appliance_type] = instance
+            appliances.append({
+                'type': appliance_type, 'instance': instance,
+                'meters': [rng.randint(min(2, n_meters), n_meters)],
+                'room': 'kitchen'})
+
+        _dump(yaml_dir, 'building{:d}.yaml'.format(building_i), {
+            'instance': building_i,
+            'elec_meters': elec_meters,
+            'appliances': appliances})
+
+
+def write_catalogue(directory, n_types_per_file=100, n_files=10, seed=0):
+    """Writes an inflated appliance type catalogue: the central catalogue
+    plus `n_files` files each containing `n_types_per_file` synthetic
+    types which inherit from (and have components of) real types.
+
+    Returns
+    -------
+    list of filenames
+    """
+    rng = random.Random(seed)
+    central = get_appliance_types_from_disk()
+    names = sorted(central)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    filenames = [_dump(directory, 'central.yaml', central)]
+    for file_i in range(n_files):
+        types = {}
+        for type_i in range(n_types_per_file):
+            types['synthetic {:d} {:d}'.format(file_i, type_i)] = {
+                'parent': rng.choice(names),
+                'categories': {'traditional': rng.choice(['wet', 'cold',
+                                                          'misc'])},
+                'components': [{'type': rng.choice(['light', 'motor'])}],
+                'synonyms': ['synonym {:d}'.format(type_i)],
+                'distributions': {'rooms': [{
+                    'distribution_of_data': {
+                        'categories': ['kitchen', 'utility'],
+                        'values': [0.5, 0.5]}}]}}
+        filenames.append(
+            _dump(directory, 'synthetic{:d}.yaml'.format(file_i), types))
+    return filenames
+
+
+def _dump(directory, fname, obj):
+    filename = os.path.join(directory, fname)
+    with open(filename, 'w') as fh:
+        yaml.safe_dump(obj, fh)
+    return filename
@@ -1,8 +1,46 @@
-from nilm_metadata.object_concatenation import get_appliance_types, recursively_update_dict
-from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5, save_yaml_to_datastore
+import sys
+import types
+from importlib import import_module
+from nilm_metadata.object_concatenation import get_appliance_types, get_appliance_type_registry, recursively_update_dict
+
+# Functions whose modules import pandas (and PyTables).  These modules are
+# only imported when one of the functions is first used, so that
+# `import nilm_metadata` stays cheap for catalogue-only users.
+_LAZY_FUNCTIONS = {
+    'convert_yaml_to_hdf5': 'nilm_metadata.convert_yaml_to_hdf5',
+    'save_yaml_to_datastore': 'nilm_metadata.convert_yaml_to_hdf5',
+}
+
+__all__ = ['get_appliance_types', 'get_appliance_type_registry',
+           'recursively_update_dict', 'get_data'] + sorted(_LAZY_FUNCTIONS)
 
-import os
 
-_ROOT = os.path.abspath(os.path.dirname(__file__))
 def get_data(path):
-    return os.path.join(_ROOT, 'central_metadata', path)
+    from importlib.resources import files
+    return str(files('nilm_metadata').joinpath('central_metadata', path))
+
+
+def __getattr__(name):
+    if name in _LAZY_FUNCTIONS:
+        function = getattr(import_module(_LAZY_FUNCTIONS[name]), name)
+        globals()[name] = function
+        return function
+    raise AttributeError(
+        "module 'nilm_metadata' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_FUNCTIONS))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing the submodule nilm_metadata.convert_yaml_to_hdf5 sets
+        # this package's attribute of the same name to the submodule.
+        # Keep the function instead, as eager imports used to.
+        if name in _LAZY_FUNCTIONS and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super(_Package, self).__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,139 @@
+from __future__ import print_function, division
+from six import iteritems
+
+
+class ApplianceTypeIndex(object):
+    """Inverted indexes over a concatenated appliance type catalogue.
+
+    Every lookup is a dict access so costs O(1) (or O(k) to build
+    the answer) rather than a scan over every appliance type.  All
+    returned collections are frozensets so the index cannot be
+    modified by callers.
+
+    Parameters
+    ----------
+    appliance_types : dict
+        Concatenated appliance types, as returned by `get_appliance_types()`.
+        Not modified and no reference to it is kept.
+    """
+
+    def __init__(self, appliance_types):
+        self._names = frozenset(appliance_types)
+        synonyms = {}
+        categories = {}
+        category_values = {}
+        parents = {}
+        components = {}
+
+        for name, appliance_type in iteritems(appliance_types):
+            for synonym in appliance_type.get('synonyms', []):
+                synonyms.setdefault(synonym, set()).add(name)
+
+            for category, values in iteritems(
+                    appliance_type.get('categories', {})):
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    categories.setdefault((category, value), set()).add(name)
+                    category_values.setdefault(value, set()).add(name)
+
+            parent = appliance_type.get('parent')
+            if parent is not None:
+                parents[name] = parent
+
+            for component in appliance_type.get('components', []):
+                components.setdefault(component['type'], set()).add(name)
+
+        descendants = {}
+        for name in parents:
+            ancestor = parents[name]
+            while ancestor is not None:
+                descendants.setdefault(ancestor, set()).add(name)
+                ancestor = parents.get(ancestor)
+
+        self._synonyms = _freeze(synonyms)
+        self._categories = _freeze(categories)
+        self._category_values = _freeze(category_values)
+        self._parents = parents
+        self._descendants = _freeze(descendants)
+        self._owners = _freeze(components)
+
+    def __contains__(self, appliance_type_name):
+        return appliance_type_name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        """frozenset of all appliance type names."""
+        return self._names
+
+    def lookup(self, name):
+        """
+        Parameters
+        ----------
+        name : string
+            An appliance type name or a synonym.
+
+        Returns
+        -------
+        frozenset of appliance type names.  If `name` is itself an appliance
+        type then only `name` is returned.  Otherwise all types which list
+        `name` as a synonym are returned (possibly none).
+        """
+        if name in self._names:
+            return frozenset([name])
+        return self._synonyms.get(name, frozenset())
+
+    def types_for_synonym(self, synonym):
+        """frozenset of appliance types which list `synonym` as a synonym."""
+        return self._synonyms.get(synonym, frozenset())
+
+    def types_in_category(self, value, category=None):
+        """
+        Parameters
+        ----------
+        value : string
+            e.g. 'cold'
+        category : string, optional
+            e.g. 'traditional'.  If None then match `value` in any category.
+
+        Returns
+        -------
+        frozenset of appliance type names.
+        """
+        if category is None:
+            return self._category_values.get(value, frozenset())
+        return self._categories.get((category, value), frozenset())
+
+    def ancestors(self, appliance_type_name):
+        """
+        Returns
+        -------
+        list of ancestor names, starting with the parent of
+        `appliance_type_name` and ending with the root type.
+        """
+        ancestors = []
+        ancestor = self._parents.get(appliance_type_name)
+        while ancestor is not None:
+            ancestors.append(ancestor)
+            ancestor = self._parents.get(ancestor)
+        return ancestors
+
+    def descendants(self, appliance_type_name):
+        """frozenset of all (direct and indirect) children of a type."""
+        return self._descendants.get(appliance_type_name, frozenset())
+
+    def is_a(self, appliance_type_name, ancestor):
+        """True if `appliance_type_name` is `ancestor` or descends from it."""
+        return (appliance_type_name == ancestor or
+                appliance_type_name in self.descendants(ancestor))
+
+    def owners_of_component(self, component_type_name):
+        """frozenset of appliance types which have `component_type_name`
+        as a component."""
+        return self._owners.get(component_type_name, frozenset())
+
+
+def _freeze(dict_of_sets):
+    return {key: frozenset(value) for key, value in iteritems(dict_of_sets)}
@@ -0,0 +1,295 @@
+"""Convert many NILM Metadata YAML datasets to HDF5 in one job.
+
+Usage from the command line::
+
+    nilm_metadata_batch REDD/metadata redd.h5 UKDALE/metadata ukdale.h5
+    nilm_metadata_batch --jobs-file jobs.txt --workers 8 --incremental
+"""
+from __future__ import print_function, division
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+import pandas as pd
+from nilm_metadata.object_concatenation import get_appliance_type_registry
+from nilm_metadata.convert_yaml_to_hdf5 import (
+    convert_yaml_to_hdf5, _find_building_filenames)
+
+DatasetResult = namedtuple(
+    'DatasetResult', ['yaml_dir', 'hdf_filename', 'error', 'seconds'])
+
+
+class BatchReport(object):
+    """The outcome of every conversion run by `convert_datasets`.
+
+    Attributes
+    ----------
+    results : list of DatasetResult namedtuples
+        (yaml_dir, hdf_filename, error, seconds), in the order the
+        datasets were given.  `error` is None if the conversion succeeded
+        or else the error message.
+    """
+
+    def __init__(self, results=None):
+        self.results = list(results or [])
+
+    def __bool__(self):
+        """True if every conversion succeeded."""
+        return not self.failed()
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def succeeded(self):
+        return [result for result in self.results if result.error is None]
+
+    def failed(self):
+        return [result for result in self.results
+                if result.error is not None]
+
+    def __str__(self):
+        lines = ["{:d} of {:d} dataset(s) converted successfully."
+                 .format(len(self.succeeded()), len(self.results))]
+        for result in self.results:
+            status = 'OK' if result.error is None else 'FAILED'
+            lines.append("* [{}] {} -> {} ({:.2f}s)".format(
+                status, result.yaml_dir, result.hdf_filename,
+                result.seconds))
+            if result.error is not None:
+                lines.extend('    ' + line
+                             for line in result.error.splitlines())
+        return '\n'.join(lines)
+
+    def to_frame(self):
+        """
+        Returns
+        -------
+        pd.DataFrame with one row per dataset.
+        """
+        return pd.DataFrame(self.results, columns=DatasetResult._fields)
+
+    def to_dict(self):
+        return {'n_datasets': len(self.results),
+                'n_failed': len(self.failed()),
+                'results': [result._asdict() for result in self.results]}
+
+
+def convert_datasets(jobs, workers=None, incremental=False, sidecar=False):
+    """Converts many NILM Metadata YAML datasets to HDF5.
+
+    The appliance type catalogue is built once, in this process, before
+    any worker processes are started.  Where the 'fork' start method is
+    available the workers inherit the built catalogue; otherwise each
+    worker builds it once (from the compiled cache) when it starts.
+
+    If there are at least as many datasets as `workers` then whole
+    datasets are scheduled across one pool of worker processes, largest
+    (by size of building YAML files) first: each worker converts one
+    dataset at a time and writes its HDF5 file, so no worker waits for
+    another dataset's file to be written.  Otherwise there are too few
+    datasets to keep the pool busy, so the datasets are converted one
+    after another and the buildings of each are loaded and sanity
+    checked in the shared pool while this process writes the HDF5 file.
+
+    An invalid dataset does not stop the batch: its error is recorded in
+    the report and the next dataset is converted.
+
+    Parameters
+    ----------
+    jobs : list of (yaml_dir, hdf_filename) pairs
+    workers : int, optional
+        Size of the shared process pool.  If None or 1 then every
+        dataset is converted serially in this process.
+    incremental, sidecar : bool, optional
+        See `convert_yaml_to_hdf5`.
+
+    Returns
+    -------
+    BatchReport
+    """
+    jobs = list(jobs)
+    get_appliance_type_registry().names()  # build the catalogue once
+    if workers is not None and workers > 1 and len(jobs) >= workers:
+        results = _convert_datasets_in_pool(jobs, workers, incremental,
+                                            sidecar)
+    else:
+        results = _convert_buildings_in_pool(jobs, workers, incremental,
+                                             sidecar)
+    return BatchReport(results)
+
+
+def _convert_datasets_in_pool(jobs, workers, incremental, sidecar):
+    """Converts each dataset in a worker process.
+
+    Returns
+    -------
+    list of DatasetResults, in the order of `jobs`.
+    """
+    results = [None] * len(jobs)
+    pending = deque(sorted(range(len(jobs)),
+                           key=lambda i: _dataset_size(jobs[i][0]),
+                           reverse=True))
+    running = {}  # maps future to (job index, start time)
+    executor = _make_executor(workers)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                i = pending.popleft()
+                future = executor.submit(_convert_dataset, *jobs[i],
+                                         incremental=incremental,
+                                         sidecar=sidecar)
+                running[future] = (i, perf_counter())
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                i, start = running.pop(future)
+                try:
+                    results[i] = future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    results[i] = _failed(jobs[i], e, start)
+            if broken:
+                # Every dataset still running in the pool was lost.
+                for future, (i, start) in running.items():
+                    results[i] = _failed(
+                        jobs[i], BrokenProcessPool('process pool broken'),
+                        start)
+                running.clear()
+                executor.shutdown(wait=False)
+                executor = _make_executor(workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _convert_buildings_in_pool(jobs, workers, incremental, sidecar):
+    """Converts the datasets one after another, loading buildings in a
+    process pool if `workers` > 1.
+
+    Returns
+    -------
+    list of DatasetResults, in the order of `jobs`.
+    """
+    executor = None
+    results = []
+    try:
+        for yaml_dir, hdf_filename in jobs:
+            if executor is None and workers is not None and workers > 1:
+                executor = _make_executor(workers)
+            start = perf_counter()
+            try:
+                result = _convert_dataset(
+                    yaml_dir, hdf_filename, incremental=incremental,
+                    sidecar=sidecar, executor=executor, workers=workers)
+            except BrokenProcessPool as e:
+                result = _failed((yaml_dir, hdf_filename), e, start)
+                executor.shutdown(wait=False)
+                executor = None  # start a new pool for the next job
+            results.append(result)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _convert_dataset(yaml_dir, hdf_filename, **kwargs):
+    """Runs `convert_yaml_to_hdf5` and records the outcome.  Only
+    BrokenProcessPool is raised, because it affects other datasets.
+
+    Returns
+    -------
+    DatasetResult
+    """
+    start = perf_counter()
+    try:
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, **kwargs)
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        return _failed((yaml_dir, hdf_filename), e, start)
+    return DatasetResult(yaml_dir, hdf_filename, None,
+                         perf_counter() - start)
+
+
+def _failed(job, exception, start):
+    error = '{}: {}'.format(type(exception).__name__, exception)
+    return DatasetResult(job[0], job[1], error, perf_counter() - start)
+
+
+def _dataset_size(yaml_dir):
+    """Total size in bytes of the building YAML files in `yaml_dir`."""
+    try:
+        return sum(os.path.getsize(os.path.join(yaml_dir, fname))
+                   for fname in _find_building_filenames(yaml_dir))
+    except OSError:
+        return 0
+
+
+def _make_executor(workers):
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'))
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=_build_catalogue)
+
+
+def _build_catalogue():
+    get_appliance_type_registry().names()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert many NILM Metadata YAML datasets to HDF5.")
+    parser.add_argument(
+        'paths', nargs='*', metavar='YAML_DIR HDF_FILENAME',
+        help="Pairs of YAML directory and output HDF5 filename.")
+    parser.add_argument(
+        '--jobs-file',
+        help="File listing one 'YAML_DIR HDF_FILENAME' pair per line.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes.")
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--sidecar', action='store_true')
+    parser.add_argument('--json', dest='json_filename',
+                        help="Also write the report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    if len(args.paths) % 2:
+        parser.error("paths must be pairs of YAML_DIR HDF_FILENAME")
+    jobs = list(zip(args.paths[::2], args.paths[1::2]))
+    if args.jobs_file:
+        with open(args.jobs_file) as fh:
+            for line in fh:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    job = line.rsplit(None, 1)
+                    if len(job) != 2:
+                        parser.error("bad line in {}: '{}'"
+                                     .format(args.jobs_file, line))
+                    jobs.append(tuple(job))
+    if not jobs:
+        parser.error("no datasets given")
+
+    report = convert_datasets(jobs, workers=args.workers,
+                              incremental=args.incremental,
+                              sidecar=args.sidecar)
+    print(report)
+    if args.json_filename:
+        with open(args.json_filename, 'w') as fh:
+            json.dump(report.to_dict(), fh, indent=2)
+    return 0 if report else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,52 @@
 from __future__ import print_function, division
-import yaml
+import re
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from itertools import islice
 from os.path import isdir, isfile, join, splitext
-from os import listdir
+from os import listdir, cpu_count
 from sys import stderr
-from copy import deepcopy
-from six import iteritems
-from nilm_metadata.object_concatenation import get_appliance_types
-
-
-class NilmMetadataError(Exception):
-    pass
-
-
-def convert_yaml_to_hdf5(yaml_dir, hdf_filename):
+from nilm_metadata.file_management import (
+    load_yaml, get_appliance_types_hash, _read_file)
+from nilm_metadata.streaming import load_building
+from nilm_metadata.records import load_building_records
+from nilm_metadata.validation import (
+    NilmMetadataError, ValidationReport, validate_buildings,
+    validate_dataset_metadata)
+from nilm_metadata.sidecar import (
+    write_metadata_sidecar, remove_metadata_sidecar)
+from nilm_metadata.wiring import WiringTree
+from nilm_metadata.pipeline import Pipeline
+from nilm_metadata.interning import InternTable, INTERN_TABLE_ATTR
+from nilm_metadata.export import read_store_metadata
+from nilm_metadata.timeframe_index import (
+    TimeframeIndex, TIMEFRAME_INDEX_KEY)
+from nilm_metadata.profiling import phase, profiled
+
+# Name of the HDF5 root attribute in which convert_yaml_to_hdf5 records
+# the hashes of the files used for the conversion.
+HASHES_ATTR = 'nilm_metadata_hashes'
+APPLIANCE_TYPES_HASH_KEY = '<appliance_types>'
+# Whether the metadata was interned, so that incremental conversions
+# rewrite everything when `intern` changes.
+INTERNED_HASH_KEY = '<interned>'
+
+
+@profiled('convert_yaml_to_hdf5')
+def convert_yaml_to_hdf5(yaml_dir, hdf_filename, workers=None,
+                         incremental=False, sidecar=False, pipeline=False,
+                         executor=None, intern=False,
+                         index_timeframes=False):
     """Converts a NILM Metadata YAML instance to HDF5.
 
     Also does a set of sanity checks on the metadata.
 
+    Each building's group gets a 'metadata' attribute and a 'wiring'
+    attribute: the `wiring.WiringTree` of its meters, stored as
+    `WiringTree.to_dict()`.
+
     Parameters
     ----------
     yaml_dir : str
@@ -26,41 +55,148 @@ def convert_yaml_to_hdf5(yaml_dir, hdf_filename):
         Filename and path of output HDF5 file.  If file exists then will
         attempt to append metadata to file.  If file does not exist then
         will create it.
+    workers : int, optional
+        Number of processes used to load and sanity check buildings.
+        If None or 1 (the default) then buildings are processed serially.
+        Whatever the number of workers, buildings are written in order of
+        building number and, if any buildings are invalid, the error for
+        the lowest-numbered invalid building is raised.
+    pipeline : bool, optional
+        If True (and `workers` is None or 1) then reading, parsing and
+        checking buildings run in separate threads connected by bounded
+        queues, overlapping with each other and with writing to HDF5.
+        Per-stage timings are printed at the end.
+    incremental : bool, optional
+        The SHA1 hash of every YAML file (and of the appliance type
+        catalogue) is always recorded in the root attribute
+        `HASHES_ATTR`.  If `incremental` is True then buildings whose
+        YAML file, `meter_devices.yaml` and the appliance type catalogue
+        are all unchanged since the last conversion are skipped, and the
+        metadata of buildings whose YAML file has since been deleted is
+        removed (along with the building's group, if it is empty).
+    sidecar : bool, optional
+        If True then also write a memory-mappable metadata sidecar file
+        next to `hdf_filename` (see `sidecar.MetadataSidecar`).  Any
+        existing sidecar is removed before the HDF5 file is modified, so
+        with `sidecar=False` a sidecar from an earlier conversion never
+        goes stale.
+    executor : concurrent.futures.Executor, optional
+        A process pool, shared with other conversions, in which to load
+        and sanity check buildings (see `batch.convert_datasets`).
+        Overrides `pipeline`, and `workers` then only bounds the number
+        of buildings in flight (to twice `workers`, or twice the number
+        of CPUs if `workers` is None).  Not shut down.
+    intern : bool, optional
+        If True then nested dicts and lists of meter devices, ElecMeters
+        and Appliances are stored once, in the root attribute
+        `interning.INTERN_TABLE_ATTR`, and each 'metadata' attribute holds
+        references to them (see `interning.InternTable`).  Read the
+        metadata with `export.read_hdf5_metadata` to rehydrate it.
+        Readers which expect plain dicts (e.g. NILMTK) need the default,
+        False, which also removes any table left by an earlier conversion.
+    index_timeframes : bool, optional
+        If True then build a `timeframe_index.TimeframeIndex` of every
+        building and meter in the file, store it under
+        `timeframe_index.TIMEFRAME_INDEX_KEY` (read it back with
+        `timeframe_index.read_timeframe_index`) and print a summary of
+        the gaps between meter timeframes.  If False then any stored
+        index, which may now be stale, is removed.
+
+    Set the environment variable NILM_METADATA_PROFILE to get a JSON
+    summary of where the time went (see `nilm_metadata.profiling`).
     """
 
     assert isdir(yaml_dir)
-    store = pd.HDFStore(hdf_filename, 'a')
-
-    # Load Dataset and MeterDevice metadata
-    metadata = _load_file(yaml_dir, 'dataset.yaml')
-    meter_devices = _load_file(yaml_dir, 'meter_devices.yaml')
-    metadata['meter_devices'] = meter_devices
-    store.root._v_attrs.metadata = metadata
-
-    # Load buildings
-    building_filenames = [fname for fname in listdir(yaml_dir)
-                          if fname.startswith('building')
-                          and fname.endswith('.yaml')]
+    building_filenames = _find_building_filenames(yaml_dir)
+    hashes = _hash_files(
+        yaml_dir, ['dataset.yaml', 'meter_devices.yaml'] + building_filenames)
+    hashes[APPLIANCE_TYPES_HASH_KEY] = get_appliance_types_hash()
+    hashes[INTERNED_HASH_KEY] = str(bool(intern))
 
-    for fname in building_filenames:
-        building = splitext(fname)[0]  # e.g. 'building1'
-        try:
-            group = store._handle.create_group('/', building)
-        except:
-            group = store._handle.get_node('/' + building)
-        building_metadata = _load_file(yaml_dir, fname)
-        elec_meters = building_metadata['elec_meters']
-        _deep_copy_meters(elec_meters)
-        _set_data_location(elec_meters, building)
-        _sanity_check_meters(elec_meters, meter_devices)
-        _sanity_check_appliances(building_metadata)
-        group._f_setattr('metadata', building_metadata)
-
-    store.close()
+    remove_metadata_sidecar(hdf_filename)
+    store = pd.HDFStore(hdf_filename, 'a')
+    try:
+        old_hashes = (getattr(store.root._v_attrs, HASHES_ATTR, {})
+                      if incremental else {})
+
+        def unchanged(*fnames):
+            return all(fname in old_hashes and
+                       old_hashes[fname] == hashes[fname]
+                       for fname in fnames)
+
+        # Content-addressed, so keep every object already stored: buildings
+        # which are not rewritten may refer to them.
+        intern_table = InternTable(
+            getattr(store.root._v_attrs, INTERN_TABLE_ATTR, None))
+
+        def prepare(metadata, intern_function):
+            if not intern:
+                return metadata
+            with phase('intern'):
+                return intern_function(metadata)
+
+        # Load Dataset and MeterDevice metadata
+        metadata = _load_file(yaml_dir, 'dataset.yaml')
+        meter_devices = _load_file(yaml_dir, 'meter_devices.yaml')
+        validate_dataset_metadata(metadata, meter_devices).raise_if_invalid()
+        metadata['meter_devices'] = meter_devices
+        if not unchanged('dataset.yaml', 'meter_devices.yaml',
+                         INTERNED_HASH_KEY):
+            metadata = prepare(metadata, intern_table.intern_dataset)
+            with phase('write_hdf5'):
+                store.root._v_attrs.metadata = metadata
+
+        # Load buildings
+        if incremental:
+            n_buildings = len(building_filenames)
+            building_filenames = [
+                fname for fname in building_filenames
+                if not (unchanged(fname, 'meter_devices.yaml',
+                                  APPLIANCE_TYPES_HASH_KEY,
+                                  INTERNED_HASH_KEY) and
+                        _has_metadata(store, splitext(fname)[0]))]
+            print("Skipping {:d} unchanged building(s)."
+                  .format(n_buildings - len(building_filenames)))
+            _remove_deleted_buildings(
+                store, set(old_hashes) - set(hashes))
+
+        for building, building_metadata in _load_buildings(
+                yaml_dir, building_filenames, meter_devices, workers,
+                pipeline, executor):
+            wiring = WiringTree(building_metadata['elec_meters'],
+                                building_metadata.get('instance'))
+            building_metadata = prepare(building_metadata,
+                                        intern_table.intern_building)
+            with phase('write_hdf5'):
+                try:
+                    group = store._handle.create_group('/', building)
+                except:
+                    group = store._handle.get_node('/' + building)
+                group._f_setattr('metadata', building_metadata)
+                group._f_setattr('wiring', wiring.to_dict())
+
+        with phase('write_hdf5'):
+            if intern:
+                setattr(store.root._v_attrs, INTERN_TABLE_ATTR,
+                        intern_table.objects)
+            elif INTERN_TABLE_ATTR in store.root._v_attrs._f_list():
+                # Every building has just been rewritten without references
+                # (changing `intern` defeats incremental skipping).
+                delattr(store.root._v_attrs, INTERN_TABLE_ATTR)
+        _write_timeframe_index(store, index_timeframes)
+        # Only record hashes once every building has been written.
+        setattr(store.root._v_attrs, HASHES_ATTR, hashes)
+    finally:
+        with phase('write_hdf5'):
+            store.close()
+
+    if sidecar:
+        write_metadata_sidecar(hdf_filename)
     print("Done converting YAML metadata to HDF5!")
 
 
-def save_yaml_to_datastore(yaml_dir, store):
+@profiled('save_yaml_to_datastore')
+def save_yaml_to_datastore(yaml_dir, store, workers=None, pipeline=False):
     """Saves a NILM Metadata YAML instance to a NILMTK datastore.
 
     Parameters
@@ -69,6 +205,11 @@ def save_yaml_to_datastore(yaml_dir, store):
         Directory path of all *.YAML files describing this dataset.
     store : DataStore
         DataStore object
+    workers : int, optional
+        Number of processes used to load and sanity check buildings.
+        See `convert_yaml_to_hdf5`.
+    pipeline : bool, optional
+        See `convert_yaml_to_hdf5`.
     """
 
     assert isdir(yaml_dir)
@@ -77,67 +218,250 @@ def save_yaml_to_datastore(yaml_dir, store):
     metadata = _load_file(yaml_dir, 'dataset.yaml')
     print("Loaded metadata")
     meter_devices = _load_file(yaml_dir, 'meter_devices.yaml')
+    validate_dataset_metadata(metadata, meter_devices).raise_if_invalid()
     metadata['meter_devices'] = meter_devices
-    store.save_metadata('/', metadata)
+    with phase('write_hdf5'):
+        store.save_metadata('/', metadata)
 
     # Load buildings
+    building_filenames = _find_building_filenames(yaml_dir)
+    for building, building_metadata in _load_buildings(
+            yaml_dir, building_filenames, meter_devices, workers, pipeline):
+        with phase('write_hdf5'):
+            store.save_metadata('/'+building, building_metadata)
+
+    with phase('write_hdf5'):
+        store.close()
+    print("Done converting YAML metadata to HDF5!")
+
+
+def validate_dataset(yaml_dir):
+    """Loads and checks every building in a NILM Metadata YAML directory.
+
+    Unlike `convert_yaml_to_hdf5`, which stops at the first invalid
+    building, this reports every problem in the whole dataset at once.
+    Buildings are held as `records.BuildingRecords` until they are
+    checked, so the whole dataset fits in memory even with tens of
+    thousands of meters.
+
+    Parameters
+    ----------
+    yaml_dir : str
+        Directory path of all *.YAML files describing this dataset.
+
+    Returns
+    -------
+    validation.ValidationReport
+    """
+    assert isdir(yaml_dir)
+    dataset_metadata = _load_file(yaml_dir, 'dataset.yaml')
+    meter_devices = _load_file(yaml_dir, 'meter_devices.yaml')
+    buildings = {}
+    for fname in _find_building_filenames(yaml_dir):
+        with open(join(yaml_dir, fname), 'rb') as fh:
+            buildings[splitext(fname)[0]] = load_building_records(fh)
+    return ValidationReport(
+        list(validate_dataset_metadata(dataset_metadata, meter_devices)) +
+        list(validate_buildings(buildings, meter_devices)))
+
+
+def _find_building_filenames(yaml_dir):
+    """
+    Returns
+    -------
+    list of building filenames (e.g. 'building1.yaml') in `yaml_dir`,
+    sorted by building number.
+    """
     building_filenames = [fname for fname in listdir(yaml_dir)
                           if fname.startswith('building')
                           and fname.endswith('.yaml')]
 
-    for fname in building_filenames:
-        building = splitext(fname)[0]  # e.g. 'building1'
-        building_metadata = _load_file(yaml_dir, fname)
-        elec_meters = building_metadata['elec_meters']
-        _deep_copy_meters(elec_meters)
-        _set_data_location(elec_meters, building)
-        _sanity_check_meters(elec_meters, meter_devices)
-        _sanity_check_appliances(building_metadata)
-        store.save_metadata('/'+building, building_metadata)
-
-    store.close()
-    print("Done converting YAML metadata to HDF5!")
+    def sort_key(fname):
+        digits = re.findall(r'\d+', fname)
+        return (int(digits[0]) if digits else -1, fname)
 
+    return sorted(building_filenames, key=sort_key)
 
-def _load_file(yaml_dir, yaml_filename):
-    yaml_full_filename = join(yaml_dir, yaml_filename)
-    if isfile(yaml_full_filename):
-        with open(yaml_full_filename, 'rb') as fh:
-            return yaml.safe_load(fh)
-    else:
-        print(yaml_full_filename, "not found.", file=stderr)
 
+def _hash_files(yaml_dir, fnames):
+    """
+    Returns
+    -------
+    dict mapping each filename in `fnames` to the SHA1 hex digest of its
+    contents.  Files which do not exist are omitted.
+    """
+    hashes = {}
+    with phase('hash_files'):
+        for fname in fnames:
+            full_filename = join(yaml_dir, fname)
+            if isfile(full_filename):
+                with open(full_filename, 'rb') as fh:
+                    hashes[fname] = sha1(fh.read()).hexdigest()
+    return hashes
+
+
+def _has_metadata(store, building):
+    try:
+        group = store._handle.get_node('/' + building)
+    except Exception:
+        return False
+    return 'metadata' in group._v_attrs._f_list()
+
+
+def _write_timeframe_index(store, index_timeframes):
+    """Rebuilds the timeframe index from every building in `store`,
+    including those skipped by an incremental conversion, or removes it."""
+    if not index_timeframes:
+        if TIMEFRAME_INDEX_KEY in store:
+            with phase('write_hdf5'):
+                store.remove(TIMEFRAME_INDEX_KEY)
+        return
+    with phase('index_timeframes'):
+        dataset_metadata, buildings = read_store_metadata(store)
+        index = TimeframeIndex(buildings, dataset_metadata)
+    with phase('write_hdf5'):
+        index.write(store)
+    statistics = index.statistics
+    print("Indexed the timeframes of {:d} meter(s) in {:d} building(s)."
+          .format(len(index.meters), len(index.buildings)))
+    for building, row in statistics[statistics['n_gaps'] > 0].iterrows():
+        print("{}: {:d} gap(s) between meter timeframes, the longest {}."
+              .format(building, row['n_gaps'], row['longest_gap']))
+
+
+def _remove_deleted_buildings(store, deleted_fnames):
+    """Removes the metadata of buildings whose YAML files have been deleted.
+    Groups are only removed if they contain no other nodes (e.g. data)."""
+    for fname in sorted(deleted_fnames):
+        if not fname.startswith('building'):
+            continue
+        building = splitext(fname)[0]
+        try:
+            group = store._handle.get_node('/' + building)
+        except Exception:
+            continue
+        for attr in ['metadata', 'wiring']:
+            if attr in group._v_attrs._f_list():
+                group._f_delattr(attr)
+        if not group._v_children:
+            group._f_remove()
+        print("Removed metadata for deleted", building)
+
+
+def _load_buildings(yaml_dir, building_filenames, meter_devices,
+                    workers=None, pipeline=False, executor=None):
+    """Loads and sanity checks buildings, in `executor` if given, in a
+    process pool if `workers` > 1 or in a threaded pipeline if `pipeline`
+    is True.
+
+    Returns
+    -------
+    generator of (building, building_metadata) tuples, in the same order
+    as `building_filenames`.  Exceptions raised while loading a building
+    are re-raised when that building is reached.
+    """
+    use_pool = (workers is not None and workers > 1 and
+                len(building_filenames) > 1)
+    if executor is not None or use_pool:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        # Only a bounded window of buildings is in flight, and each future
+        # is dropped once its result has been yielded, so that the whole
+        # dataset's metadata is never held in this process at once.
+        window = 2 * (workers or cpu_count() or 1)
+        pending = iter(building_filenames)
+        futures = deque()
+        try:
+            for fname in islice(pending, window):
+                futures.append(executor.submit(
+                    _load_building, yaml_dir, fname, meter_devices))
+            while futures:
+                result = futures.popleft().result()
+                for fname in islice(pending, 1):
+                    futures.append(executor.submit(
+                        _load_building, yaml_dir, fname, meter_devices))
+                yield result
+                del result
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                for future in futures:
+                    future.cancel()
+
+    elif pipeline:
+        def read(fname):
+            return fname, _read_file(join(yaml_dir, fname))
+
+        def parse(fname_and_text):
+            fname, text = fname_and_text
+            building = splitext(fname)[0]
+            return building, load_building(text, building)
+
+        def check(building_and_metadata):
+            building, building_metadata = building_and_metadata
+            _check_building(building, building_metadata, meter_devices)
+            return building, building_metadata
+
+        building_pipeline = Pipeline(
+            [('read', read), ('parse', parse), ('check', check)])
+        for building in building_pipeline.run(building_filenames):
+            yield building
+        for stats in building_pipeline.stats:
+            print(stats)
+
+    else:
+        for fname in building_filenames:
+            yield _load_building(yaml_dir, fname, meter_devices)
 
-def _deep_copy_meters(elec_meters):
-    for meter_instance, meter in iteritems(elec_meters):
-        elec_meters[meter_instance] = deepcopy(meter)
 
+def _load_building(yaml_dir, fname, meter_devices):
+    """Loads one building's metadata, sets the data locations of its meters
+    and sanity checks it.
 
-def _set_data_location(elec_meters, building):
-    """Goes through each ElecMeter in elec_meters and sets `data_location`.
-    Modifies `elec_meters` in place.
+    The file is parsed one ElecMeter or Appliance at a time (see
+    `streaming.load_building`) so that the YAML node graph of a building
+    with tens of thousands of meters is never held in memory all at once.
 
-    Parameters
-    ----------
-    elec_meters : dict of dicts
-    building : string e.g. 'building1'
+    Returns
+    -------
+    (building, building_metadata) where building is e.g. 'building1'.
     """
-    for meter_instance in elec_meters:
-        data_location = '/{:s}/elec/meter{:d}'.format(building, meter_instance)
-        elec_meters[meter_instance]['data_location'] = data_location
+    building = splitext(fname)[0]  # e.g. 'building1'
+    with open(join(yaml_dir, fname), 'rb') as fh:
+        building_metadata = load_building(fh, building)
+    _check_building(building, building_metadata, meter_devices)
+    return building, building_metadata
+
+
+def _check_building(building, building_metadata, meter_devices):
+    """Raises NilmMetadataError if the building's metadata is invalid.
+    Rules such as the wiring tree span the whole building so are checked
+    once all its records have been loaded."""
+    validate_buildings({building: building_metadata},
+                       meter_devices).raise_if_invalid()
+
+
+def _load_file(yaml_dir, yaml_filename):
+    yaml_full_filename = join(yaml_dir, yaml_filename)
+    if isfile(yaml_full_filename):
+        return load_yaml(_read_file(yaml_full_filename))
+    else:
+        print(yaml_full_filename, "not found.", file=stderr)
 
 
 def _sanity_check_meters(meters, meter_devices):
     """
     Checks:
     * Make sure all meter devices map to meter_device keys
-    * Makes sure all IDs are unique
-    """
-    if len(meters) != len(set(meters)):
-        raise NilmMetadataError("elec_meters not unique")
 
-    for meter_instance, meter in iteritems(meters):
-        assert meter['device_model'] in meter_devices
+    Raises
+    ------
+    NilmMetadataError listing every problem found.
+    """
+    validate_buildings({'building': {'elec_meters': meters}},
+                       meter_devices).raise_if_invalid()
 
 
 def _sanity_check_appliances(building_metadata):
@@ -145,67 +469,10 @@ def _sanity_check_appliances(building_metadata):
     Checks:
     * Make sure we use proper NILM Metadata names.
     * Make sure there aren't multiple appliance types with same instance
+
+    Raises
+    ------
+    NilmMetadataError listing every problem found.
     """
-    appliances = building_metadata['appliances']
-    appliance_types = get_appliance_types()
-    building_instance = building_metadata['instance']
-    REQUIRED_KEYS = ['type', 'instance', 'meters']
-
-    for appliance in appliances:
-        if not isinstance(appliance, dict):
-            raise NilmMetadataError(
-                "Appliance '{}' is {} when it should be a dict."
-                .format(appliance, type(appliance)))
-
-        # Generate string for specifying which is the problematic
-        # appliance for error messages:
-        appl_string = ("ApplianceType '{}', instance '{}', in building {:d}"
-                       .format(appliance.get('type'),
-                               appliance.get('instance'),
-                               building_instance))
-
-        # Check required keys are all present
-        for key in REQUIRED_KEYS:
-            if key not in appliance:
-                raise NilmMetadataError("key '{}' missing for {}"
-                                        .format(key, appl_string))
-
-        appl_type = appliance['type']
-
-        # check all appliance names are valid
-        if appl_type not in appliance_types:
-            raise NilmMetadataError(
-                appl_string + " not in appliance_types."
-                "  In other words, '{}' is not a recognised appliance type."
-                .format(appl_type))
-
-        # Check appliance references valid meters
-        meters = appliance['meters']
-        if len(meters) != len(set(meters)):
-            msg = "In {}, meters '{}' not unique.".format(appl_string, meters)
-            raise NilmMetadataError(msg)
-
-        for meter in meters:
-            if meter != 0 and meter not in building_metadata['elec_meters']:
-                msg = ("In ({}), meter '{:d}' is not in"
-                       " this building's 'elec_meters'"
-                       .format(appl_string, meter))
-                raise NilmMetadataError(msg)
-
-    # Check list of instances for each appliance is valid.
-    appliance_instances = {}
-    for appliance in appliances:
-        appl_type = appliance['type']
-        instances = appliance_instances.setdefault(appl_type, [])
-        instances.append(appliance['instance'])
-
-    for appliance_type, instances in iteritems(appliance_instances):
-        instances.sort()
-        correct_instances = list(range(1, len(instances)+1))
-        if instances != correct_instances:
-            msg = ("In building {:d}, appliance '{}' appears {:d} time(s)."
-                   " Yet the list of instances is '{}'.  The list of instances"
-                   " should be '{}'."
-                   .format(building_metadata['instance'], appliance_type,
-                           len(instances), instances, correct_instances))
-            raise NilmMetadataError(msg)
+    building = 'building{}'.format(building_metadata.get('instance'))
+    validate_buildings({building: building_metadata}).raise_if_invalid()
@@ -0,0 +1,170 @@
+from __future__ import print_function, division
+import numpy as np
+from six import iteritems
+
+
+class CategoricalDistributionTable(object):
+    """One categorical distribution (e.g. 'rooms') for every appliance
+    type, compiled into a dense NumPy array for vectorized lookups.
+
+    For each appliance type the nearest distribution wins: the one with
+    the smallest 'distance' (as tagged by the concatenation code), with
+    ties going to the first in the list.  Distributions without
+    'distribution_of_data: categories' (e.g. histograms over bin_edges)
+    and those whose categories and values differ in length are ignored.
+
+    Each chosen distribution is normalised over `categories`: if its
+    values sum to less than 1 then the remaining mass is shared equally
+    between the categories it does not mention, as described in the
+    Prior schema; otherwise the values are scaled to sum to 1.
+
+    Parameters
+    ----------
+    appliance_types : dict
+        Concatenated appliance types, e.g. from `get_appliance_types()`.
+    distribution_name : str
+        Key in each appliance type's 'distributions' dict.
+    categories : list of strings, optional
+        All possible categories.  Defaults to every category mentioned in
+        any of the chosen distributions.
+
+    Attributes
+    ----------
+    appliance_types : np.ndarray of str, sorted
+    categories : np.ndarray of str, sorted
+    probabilities : np.ndarray of float, shape (n_appliance_types,
+        n_categories).  Rows of appliance types without a distribution are
+        NaN.
+    distance : np.ndarray of int; -1 for appliance types without a
+        distribution.
+    from_appliance_type : np.ndarray of str; the appliance type each
+        distribution was inherited from ('' if none).
+    """
+
+    def __init__(self, appliance_types, distribution_name='rooms',
+                 categories=None):
+        self.distribution_name = distribution_name
+        names = sorted(appliance_types)
+        chosen = [_nearest_categorical(
+            appliance_types[name].get('distributions', {})
+            .get(distribution_name, []))
+            for name in names]
+
+        if categories is None:
+            categories = set()
+            for dist in chosen:
+                if dist is not None:
+                    categories.update(
+                        dist['distribution_of_data']['categories'])
+        categories = sorted(set(categories))
+        category_index = {category: i for i, category in
+                          enumerate(categories)}
+
+        probabilities = np.full((len(names), len(categories)), np.nan)
+        distance = np.full(len(names), -1, dtype=np.int64)
+        from_appliance_type = []
+        for row, dist in enumerate(chosen):
+            if dist is None:
+                from_appliance_type.append('')
+                continue
+            probabilities[row] = _normalise(
+                dist['distribution_of_data'], category_index)
+            distance[row] = dist.get('distance', 0)
+            from_appliance_type.append(dist.get('from_appliance_type', ''))
+
+        self.appliance_types = np.array(names, dtype=str)
+        self.categories = np.array(categories, dtype=str)
+        self.probabilities = probabilities
+        self.distance = distance
+        self.from_appliance_type = np.array(from_appliance_type, dtype=str)
+
+    def priors(self, appliance_types, categories):
+        """Vectorized lookup of P(category | appliance type).
+
+        Parameters
+        ----------
+        appliance_types, categories : array-like of strings, same length
+
+        Returns
+        -------
+        np.ndarray of floats.  NaN where the appliance type is unknown or
+        has no distribution, or the category is not in `self.categories`.
+        """
+        rows = _codes(self.appliance_types, appliance_types)
+        columns = _codes(self.categories, categories)
+        if rows.shape != columns.shape:
+            raise ValueError("appliance_types and categories must have the"
+                             " same length.")
+        valid = (rows >= 0) & (columns >= 0)
+        priors = np.full(rows.shape, np.nan)
+        priors[valid] = self.probabilities[rows[valid], columns[valid]]
+        return priors
+
+    def prior(self, appliance_type, category):
+        """P(category | appliance type) for a single pair."""
+        return self.priors([appliance_type], [category])[0]
+
+    def distribution(self, appliance_type):
+        """
+        Returns
+        -------
+        dict mapping category to probability, or None if `appliance_type`
+        has no distribution.
+        """
+        row = _codes(self.appliance_types, [appliance_type])[0]
+        if row < 0 or self.distance[row] < 0:
+            return None
+        return dict(zip(self.categories.tolist(),
+                        self.probabilities[row].tolist()))
+
+
+def _nearest_categorical(list_of_dists):
+    nearest = None
+    for dist in list_of_dists:
+        data = dist.get('distribution_of_data') or {}
+        values = data.get('values')
+        dist_categories = data.get('categories')
+        if (values is None or dist_categories is None or
+                len(values) != len(dist_categories)):
+            continue
+        if (nearest is None or
+                dist.get('distance', 0) < nearest.get('distance', 0)):
+            nearest = dist
+    return nearest
+
+
+def _normalise(distribution_of_data, category_index):
+    """
+    Returns
+    -------
+    np.ndarray of probabilities over every category in `category_index`.
+    """
+    probabilities = np.zeros(len(category_index))
+    for category, value in zip(distribution_of_data['categories'],
+                               distribution_of_data['values']):
+        if category in category_index:
+            probabilities[category_index[category]] += value
+    total = probabilities.sum()
+    mentioned = set(distribution_of_data['categories'])
+    others = [i for category, i in iteritems(category_index)
+              if category not in mentioned]
+    if total < 1 and others:
+        probabilities[others] = (1 - total) / len(others)
+    elif total > 0:
+        probabilities /= total
+    return probabilities
+
+
+def _codes(sorted_names, names):
+    """
+    Returns
+    -------
+    np.ndarray of the positions of `names` in `sorted_names` (-1 if
+    absent), found with one vectorized binary search.
+    """
+    names = np.asarray(names, dtype=str)
+    if not len(sorted_names):
+        return np.full(names.shape, -1, dtype=np.int64)
+    codes = np.searchsorted(sorted_names, names)
+    codes = np.minimum(codes, len(sorted_names) - 1)
+    return np.where(sorted_names[codes] == names, codes, -1)
@@ -0,0 +1,222 @@
+"""Export dataset metadata and the appliance type catalogue to columnar
+files (Parquet or Arrow IPC / Feather) so that fleet-wide queries can be
+run as column scans instead of unpickling every building's metadata.
+
+Requires pyarrow (install with `pip install nilm_metadata[parquet]`).
+"""
+from __future__ import print_function, division
+import json
+from os import makedirs
+from os.path import isdir, join
+import pandas as pd
+from six import iteritems
+from nilm_metadata.object_concatenation import get_appliance_types
+from nilm_metadata.interning import (
+    InternTable, RehydratingMapping, INTERN_TABLE_ATTR)
+
+FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+
+
+def export_metadata(hdf_filename, output_dir, fmt='parquet',
+                    include_appliance_types=True):
+    """Exports the metadata in a NILMTK HDF5 file to columnar files.
+
+    Writes one file per table returned by `metadata_tables`.
+
+    Parameters
+    ----------
+    hdf_filename : str
+        HDF5 file written by `convert_yaml_to_hdf5`.
+    output_dir : str
+        Created if it does not exist.
+    fmt : {'parquet', 'feather'}
+    include_appliance_types : bool
+        Also export the concatenated appliance type catalogue.
+
+    Returns
+    -------
+    dict mapping table name to filename.
+    """
+    dataset_metadata, buildings = read_hdf5_metadata(hdf_filename)
+    tables = metadata_tables(
+        buildings, dataset_metadata.get('meter_devices'),
+        get_appliance_types() if include_appliance_types else None)
+    return write_tables(tables, output_dir, fmt)
+
+
+def write_tables(tables, output_dir, fmt='parquet'):
+    """
+    Parameters
+    ----------
+    tables : dict mapping table name to pd.DataFrame
+    output_dir : str
+    fmt : {'parquet', 'feather'}
+
+    Returns
+    -------
+    dict mapping table name to filename.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("fmt must be one of {}".format(sorted(FORMATS)))
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    filenames = {}
+    for name, table in iteritems(tables):
+        filename = join(output_dir, name + FORMATS[fmt])
+        if fmt == 'parquet':
+            table.to_parquet(filename, index=False)
+        else:
+            table.reset_index(drop=True).to_feather(filename)
+        filenames[name] = filename
+    return filenames
+
+
+def read_hdf5_metadata(hdf_filename):
+    """
+    References to sub-structures stored once in an intern table (see
+    `convert_yaml_to_hdf5(..., intern=True)`) are rehydrated: the dataset
+    metadata straight away and each building when it is first looked up.
+
+    Returns
+    -------
+    (dataset_metadata, buildings) where buildings maps building name
+    (e.g. 'building1') to building metadata.  It is a dict, or an
+    `interning.RehydratingMapping` if the file was interned.
+    """
+    store = pd.HDFStore(hdf_filename, 'r')
+    try:
+        return read_store_metadata(store)
+    finally:
+        store.close()
+
+
+def read_store_metadata(store):
+    """Like `read_hdf5_metadata` but reads from an open pd.HDFStore."""
+    root_attrs = store.root._v_attrs
+    buildings = {}
+    for group in store._handle.list_nodes('/'):
+        if 'metadata' in group._v_attrs._f_list():
+            buildings[group._v_name] = group._v_attrs.metadata
+    dataset_metadata = root_attrs.metadata
+    if INTERN_TABLE_ATTR in root_attrs._f_list():
+        intern_table = InternTable(getattr(root_attrs, INTERN_TABLE_ATTR))
+        dataset_metadata = intern_table.rehydrate(dataset_metadata)
+        buildings = RehydratingMapping(buildings, intern_table)
+    return dataset_metadata, buildings
+
+
+def metadata_tables(buildings, meter_devices=None, appliance_types=None):
+    """Flattens building metadata into tables.
+
+    Nested dicts are flattened into columns named '<key>_<subkey>'
+    (e.g. 'timeframe_start') and lists are stored as JSON strings.
+
+    Parameters
+    ----------
+    buildings : dict mapping building name to building metadata
+    meter_devices : dict, optional
+        If given then each meter's 'sample_period' and 'max_sample_period'
+        are filled in from its device model (unless the meter overrides
+        them) and a 'meter_devices' table is returned.
+    appliance_types : dict, optional
+        If given then an 'appliance_types' table is returned.
+
+    Returns
+    -------
+    dict mapping table name to pd.DataFrame.  Tables are:
+    * 'buildings' : one row per building
+    * 'meters' : one row per ElecMeter, keyed on (building, meter)
+    * 'appliances' : one row per appliance, keyed on
+      (building, type, instance)
+    * 'appliance_meters' : links each appliance to each of its meters
+    * 'meter_devices' and 'appliance_types' (optional)
+    """
+    meter_devices = meter_devices or {}
+    building_rows = []
+    meter_rows = []
+    appliance_rows = []
+    appliance_meter_rows = []
+    for building, building_metadata in sorted(iteritems(buildings)):
+        building_row = {'building': building}
+        building_row.update(_flatten(
+            {key: value for key, value in iteritems(building_metadata)
+             if key not in ['elec_meters', 'appliances']}))
+        building_rows.append(building_row)
+
+        for meter, meter_metadata in sorted(iteritems(
+                building_metadata.get('elec_meters', {}))):
+            device = meter_devices.get(meter_metadata.get('device_model'), {})
+            meter_row = {'building': building, 'meter': meter}
+            for key in ['sample_period', 'max_sample_period']:
+                if key in device:
+                    meter_row[key] = device[key]
+            meter_row.update(_flatten(meter_metadata))
+            meter_rows.append(meter_row)
+
+        for appliance in building_metadata.get('appliances', []):
+            appliance_row = {'building': building}
+            appliance_row.update(_flatten(appliance))
+            appliance_rows.append(appliance_row)
+            for meter in appliance.get('meters', []):
+                appliance_meter_rows.append({
+                    'building': building,
+                    'appliance_type': appliance.get('type'),
+                    'appliance_instance': appliance.get('instance'),
+                    'meter': meter})
+
+    tables = {
+        'buildings': _to_frame(building_rows, ['building']),
+        'meters': _to_frame(meter_rows, ['building', 'meter']),
+        'appliances': _to_frame(appliance_rows,
+                                ['building', 'type', 'instance']),
+        'appliance_meters': _to_frame(
+            appliance_meter_rows,
+            ['building', 'appliance_type', 'appliance_instance', 'meter'])}
+
+    if meter_devices:
+        tables['meter_devices'] = _to_frame(
+            [dict(_flatten(device), device_model=name)
+             for name, device in sorted(iteritems(meter_devices))],
+            ['device_model'])
+
+    if appliance_types is not None:
+        tables['appliance_types'] = _to_frame(
+            [dict(_flatten(appliance_type), type=name)
+             for name, appliance_type in sorted(iteritems(appliance_types))],
+            ['type'])
+
+    return tables
+
+
+def _flatten(obj, prefix=''):
+    flat = {}
+    for key, value in iteritems(obj):
+        column = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, column + '_'))
+        elif isinstance(value, (list, tuple)):
+            flat[column] = json.dumps(value, default=str)
+        else:
+            flat[column] = value
+    return flat
+
+
+def _to_frame(rows, first_columns):
+    table = pd.DataFrame(rows)
+    for column in first_columns:
+        if column not in table:
+            table[column] = None
+    columns = first_columns + sorted(
+        column for column in table.columns if column not in first_columns)
+    table = table[columns]
+
+    # Columnar formats need a single type per column.  Columns mixing
+    # strings with other objects are stored as strings.
+    for column in table.columns:
+        if table[column].dtype == object:
+            types = set(type(value) for value in table[column]
+                        if value is not None and value == value)
+            if len(types) > 1:
+                table[column] = [None if value is None else str(value)
+                                 for value in table[column]]
+    return table
@@ -1,27 +1,287 @@
 from __future__ import print_function, division
-from inspect import currentframe, getfile, getsourcefile
-from os.path import dirname, join, isdir, abspath
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from hashlib import sha1
+from os.path import abspath, dirname, join, isdir
 import os
-from os import getcwd
-from sys import getfilesystemencoding
+import pickle
+import tempfile
 import yaml
+from nilm_metadata.profiling import phase, add_bytes_read
 
+try:
+    from yaml import CSafeLoader as _LibYAMLSafeLoader
+except ImportError:
+    _LibYAMLSafeLoader = None
 
+_YAML_LOADERS = {'libyaml': _LibYAMLSafeLoader, 'python': yaml.SafeLoader}
+_yaml_loader_name = None
 
-def get_appliance_types_from_disk():
-    obj_filenames = _find_all_appliance_type_files()
+# os.pathsep-separated list of extra directories of appliance type files.
+APPLIANCE_TYPES_DIRS_ENV_VAR = 'NILM_METADATA_APPLIANCE_TYPES_DIRS'
+_extra_appliance_types_directories = []
+
+# Maps (directory, suffix) to ((subdirectory, mtime) tuples, filenames).
+_listing_cache = {}
+
+# Catalogues with fewer files than this are loaded in the calling process.
+_MIN_FILES_FOR_PROCESS_POOL = 64
+
+
+class DuplicateApplianceTypeError(Exception):
+    pass
+
+
+def set_yaml_loader(name='auto'):
+    """Choose which YAML parser `load_yaml` uses.
+
+    Parameters
+    ----------
+    name : {'auto', 'libyaml', 'python'}
+        'auto' uses libyaml's `CSafeLoader` if PyYAML was built with
+        libyaml and falls back to the pure-Python `SafeLoader` otherwise.
+        The default can also be set with the environment variable
+        NILM_METADATA_YAML_LOADER.
+
+    Raises
+    ------
+    ValueError if `name` is not recognised.
+    ImportError if 'libyaml' is requested but is not available.
+    """
+    global _yaml_loader_name
+    if name == 'auto':
+        name = 'python' if _LibYAMLSafeLoader is None else 'libyaml'
+    if name not in _YAML_LOADERS:
+        raise ValueError("YAML loader '{}' not recognised.  Use one of"
+                         " 'auto', 'libyaml' or 'python'.".format(name))
+    if _YAML_LOADERS[name] is None:
+        raise ImportError("PyYAML was built without libyaml so the"
+                          " 'libyaml' YAML loader is not available.")
+    _yaml_loader_name = name
+
+
+def get_yaml_loader():
+    """
+    Returns
+    -------
+    string : the name of the YAML parser used by `load_yaml`;
+    either 'libyaml' or 'python'.
+    """
+    if _yaml_loader_name is None:
+        set_yaml_loader(os.environ.get('NILM_METADATA_YAML_LOADER', 'auto'))
+    return _yaml_loader_name
+
+
+def load_yaml(stream):
+    """Equivalent to `yaml.safe_load(stream)` but uses the parser chosen
+    with `set_yaml_loader` (libyaml, if available, by default)."""
+    with phase('parse_yaml'):
+        return yaml.load(stream, Loader=_YAML_LOADERS[get_yaml_loader()])
+
+
+def get_appliance_types_from_disk(obj_filenames=None, workers=1):
+    """Loads appliance type files without concatenating them.
+
+    Parameters
+    ----------
+    obj_filenames : list of strings, optional
+        Defaults to every appliance type file in
+        `get_appliance_types_directories()`.
+    workers : int, optional
+        Number of processes used to read and parse files.  Defaults to 1:
+        files are loaded in the calling process, so no process pool is
+        started behind the caller's back (which would fail under the
+        'spawn' start method without a `__main__` guard, and would nest
+        inside callers' own pools).  None means the number of CPUs.
+        Catalogues with fewer than 64 files are always loaded in the
+        calling process.
+
+    Returns
+    -------
+    dict mapping appliance type name to appliance type, as on disk.
+
+    Raises
+    ------
+    DuplicateApplianceTypeError if an appliance type is defined in more
+    than one file.
+    """
+    if obj_filenames is None:
+        obj_filenames = _find_all_appliance_type_files()
     obj_cache = {}
-    for filename in obj_filenames:
-        with open(filename, 'rb') as fh:
-            objs = yaml.safe_load(fh)
-        obj_cache.update(objs)
+    sources = {}
+    duplicates = []
+    for filename, objs in zip(obj_filenames,
+                              _load_yaml_files(obj_filenames, workers)):
+        for obj_name in objs or {}:
+            if obj_name in sources:
+                duplicates.append("'{}' is defined in {} and {}".format(
+                    obj_name, sources[obj_name], filename))
+            sources[obj_name] = filename
+        obj_cache.update(objs or {})
 
+    if duplicates:
+        raise DuplicateApplianceTypeError('\n'.join(duplicates))
     return obj_cache
 
 
+def add_appliance_types_directory(directory):
+    """Also load appliance types from every *.yaml file in `directory`
+    (and its subdirectories), e.g. site-specific appliance types which
+    inherit from the central appliance types.  Extra directories can also
+    be listed in the environment variable NILM_METADATA_APPLIANCE_TYPES_DIRS
+    (separated by os.pathsep).
+
+    Appliance type names must be unique across all directories.
+    """
+    directory = abspath(directory)
+    if not isdir(directory):
+        raise ValueError("'{}' is not a directory.".format(directory))
+    if directory not in _extra_appliance_types_directories:
+        _extra_appliance_types_directories.append(directory)
+
+
+def remove_appliance_types_directory(directory):
+    _extra_appliance_types_directories.remove(abspath(directory))
+
+
+def get_appliance_types_directories():
+    """
+    Returns
+    -------
+    list of directories searched for appliance type files: the central
+    appliance types, then those in NILM_METADATA_APPLIANCE_TYPES_DIRS,
+    then those added with `add_appliance_types_directory`.
+    """
+    directories = [_get_appliance_types_directory()]
+    env_directories = os.environ.get(APPLIANCE_TYPES_DIRS_ENV_VAR, '')
+    for directory in (env_directories.split(os.pathsep) +
+                      _extra_appliance_types_directories):
+        if directory:
+            directory = abspath(directory)
+            if directory not in directories:
+                directories.append(directory)
+    return directories
+
+
+def get_appliance_types_signature(filenames=None):
+    """Cheap fingerprint of the appliance type YAML files.
+
+    Parameters
+    ----------
+    filenames : list of strings, optional
+        Defaults to all appliance type files on disk.
+
+    Returns
+    -------
+    tuple of (filename, mtime in nanoseconds, size in bytes) tuples,
+    sorted by filename.
+    """
+    if filenames is None:
+        filenames = _find_all_appliance_type_files()
+    signature = []
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        signature.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def get_appliance_types_hash(filenames=None):
+    """SHA1 hex digest over the names and contents of the appliance
+    type YAML files.  Unlike `get_appliance_types_signature`, this does
+    not change if a file is merely touched."""
+    if filenames is None:
+        filenames = _find_all_appliance_type_files()
+    digest = sha1()
+    with phase('hash_files'):
+        for filename in sorted(filenames):
+            digest.update(os.path.basename(filename).encode('utf-8'))
+            with open(filename, 'rb') as fh:
+                digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def get_compiled_cache_directory():
+    """
+    Returns
+    -------
+    Directory in which compiled appliance type catalogues are stored, or
+    None if the compiled cache is disabled.  Set the environment variable
+    NILM_METADATA_CACHE_DIR to choose the directory; set it to an empty
+    string to disable the compiled cache.  Defaults to
+    $XDG_CACHE_HOME/nilm_metadata (or ~/.cache/nilm_metadata).
+    """
+    directory = os.environ.get('NILM_METADATA_CACHE_DIR')
+    if directory is None:
+        cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                      join(os.path.expanduser('~'), '.cache'))
+        directory = join(cache_home, 'nilm_metadata')
+    return directory or None
+
+
+def load_compiled_cache(key):
+    """
+    Parameters
+    ----------
+    key : string
+        Content hash identifying the compiled object.
+
+    Returns
+    -------
+    The object stored by `save_compiled_cache(key, obj)` or None if
+    no such object exists (or the cache is disabled or unreadable).
+    """
+    filename = _compiled_cache_filename(key)
+    if filename is None or not os.path.isfile(filename):
+        return None
+    try:
+        return pickle.loads(_read_file(filename))
+    except Exception:
+        return None
+
+
+def save_compiled_cache(key, obj):
+    """Pickles `obj` into the compiled cache under `key`.
+
+    Writes are atomic so concurrent processes never see a partial file.
+    Compiled catalogues stored under other keys are out of date, so are
+    removed.  Failures (e.g. a read-only home directory) are silently
+    ignored because the cache is only an optimisation.
+    """
+    filename = _compiled_cache_filename(key)
+    if filename is None:
+        return
+    directory = dirname(filename)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+    except Exception:
+        return
+    for old_filename in glob(_compiled_cache_filename('*')):
+        if old_filename != filename:
+            try:
+                os.remove(old_filename)
+            except OSError:
+                pass
+
+
+def _compiled_cache_filename(key):
+    directory = get_compiled_cache_directory()
+    if directory is None:
+        return None
+    return join(directory, 'appliance_types-{}.pickle'.format(key))
+
+
 def _find_all_appliance_type_files():
-    filenames = _find_all_files_with_suffix('.yaml',
-                                            _get_appliance_types_directory())
+    filenames = []
+    for directory in get_appliance_types_directories():
+        filenames.extend(_find_all_files_with_suffix('.yaml', directory))
     return filenames
 
 
@@ -30,17 +290,88 @@ def _get_appliance_types_directory():
 
 
 def _find_all_files_with_suffix(suffix, directory):
-    """Find all files with suffix, recursively."""
-    accumulator = []
+    """Find all files with suffix, recursively.  Symbolic links to
+    directories are not followed.
+
+    The listing is cached.  The cached listing is reused as long as the
+    modification time of every directory in the tree is unchanged, which
+    costs one `os.stat` per directory rather than a full walk.
 
-    for root, dirs, fnames in os.walk(directory):
-        new_files = [os.path.join(root, fname) for fname in fnames
-                     if fname.endswith(suffix)]
-        accumulator.extend(new_files)
+    Returns
+    -------
+    sorted list of filenames.
+    """
+    with phase('find_files'):
+        key = (directory, suffix)
+        cached = _listing_cache.get(key)
+        if cached is not None and _directories_unchanged(cached[0]):
+            return list(cached[1])
+
+        directory_mtimes = []
+        accumulator = []
+        directories = [directory]
+        while directories:
+            root = directories.pop()
+            # stat before listing so that a file added in between makes
+            # the cached listing stale rather than silently incomplete.
+            directory_mtimes.append((root, os.stat(root).st_mtime_ns))
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            directories.append(entry.path)
+                    elif entry.name.endswith(suffix):
+                        accumulator.append(entry.path)
+
+        accumulator.sort()
+        _listing_cache[key] = (tuple(directory_mtimes), tuple(accumulator))
 
     return accumulator
 
 
+def _directories_unchanged(directory_mtimes):
+    try:
+        return all(os.stat(directory).st_mtime_ns == mtime
+                   for directory, mtime in directory_mtimes)
+    except OSError:
+        return False
+
+
+def _load_yaml_files(filenames, workers=1):
+    """Reads and parses `filenames`, in a process pool if there are many.
+    YAML parsing holds the GIL so threads would not help.
+
+    Returns
+    -------
+    list of parsed objects, in the same order as `filenames`.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(filenames) < _MIN_FILES_FOR_PROCESS_POOL or workers <= 1:
+        return _load_yaml_chunk(filenames)
+
+    # A few chunks per worker amortise pickling while balancing load.
+    chunk_size = -(-len(filenames) // (workers * 4))
+    chunks = [filenames[i:i+chunk_size]
+              for i in range(0, len(filenames), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [obj for chunk in executor.map(_load_yaml_chunk, chunks)
+                for obj in chunk]
+
+
+def _load_yaml_chunk(filenames):
+    return [load_yaml(_read_file(filename)) for filename in filenames]
+
+
+def _read_file(filename):
+    """Returns the contents of `filename` as bytes."""
+    with phase('read_files'):
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+    add_bytes_read('read_files', len(data))
+    return data
+
+
 def _path_to_directory(*args):
     path_to_directory = join(_get_module_directory(), *args)
     assert isdir(path_to_directory)
@@ -48,14 +379,11 @@ def _path_to_directory(*args):
 
 
 def _get_module_directory():
-    # Taken from http://stackoverflow.com/a/6098238/732596
-    path_to_this_file = dirname(getfile(currentframe()))
-    if not isdir(path_to_this_file):
-        encoding = getfilesystemencoding()
-        path_to_this_file = dirname(unicode(__file__, encoding))
-    if not isdir(path_to_this_file):
-        abspath(getsourcefile(lambda _: None))
-    if not isdir(path_to_this_file):
-        path_to_this_file = getcwd()
-    assert isdir(path_to_this_file), path_to_this_file + ' is not a directory'
-    return path_to_this_file
+    """The directory of the installed nilm_metadata package, located with
+    `importlib.resources` (so the package must be installed as a directory
+    rather than inside a zip file)."""
+    from importlib.resources import files
+    path_to_this_package = str(files('nilm_metadata'))
+    assert isdir(path_to_this_package), (
+        path_to_this_package + ' is not a directory')
+    return path_to_this_package
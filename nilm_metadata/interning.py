@@ -0,0 +1,211 @@
+"""Content-addressed storage of repeated metadata sub-structures.
+
+In large datasets thousands of meters and appliances often share the same
+few nested configurations (timeframes, `dominant_appliance` lists,
+`components` and so on).  When every building's metadata is pickled into
+its HDF5 attribute each copy is serialised again.  `InternTable` stores
+each distinct sub-structure once, keyed by a hash of its content, and
+replaces every occurrence with a reference: a dict `{REF_KEY: digest}`.
+
+`convert_yaml_to_hdf5(..., intern=True)` stores the table in the root
+attribute `INTERN_TABLE_ATTR`.  `export.read_hdf5_metadata` returns the
+buildings as a `RehydratingMapping`, which only rehydrates a building's
+references when that building is first looked up.  Code which reads the
+attributes directly sees the references.
+"""
+from __future__ import print_function, division
+from hashlib import sha1
+from sys import intern
+from collections import Counter
+from collections.abc import Mapping
+from six import iteritems, itervalues
+from nilm_metadata.object_concatenation import copy_tree
+
+# Name of the HDF5 root attribute holding the InternTable's objects.
+INTERN_TABLE_ATTR = 'nilm_metadata_interned'
+REF_KEY = '$ref'
+
+
+class InternTable(object):
+    """Maps the digest of each interned object to the object.
+
+    Only repeated container values (dicts and non-empty lists) at the top
+    level of each ElecMeter, Appliance and MeterDevice are interned:
+    scalars and unique values are cheaper to store inline than to
+    reference.
+
+    Parameters
+    ----------
+    objects : dict, optional
+        Maps digest to object, e.g. a previously stored `objects`.
+
+    Attributes
+    ----------
+    objects : dict mapping digest (str) to object.
+    """
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, digest):
+        return digest in self.objects
+
+    def intern(self, obj, digest=None):
+        """
+        Returns
+        -------
+        A reference to `obj`.  Every reference to equal objects uses the
+        same digest string object, so pickle stores it only once.
+        """
+        digest = intern(digest or _digest(obj))
+        if digest not in self.objects:
+            self.objects[digest] = copy_tree(obj)
+        return {REF_KEY: digest}
+
+    def intern_records(self, records):
+        """
+        Parameters
+        ----------
+        records : list of dicts
+
+        Returns
+        -------
+        list of shallow copies of `records` in which each container value
+        which is repeated (within `records` or from a previous call) is
+        replaced by a reference.  Unique values are cheaper to store
+        inline, so are left alone.  Keys and string values are interned
+        with `sys.intern` so that pickle stores each only once.
+        """
+        digests = [{key: _digest(value) for key, value in iteritems(record)
+                    if _is_container(value)} for record in records]
+        counts = Counter(digest for record_digests in digests
+                         for digest in itervalues(record_digests))
+        interned = []
+        for record, record_digests in zip(records, digests):
+            record = {_intern_string(key): _intern_string(value)
+                      for key, value in iteritems(record)}
+            for key, digest in iteritems(record_digests):
+                if counts[digest] > 1 or digest in self.objects:
+                    record[key] = self.intern(record[key], digest)
+            interned.append(record)
+        return interned
+
+    def intern_building(self, building_metadata):
+        """
+        Returns
+        -------
+        A shallow copy of `building_metadata` whose ElecMeters and
+        Appliances have been passed through `intern_records`.
+        """
+        building_metadata = dict(building_metadata)
+        elec_meters = building_metadata.get('elec_meters')
+        appliances = building_metadata.get('appliances')
+        meter_instances = list(elec_meters or [])
+        records = self.intern_records(
+            [elec_meters[meter_instance] for meter_instance
+             in meter_instances] + list(appliances or []))
+        if elec_meters is not None:
+            building_metadata['elec_meters'] = dict(
+                zip(meter_instances, records))
+        if appliances is not None:
+            building_metadata['appliances'] = records[len(meter_instances):]
+        return building_metadata
+
+    def intern_dataset(self, dataset_metadata):
+        """
+        Returns
+        -------
+        A shallow copy of `dataset_metadata` whose MeterDevices have been
+        passed through `intern_records`.
+        """
+        dataset_metadata = dict(dataset_metadata)
+        meter_devices = dataset_metadata.get('meter_devices')
+        if meter_devices:
+            models = list(meter_devices)
+            dataset_metadata['meter_devices'] = dict(zip(
+                models, self.intern_records(
+                    [meter_devices[model] for model in models])))
+        return dataset_metadata
+
+    def rehydrate(self, obj):
+        """
+        Returns
+        -------
+        A copy of `obj` with every reference replaced by a separate copy
+        of the object it refers to.
+
+        Raises
+        ------
+        KeyError if a reference is not in the table.
+        """
+        if is_ref(obj):
+            return copy_tree(self.objects[obj[REF_KEY]])
+        elif isinstance(obj, dict):
+            return {key: self.rehydrate(value)
+                    for key, value in iteritems(obj)}
+        elif isinstance(obj, list):
+            return [self.rehydrate(value) for value in obj]
+        return obj
+
+
+class RehydratingMapping(Mapping):
+    """A read-only mapping whose values are rehydrated with an
+    InternTable when first looked up, and then cached.
+
+    Parameters
+    ----------
+    raw : dict whose values may contain references
+    intern_table : InternTable
+    """
+
+    def __init__(self, raw, intern_table):
+        self._raw = raw
+        self._intern_table = intern_table
+        self._rehydrated = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._rehydrated[key]
+        except KeyError:
+            value = self._intern_table.rehydrate(self._raw[key])
+            self._rehydrated[key] = value
+            return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+
+def is_ref(obj):
+    return isinstance(obj, dict) and len(obj) == 1 and REF_KEY in obj
+
+
+def _intern_string(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+def _is_container(value):
+    return isinstance(value, dict) or (isinstance(value, list) and value)
+
+
+def _digest(obj):
+    return sha1(_canonical(obj).encode('utf-8')).hexdigest()
+
+
+def _canonical(obj):
+    """A string which is equal for equal objects whatever their dict
+    ordering, and which distinguishes e.g. 1 from 1.0 and True."""
+    if isinstance(obj, dict):
+        return '{' + ','.join(sorted(
+            _canonical(key) + ':' + _canonical(value)
+            for key, value in iteritems(obj))) + '}'
+    elif isinstance(obj, (list, tuple)):
+        brackets = '[]' if isinstance(obj, list) else '()'
+        return (brackets[0] + ','.join(_canonical(value) for value in obj) +
+                brackets[1])
+    return type(obj).__name__ + ':' + repr(obj)
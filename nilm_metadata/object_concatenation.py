@@ -1,65 +1,333 @@
 from __future__ import print_function, division
+from collections.abc import Mapping
 from copy import deepcopy
+from hashlib import sha1
+from threading import RLock
 from six import iteritems
-from nilm_metadata.file_management import get_appliance_types_from_disk
+from nilm_metadata.appliance_type_index import ApplianceTypeIndex
+from nilm_metadata.schema import SchemaValidator
+from nilm_metadata.file_management import (
+    get_appliance_types_from_disk, get_appliance_types_signature,
+    get_appliance_types_hash, load_compiled_cache, save_compiled_cache,
+    _find_all_appliance_type_files)
+from nilm_metadata.profiling import phase, profiled
 
+# Bump this whenever a change to the concatenation code changes its output,
+# so that stale compiled catalogues in the on-disk cache are ignored.
+COMPILED_CACHE_VERSION = 3
 
-def get_appliance_types():
+
+@profiled('get_appliance_types')
+def get_appliance_types(lazy=False):
     """
+    Parameters
+    ----------
+    lazy : bool, optional
+        If True then return a LazyApplianceTypes mapping, which only
+        concatenates each appliance type when it is first accessed.
+        Useful if only a handful of appliance types are needed.
+
     Returns
     -------
     dict of all appliance types.  Fully concatenated and with components
-    recursively resolved.
+    recursively resolved.  The dict is a private copy of the process-wide
+    cache held by `get_appliance_type_registry()` so callers may modify it.
+    """
+    registry = get_appliance_type_registry()
+    if lazy:
+        return registry.get_lazy_appliance_types()
+    return registry.get_appliance_types()
+
+
+def get_appliance_type_registry():
+    """
+    Returns
+    -------
+    The process-wide ApplianceTypeRegistry.
+    """
+    return _REGISTRY
+
+
+class ApplianceTypeRegistry(object):
+    """Builds the concatenated appliance type catalogue once and caches it.
+
+    Every access checks the modification time and size of each appliance
+    type YAML file.  If any of these have changed then the contents of the
+    files are hashed and the catalogue is only rebuilt if the hash differs
+    from the hash of the files used to build the cached catalogue.
+
+    The cached catalogue is never handed out directly: `get_appliance_types`
+    and `get` return deep copies (made with `copy_tree`), and `names`
+    returns a frozenset.
+
+    If `use_compiled_cache` is True then the concatenated catalogue is also
+    pickled to disk (see `file_management.get_compiled_cache_directory`),
+    keyed on the hash of the YAML files, so new processes can skip parsing
+    and concatenation altogether.
+
+    `workers` is passed to `file_management.get_appliance_types_from_disk`:
+    set it above 1 to parse a large catalogue in a process pool.
+    """
+
+    def __init__(self, use_compiled_cache=True, workers=1):
+        self.use_compiled_cache = use_compiled_cache
+        self.workers = workers
+        self._lock = RLock()
+        self._appliance_types = None
+        self._from_disk = None
+        self._names = frozenset()
+        self._index = None
+        self._distribution_tables = {}
+        self._schema_validator = None
+        self._signature = None
+        self._hash = None
+
+    def get_appliance_types(self):
+        """
+        Returns
+        -------
+        dict of all appliance types (a deep copy of the cache).
+        """
+        with self._lock:
+            return copy_tree(self._get_cached())
+
+    def get_lazy_appliance_types(self):
+        """
+        Returns
+        -------
+        LazyApplianceTypes built from the cached appliance types from disk.
+        """
+        with self._lock:
+            return LazyApplianceTypes(self._get_from_disk())
+
+    def get(self, appliance_type_name, default=None):
+        """
+        Returns
+        -------
+        dict for a single appliance type (a deep copy of the cache) or
+        `default` if `appliance_type_name` is not recognised.
+        """
+        with self._lock:
+            appliance_type = self._get_cached().get(appliance_type_name)
+            if appliance_type is None:
+                return default
+            return copy_tree(appliance_type)
+
+    def names(self):
+        """
+        Returns
+        -------
+        frozenset of all appliance type names.
+        """
+        with self._lock:
+            self._get_cached()
+            return self._names
+
+    def index(self):
+        """
+        Returns
+        -------
+        ApplianceTypeIndex for looking up appliance types by synonym,
+        category, ancestry and component.  Rebuilt along with the catalogue.
+        """
+        with self._lock:
+            appliance_types = self._get_cached()
+            if self._index is None:
+                self._index = ApplianceTypeIndex(appliance_types)
+            return self._index
+
+    def distribution_table(self, distribution_name='rooms'):
+        """
+        Returns
+        -------
+        distribution_tables.CategoricalDistributionTable for vectorized
+        lookups of `distribution_name` priors (e.g. P(room | appliance
+        type)).  Built once and rebuilt along with the catalogue.
+        """
+        # Imported here so that numpy is only imported if needed.
+        from nilm_metadata.distribution_tables import (
+            CategoricalDistributionTable)
+        with self._lock:
+            appliance_types = self._get_cached()
+            table = self._distribution_tables.get(distribution_name)
+            if table is None:
+                table = CategoricalDistributionTable(
+                    appliance_types, distribution_name)
+                self._distribution_tables[distribution_name] = table
+            return table
+
+    def schema_validator(self):
+        """
+        Returns
+        -------
+        schema.SchemaValidator which also checks each appliance type's
+        `additional_properties`.  Compiled once and rebuilt along with the
+        catalogue.
+        """
+        with self._lock:
+            appliance_types = self._get_cached()
+            if self._schema_validator is None:
+                self._schema_validator = SchemaValidator(appliance_types)
+            return self._schema_validator
+
+    def __contains__(self, appliance_type_name):
+        return appliance_type_name in self.names()
+
+    def invalidate(self):
+        """Forget the cached catalogue.  The next access rebuilds it."""
+        with self._lock:
+            self._appliance_types = None
+            self._from_disk = None
+            self._names = frozenset()
+            self._index = None
+            self._distribution_tables = {}
+            self._schema_validator = None
+            self._signature = None
+            self._hash = None
+
+    def _refresh(self):
+        """Forgets everything cached if the contents of the appliance
+        type files have changed.
+
+        Returns
+        -------
+        list of appliance type filenames.
+        """
+        filenames = _find_all_appliance_type_files()
+        signature = get_appliance_types_signature(filenames)
+        if signature != self._signature:
+            # Something has been touched.  Only rebuild if contents changed.
+            files_hash = get_appliance_types_hash(filenames)
+            if files_hash != self._hash:
+                self._appliance_types = None
+                self._from_disk = None
+                self._names = frozenset()
+                self._index = None
+                self._distribution_tables = {}
+                self._schema_validator = None
+                self._hash = files_hash
+            self._signature = signature
+        return filenames
+
+    def _get_cached(self):
+        filenames = self._refresh()
+        if self._appliance_types is None:
+            self._appliance_types = self._build(filenames)
+            self._names = frozenset(self._appliance_types)
+        return self._appliance_types
+
+    def _get_from_disk(self, filenames=None):
+        if filenames is None:
+            filenames = self._refresh()
+        if self._from_disk is None:
+            self._from_disk = get_appliance_types_from_disk(
+                filenames, workers=self.workers)
+        return self._from_disk
+
+    def _build(self, filenames):
+        if self.use_compiled_cache:
+            key = sha1('{}-{}'.format(self._hash, COMPILED_CACHE_VERSION)
+                       .encode('utf-8')).hexdigest()
+            with phase('compiled_cache'):
+                appliance_types = load_compiled_cache(key)
+            if appliance_types is not None:
+                return appliance_types
+
+        appliance_types = _concatenate_all_appliance_types(
+            self._get_from_disk(filenames))
+        if self.use_compiled_cache:
+            with phase('compiled_cache'):
+                save_compiled_cache(key, appliance_types)
+        return appliance_types
+
+
+class LazyApplianceTypes(Mapping):
+    """Read-only mapping from appliance type name to concatenated appliance
+    type.  Each appliance type is only concatenated (with its ancestors and
+    components) when it is first accessed, and is then memoized.
+
+    Iteration, `len` and `in` do not concatenate anything.  Each mapping
+    owns the dicts it returns, so modifying them does not affect other
+    mappings or `get_appliance_types()`.
+
+    Parameters
+    ----------
+    appliance_types_from_disk : dict
+        Not modified.
     """
-    appliance_types_from_disk = get_appliance_types_from_disk()
-    appliance_types = _concatenate_all_appliance_types(
-        appliance_types_from_disk)
-    return appliance_types
+
+    def __init__(self, appliance_types_from_disk):
+        self._from_disk = appliance_types_from_disk
+        self._resolver = _ObjectResolver(appliance_types_from_disk)
+        self._resolved = {}
+
+    def __getitem__(self, appliance_type_name):
+        try:
+            return self._resolved[appliance_type_name]
+        except KeyError:
+            pass
+        if appliance_type_name not in self._from_disk:
+            raise KeyError(appliance_type_name)
+        appliance_type = copy_tree(
+            self._resolver.concatenate_appliance_type(appliance_type_name))
+        self._resolved[appliance_type_name] = appliance_type
+        return appliance_type
+
+    def __contains__(self, appliance_type_name):
+        return appliance_type_name in self._from_disk
+
+    def __iter__(self):
+        return iter(self._from_disk)
+
+    def __len__(self):
+        return len(self._from_disk)
+
+    def __repr__(self):
+        return '<LazyApplianceTypes: {:d} of {:d} resolved>'.format(
+            len(self._resolved), len(self))
 
 
 class ObjectConcatenationError(Exception):
     pass
 
 
+_REGISTRY = ApplianceTypeRegistry()
+
+
 def _concatenate_all_appliance_types(appliance_types_from_disk):
+    resolver = _ObjectResolver(appliance_types_from_disk)
     concatenated = {}
-    for appliance_type_name in appliance_types_from_disk:
-        concatenated_appliance_type = _concatenate_complete_appliance_type(
-            appliance_type_name, appliance_types_from_disk)
-        concatenated[appliance_type_name] = concatenated_appliance_type
+    with phase('concatenate_appliance_types'):
+        for appliance_type_name in appliance_types_from_disk:
+            concatenated[appliance_type_name] = (
+                resolver.concatenate_appliance_type(appliance_type_name))
 
     return concatenated
 
 
 def _concatenate_complete_appliance_type(
         appliance_type_name, appliance_types_from_disk):
-
-    concatenated_app_type = _concatenate_complete_object(
-        appliance_type_name, appliance_types_from_disk)
-    categories = concatenated_app_type.setdefault('categories', {})
-
-    # Instantiate components recursively
-    components = concatenated_app_type.get('components', [])
-    for i, component_appliance_obj in enumerate(components):
-        component_type_name = component_appliance_obj['type']
-        component_type_obj = _concatenate_complete_appliance_type(
-            component_type_name, appliance_types_from_disk)
-        recursively_update_dict(component_appliance_obj, component_type_obj)
-        components[i] = component_appliance_obj
-
-        # Now merge component categories into owner appliance type object
-        if not component_appliance_obj.get('do_not_merge_categories'):
-            recursively_update_dict(
-                categories, component_appliance_obj.get('categories', {}))
-
-    return concatenated_app_type
+    resolver = _ObjectResolver(appliance_types_from_disk)
+    return resolver.concatenate_appliance_type(appliance_type_name)
 
 
 def _init_distributions(appliance_type):
-    for list_of_dists in appliance_type.get('distributions', {}).values():
-        for dist in list_of_dists:
-            dist.update({'from_appliance_type': appliance_type['type'],
-                         'distance': 0})
+    """
+    Returns
+    -------
+    A shallow copy of `appliance_type` in which each probability
+    distribution is a copy tagged with 'from_appliance_type' and
+    'distance'.  `appliance_type` itself is not modified.
+    """
+    appliance_type = dict(appliance_type)
+    distributions = appliance_type.get('distributions')
+    if distributions:
+        appliance_type['distributions'] = {
+            name: [dict(dist, from_appliance_type=appliance_type['type'],
+                        distance=0)
+                   for dist in list_of_dists]
+            for name, list_of_dists in iteritems(distributions)}
+    return appliance_type
 
 
 def _concatenate_complete_object(object_name, object_cache):
@@ -67,90 +335,164 @@ def _concatenate_complete_object(object_name, object_cache):
     Returns
     -------
     merged_object: dict.
-        If `child_object` is None then merged_object will be the object
-        identified by `object_name` merged with its ancestor tree.
-        If `child_object` is not None then it will be merged as the
-        most-derived object (i.e. a child of object_name).  This is
-        useful for appliances.
+        The object identified by `object_name` merged with its
+        ancestor tree.
     """
-    ancestors = _get_ancestors(object_name, object_cache)
-
-    # Now descend from super-object downwards,
-    # collecting and updating properties as we go.
-    merged_object = deepcopy(ancestors[0])
-    _init_distributions(merged_object)
-    merged_object['n_ancestors'] = len(ancestors) - 1
+    return _ObjectResolver(object_cache).concatenate_object(object_name)
 
-    for i, next_child in enumerate(ancestors[1:]):
-        # Remove properties that the child does not want to inherit
-        do_not_inherit = next_child.get('do_not_inherit', [])
-        do_not_inherit.extend(['synonyms', 'description', 'do_not_inherit'])
-        for property_to_not_inherit in do_not_inherit:
-            merged_object.pop(property_to_not_inherit, None)
 
-        # Now, for each probability distribution, we tag it with a
-        # 'distance' property, showing how far away it is from
-        # the most derived object.
-        distributions = merged_object.get('distributions', {})
-        for list_of_dists in distributions.values():
-            for dist in list_of_dists:
-                dist['distance'] += 1
+class _ObjectResolver(object):
+    """Concatenates objects with their ancestors and components.
 
-        _init_distributions(next_child)
+    Every concatenated object is memoized.  Parents are always resolved
+    before their children (i.e. objects are processed in topological
+    order) and each child is built from a copy of its parent's
+    already-concatenated object, so each object is concatenated exactly
+    once however many descendants or owners it has.
 
-        recursively_update_dict(merged_object, next_child)
+    Objects in `object_cache` are never modified.
+    """
 
-    return merged_object
+    def __init__(self, object_cache):
+        self.object_cache = object_cache
+        self._objects = {}  # concatenated with ancestors
+        self._appliance_types = {}  # ...and with components
+        self._components_in_progress = set()
+
+    def concatenate_object(self, object_name):
+        """
+        Returns
+        -------
+        dict: the object identified by `object_name` merged with its
+        ancestor tree.  This dict is memoized so do not modify it.
+
+        Raises
+        ------
+        ObjectConcatenationError
+        """
+        # Walk up the inheritance tree until we find an object which
+        # has already been concatenated (or we reach the root).
+        unresolved = []
+        name = object_name
+        while name is not None and name not in self._objects:
+            if name in unresolved:
+                msg = ("Object '{}' is its own ancestor!"
+                       " Inheritance cycle: {}"
+                       .format(name, ' -> '.join(unresolved + [name])))
+                raise ObjectConcatenationError(msg)
+            try:
+                obj = self.object_cache[name]
+            except KeyError:
+                if unresolved:
+                    msg = ("Object '{}' claims its parent is '{}' but that"
+                           " object is not recognised!"
+                           .format(unresolved[-1], name))
+                else:
+                    msg = "'{}' not found!".format(name)
+                raise ObjectConcatenationError(msg)
+            unresolved.append(name)
+            name = obj.get('parent')
+
+        # Now descend from the super-object downwards,
+        # collecting and updating properties as we go.
+        parent = None if name is None else self._objects[name]
+        for name in reversed(unresolved):
+            parent = _concatenate_child(parent, name, self.object_cache[name])
+            self._objects[name] = parent
+
+        return self._objects[object_name]
+
+    def concatenate_appliance_type(self, appliance_type_name):
+        """
+        Returns
+        -------
+        dict: the appliance type merged with its ancestor tree and with
+        components recursively resolved.  This dict is memoized so do not
+        modify it.
+
+        Raises
+        ------
+        ObjectConcatenationError
+        """
+        try:
+            return self._appliance_types[appliance_type_name]
+        except KeyError:
+            pass
 
+        if appliance_type_name in self._components_in_progress:
+            msg = ("Appliance type '{}' is a component of itself!"
+                   .format(appliance_type_name))
+            raise ObjectConcatenationError(msg)
 
-def _get_ancestors(appliance_type_name, appliance_types_from_disk):
+        self._components_in_progress.add(appliance_type_name)
+        try:
+            concatenated_app_type = copy_tree(
+                self.concatenate_object(appliance_type_name))
+            categories = concatenated_app_type.setdefault('categories', {})
+
+            # Instantiate components recursively
+            for component_appliance_obj in concatenated_app_type.get(
+                    'components', []):
+                component_type_obj = self.concatenate_appliance_type(
+                    component_appliance_obj['type'])
+                with phase('recursively_update_dict'):
+                    recursively_update_dict(
+                        component_appliance_obj, component_type_obj)
+
+                # Now merge component categories into owner appliance type
+                if not component_appliance_obj.get('do_not_merge_categories'):
+                    with phase('recursively_update_dict'):
+                        recursively_update_dict(
+                            categories,
+                            component_appliance_obj.get('categories', {}))
+        finally:
+            self._components_in_progress.discard(appliance_type_name)
+
+        self._appliance_types[appliance_type_name] = concatenated_app_type
+        return concatenated_app_type
+
+
+def _concatenate_child(parent, child_name, child):
     """
-    Arguments
-    ---------
-    appliance_type_name: string
+    Parameters
+    ----------
+    parent : dict or None
+        The already-concatenated parent object (not modified).
+        None if `child` is the root of its inheritance tree.
+    child_name : string
+    child : dict
+        The object as loaded from disk (not modified).
 
     Returns
     -------
-    A list of dicts where each dict is an object. The first
-    dict is the highest on the inheritance hierarchy; the last dict
-    is the object with type == `appliance_type_name`.
-
-    Raises
-    ------
-    ObjectConcatenationError
+    merged_object : dict
     """
-    if appliance_type_name is None:
-        return []
-
-    # walk the inheritance tree from
-    # bottom upwards (which is the wrong direction
-    # for actually doing inheritance)
-    try:
-        current_appliance_type_dict = appliance_types_from_disk[
-            appliance_type_name]
-    except KeyError as e:
-        msg = "'{}' not found!".format(appliance_type_name)
-        raise ObjectConcatenationError(msg)
-
-    current_appliance_type_dict['type'] = appliance_type_name
-    ancestors = [current_appliance_type_dict]
-
-    while current_appliance_type_dict.get('parent'):
-        parent_type = current_appliance_type_dict['parent']
-        try:
-            current_appliance_type_dict = appliance_types_from_disk[
-                parent_type]
-        except KeyError as e:
-            msg = ("Object '{}' claims its parent is '{}' but that"
-                   " object is not recognised!"
-                   .format(current_appliance_type_dict['type'], e))
-            raise ObjectConcatenationError(msg)
-
-        current_appliance_type_dict['type'] = parent_type
-        ancestors.append(current_appliance_type_dict)
+    child = _init_distributions(dict(child, type=child_name))
+    if parent is None:
+        merged_object = copy_tree(child)
+        merged_object['n_ancestors'] = 0
+        return merged_object
+
+    merged_object = copy_tree(parent)
+    merged_object['n_ancestors'] = parent.get('n_ancestors', 0) + 1
+
+    # Remove properties that the child does not want to inherit
+    do_not_inherit = child.get('do_not_inherit', []) + [
+        'synonyms', 'description', 'do_not_inherit']
+    for property_to_not_inherit in do_not_inherit:
+        merged_object.pop(property_to_not_inherit, None)
+
+    # Now, for each probability distribution, we tag it with a
+    # 'distance' property, showing how far away it is from
+    # the most derived object.
+    distributions = merged_object.get('distributions', {})
+    for list_of_dists in distributions.values():
+        for dist in list_of_dists:
+            dist['distance'] += 1
 
-    ancestors.reverse()
-    return ancestors
+    with phase('recursively_update_dict'):
+        recursively_update_dict(merged_object, child)
+    return merged_object
 
 
 def recursively_update_dict(dict_to_update, source_dict):
@@ -160,26 +502,55 @@ def recursively_update_dict(dict_to_update, source_dict):
     This function is required because Python's `dict.update()` function
     does not descend into dicts within dicts.
 
+    Lists which do not contain any dicts are de-duplicated, preserving
+    the order in which items first appear.
+
+    `source_dict` is never modified and nothing in `dict_to_update` will
+    refer to a mutable object in `source_dict`, but only the values which
+    are actually inserted into `dict_to_update` are copied.
+
     Parameters
     ----------
     dict_to_update, source_dict : dict
         Updates `dict_to_update` in place.
     """
-    source_dict = deepcopy(source_dict)
     for key_from_source, value_from_source in iteritems(source_dict):
         try:
             value_to_update = dict_to_update[key_from_source]
         except KeyError:
-            dict_to_update[key_from_source] = value_from_source
+            dict_to_update[key_from_source] = copy_tree(value_from_source)
         else:
             if isinstance(value_from_source, dict):
                 assert isinstance(value_to_update, dict)
                 recursively_update_dict(value_to_update, value_from_source)
             elif isinstance(value_from_source, list):
                 assert isinstance(value_to_update, list)
-                value_to_update.extend(value_from_source)
-                if not any([isinstance(v, dict) for v in value_to_update]):
+                value_to_update.extend(
+                    copy_tree(v) for v in value_from_source)
+                if not any(isinstance(v, dict) for v in value_to_update):
                     dict_to_update[key_from_source] = list(
-                        set(value_to_update))
+                        dict.fromkeys(value_to_update))
             else:
-                dict_to_update[key_from_source] = value_from_source
+                dict_to_update[key_from_source] = copy_tree(value_from_source)
+
+
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def copy_tree(obj):
+    """Deep copy of a tree of dicts and lists.
+
+    Much faster than `copy.deepcopy` for the plain YAML-derived structures
+    used throughout NILM Metadata.  Immutable leaves (strings, numbers,
+    None) are shared rather than copied.  Anything else falls back to
+    `copy.deepcopy`.
+    """
+    obj_type = type(obj)
+    if obj_type is dict:
+        return {key: copy_tree(value) for key, value in iteritems(obj)}
+    elif obj_type is list:
+        return [copy_tree(value) for value in obj]
+    elif obj_type in _IMMUTABLE_TYPES:
+        return obj
+    else:
+        return deepcopy(obj)
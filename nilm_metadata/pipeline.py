@@ -0,0 +1,174 @@
+from __future__ import print_function, division
+import threading
+from time import perf_counter
+from six.moves import queue
+
+_DONE = object()
+
+
+class _Failure(object):
+    """Wraps an exception raised by a stage so that it travels down the
+    pipeline in order and is re-raised by the consumer."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class StageStats(object):
+    """Timing counters for one pipeline stage.
+
+    Attributes
+    ----------
+    items : int
+        Number of items processed.
+    busy : float
+        Seconds spent in the stage's function.
+    waiting_for_input : float
+        Seconds spent waiting for the upstream stage.
+    waiting_for_output : float
+        Seconds spent blocked because the downstream queue was full
+        (i.e. backpressure).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting_for_input = 0.0
+        self.waiting_for_output = 0.0
+
+    def to_dict(self):
+        return {'items': self.items, 'busy': self.busy,
+                'waiting_for_input': self.waiting_for_input,
+                'waiting_for_output': self.waiting_for_output}
+
+    def __repr__(self):
+        return ('{}: {:d} items, {:.3f}s busy, {:.3f}s waiting for input,'
+                ' {:.3f}s waiting for output'
+                .format(self.name, self.items, self.busy,
+                        self.waiting_for_input, self.waiting_for_output))
+
+
+class Pipeline(object):
+    """Runs a sequence of stages concurrently, one thread per stage,
+    connected by bounded queues.
+
+    Items leave the pipeline in the order they entered it.  If a stage
+    raises an exception then it is re-raised when the consumer reaches
+    that item; later items are not processed further.  Every stage has its
+    own thread, so the consumer (the thread iterating over `run()`, e.g.
+    the single writer of an HDF5 file) overlaps with all of them.
+
+    Parameters
+    ----------
+    stages : list of (name, function) tuples
+        Each function takes one item and returns the item for the next
+        stage.
+    maxsize : int
+        Maximum number of items waiting between any two stages.
+
+    Attributes
+    ----------
+    stats : list of StageStats, one per stage plus one for the consumer
+        (named 'consumer').
+    """
+
+    def __init__(self, stages, maxsize=4):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.stats = [StageStats(name) for name, _ in stages]
+        self.stats.append(StageStats('consumer'))
+        self._stop = threading.Event()
+
+    def run(self, items):
+        """
+        Parameters
+        ----------
+        items : iterable of inputs to the first stage
+
+        Returns
+        -------
+        generator of outputs of the last stage
+        """
+        queues = [queue.Queue(self.maxsize)
+                  for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(
+            target=self._feed, args=(iter(items), queues[0]), daemon=True)]
+        for i, (name, function) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._work,
+                args=(function, self.stats[i], queues[i], queues[i+1]),
+                daemon=True))
+        consumer_stats = self.stats[-1]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                start = perf_counter()
+                item = queues[-1].get()
+                consumer_stats.waiting_for_input += perf_counter() - start
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                start = perf_counter()
+                yield item
+                consumer_stats.busy += perf_counter() - start
+                consumer_stats.items += 1
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _feed(self, items, output_queue):
+        try:
+            for item in items:
+                if not self._put(output_queue, item):
+                    return
+        except Exception as e:
+            self._put(output_queue, _Failure(e))
+        else:
+            self._put(output_queue, _DONE)
+
+    def _work(self, function, stats, input_queue, output_queue):
+        while not self._stop.is_set():
+            start = perf_counter()
+            item = self._get(input_queue)
+            stats.waiting_for_input += perf_counter() - start
+            if item is None:
+                return
+            if item is not _DONE and not isinstance(item, _Failure):
+                start = perf_counter()
+                try:
+                    item = function(item)
+                except Exception as e:
+                    item = _Failure(e)
+                stats.busy += perf_counter() - start
+                stats.items += 1
+            start = perf_counter()
+            if not self._put(output_queue, item):
+                return
+            stats.waiting_for_output += perf_counter() - start
+            if item is _DONE or isinstance(item, _Failure):
+                return
+
+    def _put(self, output_queue, item):
+        """Returns False if the pipeline was stopped before `item` could be
+        put."""
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, input_queue):
+        """Returns None if the pipeline was stopped."""
+        while not self._stop.is_set():
+            try:
+                return input_queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        return None
@@ -0,0 +1,230 @@
+"""Optional instrumentation of the conversion and concatenation paths.
+
+Profiling is off by default and then costs one global lookup per
+instrumented phase.  Turn it on in any of three ways:
+
+* set the environment variable NILM_METADATA_PROFILE to '1' (print a
+  JSON summary to stderr) or to a filename (append one JSON summary per
+  line to that file);
+* register a callback with `add_listener`, which is called with the
+  summary dict;
+* wrap code in `with profile() as profiler:` and call
+  `profiler.summary()`.
+
+A summary is emitted at the end of each outermost profiled call to
+`convert_yaml_to_hdf5`, `save_yaml_to_datastore` or `get_appliance_types`.
+Phase times are inclusive (e.g. 'parse_yaml' within
+'concatenate_appliance_types' counts towards both) and are summed over
+threads.  Work done in worker processes (`workers` > 1) is not recorded.
+"""
+from __future__ import print_function, division
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from functools import wraps
+from time import perf_counter
+from six import iteritems
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_ENV_VAR = 'NILM_METADATA_PROFILE'
+
+# The Profiler recording the outermost profiled call in progress, if any.
+_profiler = None
+_listeners = []
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, perf_counter() - self.start)
+
+
+class Profiler(object):
+    """Accumulates wall time, call counts and bytes read per phase.
+
+    Thread-safe, so phases running in pipeline threads are recorded too.
+
+    Parameters
+    ----------
+    name : str
+        Name of the profiled call, e.g. 'convert_yaml_to_hdf5'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._start = perf_counter()
+        self._wall_time = None
+
+    def phase(self, name):
+        """Context manager which times one call of phase `name`."""
+        return _Phase(self, name)
+
+    def record(self, name, seconds, calls=1, bytes_read=0):
+        with self._lock:
+            phase = self._phases.get(name)
+            if phase is None:
+                phase = self._phases[name] = {
+                    'calls': 0, 'seconds': 0.0, 'bytes_read': 0}
+            phase['calls'] += calls
+            phase['seconds'] += seconds
+            phase['bytes_read'] += bytes_read
+
+    def stop(self):
+        self._wall_time = perf_counter() - self._start
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict with keys:
+        * 'name'
+        * 'wall_time' : seconds
+        * 'phases' : dict mapping phase name to a dict of 'calls',
+          'seconds' and 'bytes_read'
+        * 'peak_rss_bytes' : peak resident set size of the process so far
+          (None if unavailable)
+        * 'peak_traced_bytes' : peak memory traced by `tracemalloc`
+          (None unless tracemalloc is tracing)
+        """
+        wall_time = self._wall_time
+        if wall_time is None:
+            wall_time = perf_counter() - self._start
+        with self._lock:
+            phases = {name: dict(phase)
+                      for name, phase in iteritems(self._phases)}
+        return {'name': self.name,
+                'wall_time': wall_time,
+                'phases': phases,
+                'peak_rss_bytes': _peak_rss_bytes(),
+                'peak_traced_bytes': (tracemalloc.get_traced_memory()[1]
+                                      if tracemalloc.is_tracing() else None)}
+
+
+def add_listener(callback):
+    """Call `callback(summary)` at the end of every profiled call.
+    Registering a listener turns profiling on."""
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    _listeners.remove(callback)
+
+
+class _Session(object):
+    """Context manager which starts a Profiler, unless one is already
+    running, in which case it just times phase `name`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _profiler
+        if _profiler is not None:
+            self._owner = False
+            self._phase = _profiler.phase(self.name).__enter__()
+        else:
+            self._owner = True
+            _profiler = Profiler(self.name)
+        return _profiler
+
+    def __exit__(self, *args):
+        global _profiler
+        if not self._owner:
+            self._phase.__exit__(*args)
+            return
+        profiler = _profiler
+        _profiler = None
+        profiler.stop()
+        _emit(profiler.summary())
+
+
+def profile(name='profile'):
+    """Profile everything run in a `with` block.
+
+    Examples
+    --------
+    >>> with profile() as profiler:
+    ...     get_appliance_types()
+    >>> profiler.summary()['phases']['parse_yaml']['calls']
+    """
+    return _Session(name)
+
+
+def profiled(name):
+    """Decorator which profiles each outermost call of the decorated
+    function if profiling is on."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None and not is_enabled():
+                return function(*args, **kwargs)
+            with _Session(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_enabled():
+    """True if the environment variable is set or listeners are registered."""
+    return bool(_listeners) or bool(os.environ.get(PROFILE_ENV_VAR))
+
+
+def phase(name):
+    """Context manager which times phase `name` if profiling is running."""
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.phase(name)
+
+
+def add_bytes_read(name, n_bytes):
+    """Count `n_bytes` as read during phase `name`."""
+    if _profiler is not None:
+        _profiler.record(name, 0.0, calls=0, bytes_read=n_bytes)
+
+
+def _emit(summary):
+    for callback in list(_listeners):
+        callback(summary)
+    destination = os.environ.get(PROFILE_ENV_VAR)
+    if not destination:
+        return
+    line = json.dumps(summary, sort_keys=True)
+    if destination.lower() in ['1', 'true', 'stderr']:
+        print(line, file=sys.stderr)
+    else:
+        with open(destination, 'a') as fh:
+            fh.write(line + '\n')
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
@@ -0,0 +1,488 @@
+"""Compact, column-oriented records of a building's ElecMeters and
+Appliances.
+
+As nested dicts, a typical meter (a device_model, submeter_of, its
+data_location and a timeframe) costs several hundred bytes of dicts and
+strings, so holding the metadata of tens of thousands of meters costs
+tens of megabytes.  `ElecMeterRecords` and `ApplianceRecords` instead
+store each commonly used field of every record in one column
+(struct-of-arrays):
+
+* numbers and booleans in `array.array`s and `bytearray`s;
+* values which many records share (e.g. device_model, appliance type and
+  timeframe) once each, plus an index per record;
+* appliances' meter lists in one flat array of meter IDs;
+* each meter's default data_location (e.g. '/building1/elec/meter2') as
+  a single byte.
+
+Values which do not fit a field's column (e.g. a string submeter_of), and
+keys which are not in `FIELDS`, are kept unchanged in a per-record dict,
+so records round-trip losslessly to the dict schema.  Looking a record up
+builds a new dict, which shares no mutable objects with the records.
+
+`load_building_records` loads a building YAML file straight into records,
+one ElecMeter or Appliance at a time (see `streaming.iter_building`), so
+the dicts of a whole building are never held at once.
+"""
+from __future__ import print_function, division
+from array import array
+from collections.abc import Mapping, Sequence
+from six import iteritems
+from nilm_metadata.object_concatenation import copy_tree
+from nilm_metadata.interning import _canonical
+from nilm_metadata.streaming import iter_building, ELEC_METER, APPLIANCE
+from nilm_metadata.profiling import phase
+
+# Integers beyond this cannot be stored exactly in a float64 column.
+_MAX_EXACT_INT = 2 ** 53
+
+
+class _Missing(object):
+    """Returned by columns for records which do not have the field."""
+
+    def __reduce__(self):
+        return '_MISSING'  # unpickle as the singleton
+
+
+_MISSING = _Missing()
+
+
+class _NumberColumn(object):
+    """ints and floats (not bools), in a float64 array."""
+
+    _INT, _FLOAT = 1, 2
+
+    def __init__(self):
+        self._values = array('d')
+        self._kinds = bytearray()  # 0 if missing
+
+    def append(self, value, instance):
+        if type(value) is int and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+            kind = self._INT
+        elif type(value) is float:
+            kind = self._FLOAT
+        else:
+            return False
+        self._values.append(value)
+        self._kinds.append(kind)
+        return True
+
+    def append_missing(self):
+        self._values.append(0.0)
+        self._kinds.append(0)
+
+    def get(self, row, instance):
+        kind = self._kinds[row]
+        if not kind:
+            return _MISSING
+        value = self._values[row]
+        return int(value) if kind == self._INT else value
+
+
+class _BooleanColumn(object):
+
+    def __init__(self):
+        self._values = bytearray()  # 0 if missing, 1 for False, 2 for True
+
+    def append(self, value, instance):
+        if type(value) is not bool:
+            return False
+        self._values.append(1 + value)
+        return True
+
+    def append_missing(self):
+        self._values.append(0)
+
+    def get(self, row, instance):
+        value = self._values[row]
+        return _MISSING if not value else value == 2
+
+
+class _SharedColumn(object):
+    """Values of any type, each distinct value stored once."""
+
+    def __init__(self):
+        self._codes = array('i')  # -1 if missing
+        self._values = []
+        self._code_by_key = {}
+
+    def append(self, value, instance):
+        key = _canonical(value)
+        code = self._code_by_key.get(key)
+        if code is None:
+            code = self._code_by_key[key] = len(self._values)
+            self._values.append(copy_tree(value))
+        self._codes.append(code)
+        return True
+
+    def append_missing(self):
+        self._codes.append(-1)
+
+    def get(self, row, instance):
+        code = self._codes[row]
+        return _MISSING if code < 0 else copy_tree(self._values[code])
+
+
+class _ObjectColumn(object):
+    """Values of any type, for fields whose values are usually unique
+    (e.g. original_name), where sharing would cost more than it saves."""
+
+    def __init__(self):
+        self._values = []
+
+    def append(self, value, instance):
+        self._values.append(copy_tree(value))
+        return True
+
+    def append_missing(self):
+        self._values.append(_MISSING)
+
+    def get(self, row, instance):
+        value = self._values[row]
+        return value if value is _MISSING else copy_tree(value)
+
+
+class _IntListColumn(object):
+    """Lists of integers, concatenated into one int64 array."""
+
+    def __init__(self):
+        self._values = array('q')
+        self._ends = array('q')
+        self._present = bytearray()
+
+    def append(self, value, instance):
+        if type(value) is not list or not all(
+                type(item) is int and -2**63 <= item < 2**63
+                for item in value):
+            return False
+        self._values.extend(value)
+        self._ends.append(len(self._values))
+        self._present.append(1)
+        return True
+
+    def append_missing(self):
+        self._ends.append(len(self._values))
+        self._present.append(0)
+
+    def get(self, row, instance):
+        if not self._present[row]:
+            return _MISSING
+        start = self._ends[row - 1] if row else 0
+        return self._values[start:self._ends[row]].tolist()
+
+
+class _DataLocationColumn(object):
+    """Only records whether a meter's data_location is the default for
+    its building and instance, e.g. '/building1/elec/meter2'."""
+
+    def __init__(self):
+        self.building = None
+        self._is_default = bytearray()
+
+    def default(self, instance):
+        return '/{}/elec/meter{}'.format(self.building, instance)
+
+    def append(self, value, instance):
+        if self.building is None or value != self.default(instance):
+            return False
+        self._is_default.append(1)
+        return True
+
+    def append_missing(self):
+        self._is_default.append(0)
+
+    def get(self, row, instance):
+        if not self._is_default[row]:
+            return _MISSING
+        return self.default(instance)
+
+
+class _Raw(object):
+    """Holds a record which is not a dict (e.g. an invalid appliance), so
+    that it too round-trips."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Records(object):
+    """Base class storing records in the columns listed in `FIELDS`, a
+    sequence of (key, column class) pairs."""
+    FIELDS = ()
+
+    def __init__(self):
+        self._columns = [(key, column()) for key, column in self.FIELDS]
+        self._columns_by_key = dict(self._columns)
+        self._extras = []  # per record: None, a dict of other keys or _Raw
+
+    def _append(self, metadata, instance):
+        if not isinstance(metadata, dict):
+            for _, column in self._columns:
+                column.append_missing()
+            self._extras.append(_Raw(copy_tree(metadata)))
+            return
+        extra = {}
+        stored = set()
+        for key, value in iteritems(metadata):
+            column = self._columns_by_key.get(key)
+            if column is not None and column.append(value, instance):
+                stored.add(key)
+            else:
+                extra[key] = copy_tree(value)
+        for key, column in self._columns:
+            if key not in stored:
+                column.append_missing()
+        self._extras.append(extra or None)
+
+    def _record(self, row, instance):
+        extra = self._extras[row]
+        if isinstance(extra, _Raw):
+            return copy_tree(extra.value)
+        record = {}
+        for key, column in self._columns:
+            value = column.get(row, instance)
+            if value is not _MISSING:
+                record[key] = value
+        if extra:
+            record.update(copy_tree(extra))
+        return record
+
+
+class ElecMeterRecords(_Records, Mapping):
+    """A building's ElecMeters.
+
+    A read-only mapping from meter instance to a dict of the meter's
+    metadata, built on each lookup.
+
+    Parameters
+    ----------
+    building : str, optional
+        e.g. 'building1'.  If given then data_locations which are the
+        default for this building take no space.
+    elec_meters : dict, optional
+        Maps meter instance to meter metadata.
+    """
+    FIELDS = (
+        ('device_model', _SharedColumn),
+        ('submeter_of', _NumberColumn),
+        ('site_meter', _BooleanColumn),
+        ('utility_meter', _BooleanColumn),
+        ('data_location', _DataLocationColumn),
+        ('timeframe', _SharedColumn),
+        ('name', _ObjectColumn),
+        ('phase', _SharedColumn),
+        ('room', _SharedColumn),
+        ('disabled', _BooleanColumn),
+        ('sample_period', _NumberColumn),
+        ('max_sample_period', _NumberColumn))
+
+    def __init__(self, building=None, elec_meters=None):
+        super(ElecMeterRecords, self).__init__()
+        self.building = building
+        self._columns_by_key['data_location'].building = building
+        # While the meter instances are 1..N (as they usually are) they are
+        # implied by the rows, so neither list is needed.
+        self._instances = None
+        self._rows = None
+        for meter_instance, meter in iteritems(elec_meters or {}):
+            self.append(meter_instance, meter)
+
+    def append(self, meter_instance, meter):
+        if meter_instance in self:
+            raise KeyError("Meter {} is already in the records."
+                           .format(meter_instance))
+        row = len(self)
+        if self._rows is None and (type(meter_instance) is not int or
+                                   meter_instance != row + 1):
+            self._instances = list(range(1, row + 1))
+            self._rows = {instance: i
+                          for i, instance in enumerate(self._instances)}
+        if self._rows is not None:
+            self._instances.append(meter_instance)
+            self._rows[meter_instance] = row
+        self._append(meter, meter_instance)
+
+    def _row(self, meter_instance):
+        if self._rows is not None:
+            return self._rows[meter_instance]
+        if type(meter_instance) is int and 1 <= meter_instance <= len(self):
+            return meter_instance - 1
+        raise KeyError(meter_instance)
+
+    def __getitem__(self, meter_instance):
+        try:
+            row = self._row(meter_instance)
+        except TypeError:  # unhashable
+            raise KeyError(meter_instance)
+        return self._record(row, meter_instance)
+
+    def __contains__(self, meter_instance):
+        try:
+            self._row(meter_instance)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        if self._instances is None:
+            return iter(range(1, len(self) + 1))
+        return iter(self._instances)
+
+    def __len__(self):
+        return len(self._extras)
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict mapping meter instance to meter metadata.
+        """
+        return {meter_instance: self._record(row, meter_instance)
+                for row, meter_instance in enumerate(self)}
+
+
+class ApplianceRecords(_Records, Sequence):
+    """A building's Appliances.
+
+    A read-only sequence of dicts of appliance metadata, built on each
+    lookup.
+
+    Parameters
+    ----------
+    appliances : list of dicts, optional
+    """
+    FIELDS = (
+        ('type', _SharedColumn),
+        ('instance', _NumberColumn),
+        ('meters', _IntListColumn),
+        ('original_name', _ObjectColumn),
+        ('room', _SharedColumn),
+        ('dominant_appliance', _BooleanColumn),
+        ('on_power_threshold', _NumberColumn),
+        ('max_power', _NumberColumn),
+        ('multiple', _BooleanColumn),
+        ('count', _NumberColumn),
+        ('subtype', _SharedColumn),
+        ('dates_active', _SharedColumn))
+
+    def __init__(self, appliances=None):
+        super(ApplianceRecords, self).__init__()
+        for appliance in appliances or []:
+            self.append(appliance)
+
+    def append(self, appliance):
+        self._append(appliance, len(self._extras))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("appliance index out of range")
+        return self._record(index, index)
+
+    def __len__(self):
+        return len(self._extras)
+
+    def to_list(self):
+        return [self._record(row, row) for row in range(len(self))]
+
+
+class BuildingRecords(object):
+    """A building's metadata, with its ElecMeters and Appliances stored
+    as records.
+
+    Parameters
+    ----------
+    building : str, optional
+        e.g. 'building1'.  See `ElecMeterRecords`.
+
+    Attributes
+    ----------
+    metadata : dict
+        Every key of the building's metadata except 'elec_meters' and
+        'appliances' (unless they are not a dict and a list).
+    elec_meters : ElecMeterRecords or None
+    appliances : ApplianceRecords or None
+        None if the building has no 'elec_meters' (or 'appliances').
+    """
+
+    def __init__(self, building=None):
+        self.building = building
+        self.metadata = {}
+        self.elec_meters = None
+        self.appliances = None
+
+    @classmethod
+    def from_dict(cls, building_metadata, building=None):
+        records = cls(building)
+        for key, value in iteritems(building_metadata):
+            records.set(key, value)
+        return records
+
+    def set(self, key, value):
+        """Sets a key of the building's metadata."""
+        if key == 'elec_meters' and isinstance(value, dict):
+            self.elec_meters = ElecMeterRecords(self.building, value)
+        elif key == 'appliances' and isinstance(value, list):
+            self.appliances = ApplianceRecords(value)
+        else:
+            self.metadata[key] = value
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict of building metadata, equal to the dict the records were
+        made from.
+        """
+        building_metadata = copy_tree(self.metadata)
+        if self.elec_meters is not None:
+            building_metadata['elec_meters'] = self.elec_meters.to_dict()
+        if self.appliances is not None:
+            building_metadata['appliances'] = self.appliances.to_list()
+        return building_metadata
+
+
+def as_building_dict(building_metadata):
+    """
+    Returns
+    -------
+    `building_metadata` if it is a dict, else the dict of a
+    BuildingRecords.
+    """
+    if isinstance(building_metadata, BuildingRecords):
+        return building_metadata.to_dict()
+    return building_metadata
+
+
+def load_building_records(stream, building=None):
+    """Loads a building YAML document into records with `iter_building`.
+
+    Parameters
+    ----------
+    stream : file-like object, bytes or str
+    building : str, optional
+        e.g. 'building1'.  If given then each ElecMeter's `data_location`
+        is set, as by `streaming.load_building`.
+
+    Returns
+    -------
+    BuildingRecords whose `to_dict()` equals
+    `streaming.load_building(stream, building)`.
+    """
+    records = BuildingRecords(building)
+    with phase('parse_yaml'):
+        for kind, key, value in iter_building(stream):
+            if kind == ELEC_METER:
+                if building is not None and isinstance(value, dict):
+                    value['data_location'] = '/{:s}/elec/meter{}'.format(
+                        building, key)
+                records.elec_meters.append(key, value)
+            elif kind == APPLIANCE:
+                records.appliances.append(value)
+            else:
+                records.set(key, value)
+    return records
@@ -0,0 +1,359 @@
+"""Type checks for dataset, meter device and building metadata, following
+the schema in docs/source/dataset_metadata.rst.
+
+The schema below is compiled once into Python source code (straight-line
+`isinstance` checks, one function per object type) which is then
+`exec`ed, so validating a building is a few plain function calls rather
+than an interpreted walk over a schema dict.  Each appliance type's
+`additional_properties` (already merged down the inheritance tree by the
+concatenation code) are compiled into a validator for that type.
+
+Keys which are not in the schema are not checked.  A null value is
+treated as if the key were absent.
+"""
+from __future__ import print_function, division
+from datetime import date
+from six import iteritems
+
+TIMEFRAME = {
+    'start': {'type': 'timestamp'},
+    'end': {'type': 'timestamp'},
+}
+
+DATASET = {
+    'name': {'type': 'string'},
+    'long_name': {'type': 'string'},
+    'creators': {'type': 'array', 'items': {'type': 'string'}},
+    'timezone': {'type': 'string'},
+    'date': {'type': 'timestamp'},
+    'contact': {'type': 'string'},
+    'institution': {'type': 'string'},
+    'description': {'type': 'string'},
+    'number_of_buildings': {'type': 'integer'},
+    'identifier': {'type': 'string'},
+    'subject': {'type': 'string'},
+    'geospatial_coverage': {'type': 'string'},
+    'timeframe': {'$ref': 'timeframe'},
+    'funding': {'type': 'array', 'items': {'type': 'string'}},
+    'publisher': {'type': 'string'},
+    'geo_location': {'type': 'object'},
+    'rights_list': {'type': 'array', 'items': {'type': 'object'}},
+    'description_of_subjects': {'type': 'string'},
+    'related_documents': {'type': 'array'},
+    'schema': {'type': 'string'},
+}
+
+METER_DEVICE = {
+    'model': {'type': 'string'},
+    'model_url': {'type': 'string'},
+    'manufacturer': {'type': 'string'},
+    'manufacturer_url': {'type': 'string'},
+    'sample_period': {'type': 'number'},
+    'max_sample_period': {'type': 'number'},
+    'measurements': {'type': 'array', 'items': {'type': 'object'}},
+    'description': {'type': 'string'},
+    'pre_pay': {'type': 'boolean'},
+    'wireless': {'type': 'boolean'},
+    'wireless_configuration': {'type': 'object'},
+    'data_logger': {'type': 'string'},
+}
+
+ELEC_METER = {
+    'device_model': {'type': 'string'},
+    'submeter_of': {'type': 'integer'},
+    'submeter_of_is_uncertain': {'type': 'boolean'},
+    'upstream_meter_in_building': {'type': 'integer'},
+    'site_meter': {'type': 'boolean'},
+    'utility_meter': {'type': 'boolean'},
+    'timeframe': {'$ref': 'timeframe'},
+    'name': {'type': 'string'},
+    'phase': {'type': ['integer', 'string']},
+    'room': {'type': 'string'},
+    'floor': {'type': 'integer'},
+    'data_location': {'type': 'string'},
+    'disabled': {'type': 'boolean'},
+    'preprocessing_applied': {'type': 'object'},
+    'statistics': {'type': 'array', 'items': {'type': 'object'}},
+    'sample_period': {'type': 'number'},
+    'max_sample_period': {'type': 'number'},
+}
+
+APPLIANCE = {
+    'type': {'type': 'string'},
+    'instance': {'type': 'integer'},
+    'meters': {'type': 'array', 'items': {'type': 'integer'}},
+    'dominant_appliance': {'type': 'boolean'},
+    'on_power_threshold': {'type': 'number'},
+    'max_power': {'type': 'number'},
+    'min_off_duration': {'type': 'number'},
+    'min_on_duration': {'type': 'number'},
+    'room': {'type': 'string'},
+    'multiple': {'type': 'boolean'},
+    'count': {'type': 'integer'},
+    'control': {'type': 'array', 'items': {'type': 'string'}},
+    'efficiency_rating': {'type': 'object'},
+    'nominal_consumption': {'type': 'object'},
+    'components': {'type': 'array', 'items': {'type': 'object'}},
+    'model': {'type': 'string'},
+    'manufacturer': {'type': 'string'},
+    'brand': {'type': 'string'},
+    'original_name': {'type': 'string'},
+    'model_url': {'type': 'string'},
+    'manufacturer_url': {'type': 'string'},
+    'dates_active': {'type': 'array', 'items': {'$ref': 'timeframe'}},
+    'year_of_purchase': {'type': 'integer'},
+    'year_of_manufacture': {'type': 'integer'},
+    'subtype': {'type': 'string'},
+    'part_number': {'type': 'string'},
+    'gtin': {'type': 'integer'},
+    'version': {'type': 'string'},
+    'portable': {'type': 'boolean'},
+}
+
+BUILDING = {
+    'instance': {'type': 'integer'},
+    'original_name': {'type': 'string'},
+    'elec_meters': {'type': 'object', 'keys': {'type': 'integer'},
+                    'values': {'$ref': 'elec_meter'}},
+    'appliances': {'type': 'array', 'items': {'$ref': 'appliance'}},
+    'description': {'type': 'string'},
+    'rooms': {'type': 'array', 'items': {
+        'type': 'object', 'properties': {
+            'name': {'type': 'string'},
+            'instance': {'type': 'integer'},
+            'description': {'type': 'string'},
+            'floor': {'type': 'integer'}}}},
+    'n_occupants': {'type': 'integer'},
+    'description_of_occupants': {'type': 'string'},
+    'timeframe': {'$ref': 'timeframe'},
+    'periods_unoccupied': {'type': 'array', 'items': {'$ref': 'timeframe'}},
+    'construction_year': {'type': 'integer'},
+    'energy_improvements': {'type': 'array', 'items': {'type': 'string'}},
+    'heating': {'type': 'array', 'items': {'type': 'string'}},
+    'communal_boiler': {'type': 'boolean'},
+    'ownership': {'enum': ['rented', 'bought']},
+    'building_type': {'type': 'string'},
+}
+
+# Python expression testing whether `{0}` has each schema type.
+_TYPE_TESTS = {
+    'string': 'isinstance({0}, str)',
+    'number': '(isinstance({0}, (int, float)) and'
+              ' not isinstance({0}, bool))',
+    'integer': '(isinstance({0}, int) and not isinstance({0}, bool))',
+    'boolean': 'isinstance({0}, bool)',
+    'array': 'isinstance({0}, (list, tuple))',
+    'object': 'isinstance({0}, dict)',
+    'timestamp': 'isinstance({0}, (str, date))',
+}
+
+
+class SchemaValidator(object):
+    """Compiled type checks for NILM Metadata.
+
+    Parameters
+    ----------
+    appliance_types : dict, optional
+        Concatenated appliance types.  The `additional_properties` of each
+        are checked on appliances of that type.
+
+    Attributes
+    ----------
+    source : str
+        The generated Python source code.
+    """
+
+    def __init__(self, appliance_types=None):
+        compiler = _Compiler()
+        compiler.function('check_timeframe', TIMEFRAME)
+        compiler.function('check_dataset', DATASET)
+        compiler.function('check_meter_device', METER_DEVICE)
+        compiler.function('check_elec_meter', ELEC_METER)
+        compiler.function('check_appliance', APPLIANCE)
+
+        appliance_checks = {}
+        for name, appliance_type in sorted(
+                iteritems(appliance_types or {})):
+            additional_properties = appliance_type.get(
+                'additional_properties')
+            if additional_properties:
+                properties = dict(APPLIANCE)
+                properties.update(additional_properties)
+                appliance_checks[name] = compiler.function(
+                    'check_appliance_{:d}'.format(len(appliance_checks)),
+                    properties)
+        compiler.lines.append('APPLIANCE_CHECKS = {')
+        for name, function_name in sorted(iteritems(appliance_checks)):
+            compiler.lines.append('    {!r}: {},'.format(name, function_name))
+        compiler.lines.append('}')
+        compiler.lines.append('')
+        compiler.function('check_building', BUILDING)
+
+        self.source = '\n'.join(compiler.lines)
+        namespace = {'date': date, 'MISSING': _MISSING,
+                     'type_error': _type_error,
+                     'appliance_type': _appliance_type}
+        exec(compile(self.source, '<nilm_metadata schema>', 'exec'),
+             namespace)
+        self._check_dataset = namespace['check_dataset']
+        self._check_meter_device = namespace['check_meter_device']
+        self._check_building = namespace['check_building']
+
+    def check_dataset(self, dataset_metadata):
+        """
+        Returns
+        -------
+        list of error message strings.
+        """
+        errors = []
+        self._check_dataset(dataset_metadata, 'dataset', errors)
+        return errors
+
+    def check_meter_devices(self, meter_devices):
+        errors = []
+        if not isinstance(meter_devices, dict):
+            errors.append(_type_error('', 'meter_devices', 'an object',
+                                      meter_devices))
+            return errors
+        for model, meter_device in iteritems(meter_devices):
+            self._check_meter_device(
+                meter_device, 'meter_devices[{!r}]'.format(model), errors)
+        return errors
+
+    def check_building(self, building_metadata, building='building'):
+        errors = []
+        self._check_building(building_metadata, building, errors)
+        return errors
+
+
+class _Missing(object):
+    def __repr__(self):
+        return 'MISSING'
+
+
+_MISSING = _Missing()
+
+
+def _appliance_type(appliance):
+    if isinstance(appliance, dict):
+        appliance_type = appliance.get('type')
+        if isinstance(appliance_type, str):
+            return appliance_type
+    return None
+
+
+def _type_error(path, key, expected, value):
+    return "{}{} must be {}, not {!r}.".format(
+        path, key, expected, value)
+
+
+class _Compiler(object):
+    """Generates the source of one checking function per object type."""
+
+    def __init__(self):
+        self.lines = []
+        self._n_functions = 0
+
+    def function(self, name, properties):
+        """Appends `def name(obj, path, errors)`, which checks that `obj`
+        is a dict whose values match `properties`.  Returns `name`."""
+        nested = []
+        body = []
+        for key, spec in sorted(iteritems(properties)):
+            if not isinstance(spec, dict):
+                continue
+            body.append("    value = obj.get({!r}, MISSING)".format(key))
+            body.append("    if value is not MISSING and value is not None:")
+            body.extend(self._check('value', spec, 'path',
+                                    repr('.{}'.format(key)), 8, nested))
+        self.lines.extend(nested)
+        self.lines.append("def {}(obj, path, errors):".format(name))
+        self.lines.append("    if not isinstance(obj, dict):")
+        self.lines.append("        errors.append(type_error("
+                          "'', path, 'an object', obj))")
+        self.lines.append("        return")
+        self.lines.extend(body or ['    pass'])
+        self.lines.append('')
+        return name
+
+    def _check(self, value, spec, path, key, indent, nested):
+        """
+        Returns
+        -------
+        list of source lines checking that the Python expression `value`
+        matches `spec`.  `path + key` is a Python expression for the
+        location used in error messages.
+        """
+        pad = ' ' * indent
+        lines = []
+        if spec.get('$ref') == 'appliance':
+            # Dispatch on appliance type to pick up additional_properties.
+            lines.append(
+                "{}APPLIANCE_CHECKS.get(appliance_type({}), check_appliance)"
+                "({}, {} + {}, errors)".format(pad, value, value, path, key))
+            return lines
+        elif '$ref' in spec:
+            lines.append("{}check_{}({}, {} + {}, errors)".format(
+                pad, spec['$ref'], value, path, key))
+            return lines
+
+        if 'enum' in spec:
+            lines.append("{}if {} not in {!r}:".format(
+                pad, value, tuple(spec['enum'])))
+            lines.append("{}    errors.append(type_error({}, {}, {!r}, {}))"
+                         .format(pad, path, key,
+                                 'one of {}'.format(list(spec['enum'])),
+                                 value))
+
+        types = spec.get('type')
+        if isinstance(types, str):
+            types = [types]
+        tests = [_TYPE_TESTS[t].format(value) for t in types or []
+                 if t in _TYPE_TESTS]
+        if not tests:
+            return lines or [pad + 'pass']
+        expected = ' or '.join(
+            ('an ' if t[0] in 'aeiou' else 'a ') + t for t in types)
+        lines.append("{}if not ({}):".format(pad, ' or '.join(tests)))
+        lines.append("{}    errors.append(type_error({}, {}, {!r}, {}))"
+                     .format(pad, path, key, expected, value))
+
+        # Check the contents of containers of the right type.
+        # Loop variables are suffixed with the indent so that nested
+        # loops do not clobber each other.
+        item = 'item{:d}'.format(indent)
+        i = 'i{:d}'.format(indent)
+        if types == ['array'] and 'items' in spec:
+            lines.append("{}else:".format(pad))
+            lines.append("{}    for {}, {} in enumerate({}):".format(
+                pad, i, item, value))
+            lines.append("{}        if {} is None:".format(pad, item))
+            lines.append("{}            continue".format(pad))
+            lines.extend(self._check(
+                item, spec['items'], "{} + {}".format(path, key),
+                "'[{{}}]'.format({})".format(i), indent + 8, nested))
+        elif types == ['object'] and ('values' in spec or 'keys' in spec):
+            lines.append("{}else:".format(pad))
+            lines.append("{}    for {}, {} in {}.items():".format(
+                pad, i, item, value))
+            if 'keys' in spec:
+                lines.extend(self._check(
+                    i, spec['keys'], "{} + {}".format(path, key),
+                    "'[{{!r}}] key'.format({})".format(i), indent + 8,
+                    nested))
+            if 'values' in spec:
+                lines.append("{}        if {} is None:".format(pad, item))
+                lines.append("{}            continue".format(pad))
+                lines.extend(self._check(
+                    item, spec['values'], "{} + {}".format(path, key),
+                    "'[{{!r}}]'.format({})".format(i), indent + 8, nested))
+        elif types == ['object'] and 'properties' in spec:
+            self._n_functions += 1
+            function_name = 'check_object_{:d}'.format(self._n_functions)
+            saved_lines, self.lines = self.lines, nested
+            self.function(function_name, spec['properties'])
+            self.lines = saved_lines
+            lines.append("{}else:".format(pad))
+            lines.append("{}    {}({}, {} + {}, errors)".format(
+                pad, function_name, value, path, key))
+        return lines
@@ -0,0 +1,209 @@
+from __future__ import print_function, division
+import errno
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from six import iteritems
+from nilm_metadata.export import read_hdf5_metadata
+from nilm_metadata.records import BuildingRecords
+
+MAGIC = b'NILMMETA'
+VERSION = 1
+_HEADER = struct.Struct('<8sIQ')  # magic, version, length of index
+SIDECAR_SUFFIX = '.nmmeta'
+
+
+def get_sidecar_filename(hdf_filename):
+    return hdf_filename + SIDECAR_SUFFIX
+
+
+def remove_metadata_sidecar(hdf_filename):
+    """Removes the sidecar of `hdf_filename`, if there is one, so that
+    `MetadataSidecar` cannot serve metadata which is out of date.
+
+    Returns
+    -------
+    True if a sidecar was removed.
+    """
+    try:
+        os.remove(get_sidecar_filename(hdf_filename))
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return False
+    return True
+
+
+def write_metadata_sidecar(hdf_filename, sidecar_filename=None):
+    """Writes the metadata in a NILMTK HDF5 file to a sidecar file which
+    can be read with `MetadataSidecar`.
+
+    Each record (the dataset, each building and each ElecMeter) is pickled
+    separately, so readers only deserialise the records they ask for.
+    The file is written atomically.
+
+    Parameters
+    ----------
+    hdf_filename : str
+    sidecar_filename : str, optional
+        Defaults to `get_sidecar_filename(hdf_filename)`.
+
+    Returns
+    -------
+    sidecar_filename
+    """
+    if sidecar_filename is None:
+        sidecar_filename = get_sidecar_filename(hdf_filename)
+    dataset_metadata, buildings = read_hdf5_metadata(hdf_filename)
+
+    records = [('/', dataset_metadata)]
+    for building, building_metadata in sorted(iteritems(buildings)):
+        elec_meters = building_metadata.get('elec_meters', {})
+        building_record = {key: value for key, value
+                           in iteritems(building_metadata)
+                           if key != 'elec_meters'}
+        building_record['meter_ids'] = sorted(elec_meters)
+        records.append(('/' + building, building_record))
+        for meter, meter_metadata in sorted(iteritems(elec_meters)):
+            records.append((_meter_key(building, meter), meter_metadata))
+
+    index = {}
+    chunks = []
+    offset = 0
+    for key, record in records:
+        chunk = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        index[key] = [offset, len(chunk)]
+        chunks.append(chunk)
+        offset += len(chunk)
+    index_bytes = json.dumps(index, sort_keys=True).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(sidecar_filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(_HEADER.pack(MAGIC, VERSION, len(index_bytes)))
+            fh.write(index_bytes)
+            for chunk in chunks:
+                fh.write(chunk)
+        os.replace(tmp_filename, sidecar_filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+    return sidecar_filename
+
+
+class MetadataSidecar(object):
+    """Read-only, memory-mapped access to a metadata sidecar file written
+    by `write_metadata_sidecar`.
+
+    Opening a sidecar only parses its index.  Each record is unpickled
+    straight from the memory map when requested.  Because the file is
+    mapped read-only, every process which opens the same sidecar shares
+    the same pages of the OS page cache.
+
+    Parameters
+    ----------
+    filename : str
+        The sidecar file, or the HDF5 file it belongs to.
+
+    Examples
+    --------
+    >>> with MetadataSidecar('redd.h5') as sidecar:
+    ...     sidecar.meter('building1', 2)['device_model']
+    """
+
+    def __init__(self, filename):
+        if not filename.endswith(SIDECAR_SUFFIX):
+            filename = get_sidecar_filename(filename)
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_length = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise IOError("{} is not a version {:d} NILM Metadata sidecar"
+                          .format(filename, VERSION))
+        index_start = _HEADER.size
+        self._data_start = index_start + index_length
+        self._index = json.loads(
+            self._mmap[index_start:self._data_start].decode('utf-8'))
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def dataset(self):
+        """dict of dataset metadata (including 'meter_devices')."""
+        return self._load('/')
+
+    def buildings(self):
+        """Sorted list of building names, e.g. ['building1', 'building2']."""
+        return sorted(key[1:] for key in self._index
+                      if key.count('/') == 1 and key != '/')
+
+    def building(self, building, include_meters=True):
+        """
+        Parameters
+        ----------
+        building : str, e.g. 'building1'
+        include_meters : bool
+            If False then 'elec_meters' is omitted and no meter records
+            are deserialised.  The meter IDs are always in 'meter_ids'.
+
+        Returns
+        -------
+        dict of building metadata.
+        """
+        building_metadata = self._load('/' + building)
+        if include_meters:
+            building_metadata['elec_meters'] = {
+                meter: self.meter(building, meter)
+                for meter in building_metadata['meter_ids']}
+        return building_metadata
+
+    def building_records(self, building):
+        """The building's metadata with its ElecMeters and Appliances as
+        compact records.  Meters are added one at a time, so the dicts of
+        all of a building's meters are never held at once.
+
+        Returns
+        -------
+        records.BuildingRecords whose `to_dict()` is the building's
+        metadata in the HDF5 file.
+        """
+        building_metadata = self._load('/' + building)
+        meter_ids = building_metadata.pop('meter_ids')
+        records = BuildingRecords.from_dict(building_metadata, building)
+        records.set('elec_meters', {})
+        for meter in meter_ids:
+            records.elec_meters.append(meter, self.meter(building, meter))
+        return records
+
+    def meter_ids(self, building):
+        return self._load('/' + building)['meter_ids']
+
+    def meter(self, building, meter):
+        """dict of metadata for one ElecMeter."""
+        return self._load(_meter_key(building, meter))
+
+    def _load(self, key):
+        try:
+            offset, length = self._index[key]
+        except KeyError:
+            raise KeyError("'{}' not in {}".format(key, self.filename))
+        start = self._data_start + offset
+        with memoryview(self._mmap) as view:
+            with view[start:start+length] as record:
+                return pickle.loads(record)
+
+
+def _meter_key(building, meter):
+    return '/{}/elec/meter{}'.format(building, meter)
@@ -0,0 +1,182 @@
+"""Load building YAML files one record at a time.
+
+`yaml.load` composes the node graph of the whole document before
+constructing any Python objects, so peak memory is several times the
+size of the file.  `iter_building` instead reads the YAML event stream
+and composes and constructs one ElecMeter or Appliance at a time, so only
+one record's nodes are alive at once (plus any anchored nodes, which
+later records may alias).
+"""
+from __future__ import print_function, division
+from yaml.events import (
+    AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent,
+    MappingStartEvent, MappingEndEvent, StreamEndEvent)
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+from yaml.composer import ComposerError
+from nilm_metadata.file_management import _YAML_LOADERS, get_yaml_loader
+from nilm_metadata.profiling import phase
+
+ELEC_METER = 'elec_meter'
+APPLIANCE = 'appliance'
+BUILDING = 'building'
+
+
+def iter_building(stream):
+    """Parses a building YAML document incrementally.
+
+    Parameters
+    ----------
+    stream : file-like object, bytes or str
+
+    Returns
+    -------
+    generator of (kind, key, value) tuples, in the order they appear in
+    the document:
+    * (ELEC_METER, meter_instance, meter_metadata) for each ElecMeter
+    * (APPLIANCE, index, appliance_metadata) for each Appliance
+    * (BUILDING, key, value) for every other top-level key.
+    'elec_meters' and 'appliances' are announced with (BUILDING,
+    'elec_meters', {}) and (BUILDING, 'appliances', []), before their
+    records, so that empty collections are not lost.
+    Every value is a separate object: no two share mutable sub-objects,
+    even if the YAML uses anchors and aliases.
+    """
+    loader = _YAML_LOADERS[get_yaml_loader()](stream)
+    try:
+        loader.get_event()  # StreamStart
+        if loader.check_event(StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStart
+        anchors = {}
+        if not loader.check_event(MappingStartEvent):
+            raise ComposerError(
+                None, None, "expected a mapping at the top level of the"
+                " building", loader.peek_event().start_mark)
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            key = _construct(loader, _compose(loader, anchors))
+            if key == 'elec_meters' and loader.check_event(
+                    MappingStartEvent):
+                _start_collection(loader, anchors)
+                yield (BUILDING, key, {})
+                while not loader.check_event(MappingEndEvent):
+                    meter_instance = _construct(
+                        loader, _compose(loader, anchors))
+                    yield (ELEC_METER, meter_instance,
+                           _construct(loader, _compose(loader, anchors)))
+                loader.get_event()
+            elif key == 'appliances' and loader.check_event(
+                    SequenceStartEvent):
+                _start_collection(loader, anchors)
+                yield (BUILDING, key, [])
+                index = 0
+                while not loader.check_event(SequenceEndEvent):
+                    yield (APPLIANCE, index,
+                           _construct(loader, _compose(loader, anchors)))
+                    index += 1
+                loader.get_event()
+            else:
+                yield (BUILDING, key,
+                       _construct(loader, _compose(loader, anchors)))
+        loader.get_event()  # MappingEnd
+        loader.get_event()  # DocumentEnd
+        if not loader.check_event(StreamEndEvent):
+            raise ComposerError(
+                None, None, "expected a single document",
+                loader.peek_event().start_mark)
+    finally:
+        loader.dispose()
+
+
+def load_building(stream, building=None):
+    """Loads a building YAML document with `iter_building`.
+
+    Parameters
+    ----------
+    stream : file-like object, bytes or str
+    building : str, optional
+        e.g. 'building1'.  If given then each ElecMeter's `data_location`
+        is set as it is loaded.
+
+    Returns
+    -------
+    dict of building metadata, equal to `yaml.safe_load(stream)` (apart
+    from data_location) except that meters never share sub-objects.
+    """
+    building_metadata = {}
+    with phase('parse_yaml'):
+        for kind, key, value in iter_building(stream):
+            if kind == ELEC_METER:
+                if building is not None:
+                    value['data_location'] = '/{:s}/elec/meter{:d}'.format(
+                        building, key)
+                building_metadata['elec_meters'][key] = value
+            elif kind == APPLIANCE:
+                building_metadata['appliances'].append(value)
+            else:
+                building_metadata[key] = value
+    return building_metadata
+
+
+def _start_collection(loader, anchors):
+    """Consumes the start event of the elec_meters mapping or appliances
+    sequence.  The collection itself cannot be aliased (it is never
+    composed as a whole)."""
+    event = loader.get_event()
+    if event.anchor is not None:
+        raise ComposerError(
+            None, None, "anchors on elec_meters or appliances are not"
+            " supported", event.start_mark)
+
+
+def _compose(loader, anchors):
+    """Builds the node for the next value from the event stream, like
+    `yaml.composer.Composer.compose_node`."""
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        try:
+            return anchors[event.anchor]
+        except KeyError:
+            raise ComposerError(None, None, "found undefined alias %r"
+                                % event.anchor, event.start_mark)
+
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark,
+                          event.end_mark, style=event.style)
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None,
+                            flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None,
+                           flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(MappingEndEvent):
+            key_node = _compose(loader, anchors)
+            node.value.append((key_node, _compose(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise ComposerError(None, None, "unexpected %s" % event,
+                            event.start_mark)
+
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def _construct(loader, node):
+    return loader.construct_document(node)
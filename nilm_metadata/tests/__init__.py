@@ -0,0 +1,10 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Keep compiled appliance type catalogues written by the tests out of the
+# developer's own cache directory.
+_cache_dir = tempfile.mkdtemp(prefix='nilm_metadata_cache_')
+os.environ['NILM_METADATA_CACHE_DIR'] = _cache_dir
+atexit.register(shutil.rmtree, _cache_dir, True)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import unittest
+from nilm_metadata.object_concatenation import get_appliance_type_registry
+
+
+class TestApplianceTypeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = get_appliance_type_registry().index()
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('fridge'), {'fridge'})
+        self.assertEqual(self.index.lookup('fridge freezer'),
+                         {'fridge freezer'})
+        self.assertEqual(self.index.types_for_synonym('fridge freezer'),
+                         {'fridge', 'freezer'})
+        self.assertEqual(self.index.lookup('blah'), set())
+
+    def test_categories(self):
+        cold = self.index.types_in_category('cold', 'traditional')
+        self.assertTrue({'cold appliance', 'fridge', 'freezer'} <= cold)
+        self.assertNotIn('kettle', cold)
+        self.assertEqual(self.index.types_in_category('cold'), cold)
+        self.assertEqual(self.index.types_in_category('cold', 'size'), set())
+
+    def test_ancestry(self):
+        self.assertEqual(self.index.ancestors('freezer'),
+                         ['fridge', 'cold appliance', 'appliance'])
+        self.assertEqual(self.index.descendants('fridge'),
+                         {'freezer', 'fridge freezer'})
+        self.assertTrue(self.index.is_a('freezer', 'cold appliance'))
+        self.assertFalse(self.index.is_a('kettle', 'cold appliance'))
+        self.assertEqual(self.index.descendants('appliance') | {'appliance'},
+                         {name for name in self.index.names()
+                          if self.index.is_a(name, 'appliance')})
+
+    def test_components(self):
+        owners = self.index.owners_of_component('compressor')
+        self.assertTrue({'fridge', 'freezer', 'air conditioner'} <= owners)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+from nilm_metadata.batch import convert_datasets, main
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    write_dataset, building_metadata, read_metadata)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.jobs = []
+        for name, n_buildings in [('good1', 3), ('bad', 2), ('good2', 4)]:
+            yaml_dir = os.path.join(self.directory, name)
+            os.mkdir(yaml_dir)
+            write_dataset(yaml_dir, n_buildings)
+            self.jobs.append(
+                (yaml_dir, os.path.join(self.directory, name + '.h5')))
+        bad = building_metadata(2)
+        bad['appliances'][0]['type'] = 'blah'
+        with open(os.path.join(self.jobs[1][0], 'building2.yaml'),
+                  'w') as fh:
+            yaml.safe_dump(bad, fh)
+
+    def test_convert_datasets(self):
+        # Whole datasets in the pool (3 datasets, 2 workers) and buildings
+        # in the pool (3 datasets, 4 workers)
+        for workers in [None, 2, 4]:
+            report = convert_datasets(self.jobs, workers=workers)
+            self.assertFalse(report)
+            self.assertEqual(len(report), 3)
+            self.assertEqual([result.hdf_filename
+                              for result in report.failed()],
+                             [self.jobs[1][1]])
+            self.assertIn('blah', report.failed()[0].error)
+            self.assertEqual(len(read_metadata(self.jobs[2][1])), 5)
+            self.assertEqual(list(report.to_frame()['error'].isnull()),
+                             [True, False, True])
+
+        # Datasets, not buildings, are scheduled across a big enough pool
+        with mock.patch('nilm_metadata.batch._convert_buildings_in_pool',
+                        side_effect=AssertionError) as in_pool:
+            self.assertEqual(len(convert_datasets(self.jobs, workers=3)), 3)
+        in_pool.assert_not_called()
+
+    def test_main(self):
+        jobs_filename = os.path.join(self.directory, 'jobs.txt')
+        with open(jobs_filename, 'w') as fh:
+            fh.write('# yaml_dir hdf_filename\n')
+            fh.write('{} {}\n'.format(*self.jobs[2]))
+        json_filename = os.path.join(self.directory, 'report.json')
+        status = main(list(self.jobs[0]) +
+                      ['--jobs-file', jobs_filename, '--json', json_filename])
+        self.assertEqual(status, 0)
+        with open(json_filename) as fh:
+            report = json.load(fh)
+        self.assertEqual(report['n_datasets'], 2)
+        self.assertEqual(report['n_failed'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
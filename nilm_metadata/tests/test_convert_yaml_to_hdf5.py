@@ -1,14 +1,174 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import importlib
+import os
+import shutil
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import pandas as pd
+import yaml
 from nilm_metadata.convert_yaml_to_hdf5 import (
+    convert_yaml_to_hdf5,
+    validate_dataset,
     _sanity_check_appliances,
     NilmMetadataError
 )
 
+# nilm_metadata.convert_yaml_to_hdf5 is shadowed by the function of the
+# same name in nilm_metadata/__init__.py
+convert_module = importlib.import_module('nilm_metadata.convert_yaml_to_hdf5')
+
+
+def write_dataset(yaml_dir, n_buildings=3):
+    """Writes a small synthetic dataset to `yaml_dir`."""
+    def dump(fname, obj):
+        with open(os.path.join(yaml_dir, fname), 'w') as fh:
+            yaml.safe_dump(obj, fh)
+
+    dump('dataset.yaml', {'name': 'TEST'})
+    dump('meter_devices.yaml', {'EnviR': {'sample_period': 6,
+                                          'max_sample_period': 50}})
+    for i in range(1, n_buildings+1):
+        dump('building{:d}.yaml'.format(i), building_metadata(i))
+
+
+def building_metadata(instance):
+    return {
+        'instance': instance,
+        'elec_meters': {
+            1: {'site_meter': True, 'device_model': 'EnviR'},
+            2: {'submeter_of': 1, 'device_model': 'EnviR'},
+            3: {'submeter_of': 1, 'device_model': 'EnviR'}},
+        'appliances': [
+            {'type': 'fridge', 'instance': 1, 'meters': [2]},
+            {'type': 'kettle', 'instance': 1, 'meters': [3]},
+            {'type': 'kettle', 'instance': 2, 'meters': [3]}]
+    }
+
+
+def read_metadata(hdf_filename):
+    store = pd.HDFStore(hdf_filename, 'r')
+    try:
+        metadata = {'/': store.root._v_attrs.metadata}
+        for group in store._handle.list_nodes('/'):
+            metadata[group._v_pathname] = group._v_attrs.metadata
+    finally:
+        store.close()
+    return metadata
+
+
+class CountingExecutor(ThreadPoolExecutor):
+
+    n_submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.n_submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kwargs)
+
 
 class TestConvertYamlToHdf5(unittest.TestCase):
 
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.yaml_dir = os.path.join(self.directory, 'metadata')
+        os.mkdir(self.yaml_dir)
+
+    def test_convert_yaml_to_hdf5(self):
+        write_dataset(self.yaml_dir, n_buildings=12)
+        serial = os.path.join(self.directory, 'serial.h5')
+        convert_yaml_to_hdf5(self.yaml_dir, serial)
+        metadata = read_metadata(serial)
+        self.assertEqual(metadata['/']['meter_devices']['EnviR']
+                         ['sample_period'], 6)
+        building = metadata['/building12']
+        self.assertEqual(building['instance'], 12)
+        self.assertEqual(building['elec_meters'][2]['data_location'],
+                         '/building12/elec/meter2')
+
+        store = pd.HDFStore(serial, 'r')
+        wiring = store._handle.get_node('/building12')._v_attrs.wiring
+        store.close()
+        self.assertEqual(wiring['children'][1], [2, 3])
+
+        parallel = os.path.join(self.directory, 'parallel.h5')
+        convert_yaml_to_hdf5(self.yaml_dir, parallel, workers=2)
+        self.assertEqual(read_metadata(parallel), metadata)
+
+        pipelined = os.path.join(self.directory, 'pipelined.h5')
+        convert_yaml_to_hdf5(self.yaml_dir, pipelined, pipeline=True)
+        self.assertEqual(read_metadata(pipelined), metadata)
+
+    def test_buildings_in_flight_are_bounded(self):
+        write_dataset(self.yaml_dir, n_buildings=12)
+        building_filenames = ['building{:d}.yaml'.format(i)
+                              for i in range(1, 13)]
+        executor = CountingExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        buildings = convert_module._load_buildings(
+            self.yaml_dir, building_filenames, {'EnviR': {}}, workers=2,
+            executor=executor)
+        for n_yielded, (building, _) in enumerate(buildings, 1):
+            self.assertEqual(building, 'building{:d}'.format(n_yielded))
+            self.assertLessEqual(executor.n_submitted - n_yielded, 4)
+        self.assertEqual(executor.n_submitted, 12)
+
+    def test_incremental_conversion(self):
+        write_dataset(self.yaml_dir, n_buildings=3)
+        hdf_filename = os.path.join(self.directory, 'incremental.h5')
+        convert_yaml_to_hdf5(self.yaml_dir, hdf_filename, incremental=True)
+
+        def converted_buildings():
+            with mock.patch.object(
+                    convert_module, '_load_building',
+                    wraps=convert_module._load_building) as load_building:
+                convert_yaml_to_hdf5(
+                    self.yaml_dir, hdf_filename, incremental=True)
+            return [call[0][1] for call in load_building.call_args_list]
+
+        self.assertEqual(converted_buildings(), [])
+
+        building2 = building_metadata(2)
+        building2['appliances'].pop()
+        with open(os.path.join(self.yaml_dir, 'building2.yaml'), 'w') as fh:
+            yaml.safe_dump(building2, fh)
+        os.remove(os.path.join(self.yaml_dir, 'building3.yaml'))
+        self.assertEqual(converted_buildings(), ['building2.yaml'])
+
+        metadata = read_metadata(hdf_filename)
+        self.assertEqual(sorted(metadata), ['/', '/building1', '/building2'])
+        self.assertEqual(len(metadata['/building2']['appliances']), 2)
+
+        # A change to meter_devices.yaml means every building is re-checked
+        with open(os.path.join(self.yaml_dir, 'meter_devices.yaml'),
+                  'a') as fh:
+            fh.write('\n# a comment\n')
+        self.assertEqual(converted_buildings(),
+                         ['building1.yaml', 'building2.yaml'])
+
+    def test_convert_yaml_to_hdf5_reports_first_error(self):
+        write_dataset(self.yaml_dir, n_buildings=4)
+        for instance in [2, 3]:
+            bad = building_metadata(instance)
+            bad['appliances'][0]['type'] = 'blah {:d}'.format(instance)
+            with open(os.path.join(
+                    self.yaml_dir, 'building{:d}.yaml'.format(instance)),
+                    'w') as fh:
+                yaml.safe_dump(bad, fh)
+
+        for workers, pipeline in [(None, False), (3, False), (None, True)]:
+            hdf_filename = os.path.join(
+                self.directory, '{}-{}.h5'.format(workers, pipeline))
+            with self.assertRaisesRegex(NilmMetadataError, 'blah 2'):
+                convert_yaml_to_hdf5(self.yaml_dir, hdf_filename,
+                                     workers=workers, pipeline=pipeline)
+
+        report = validate_dataset(self.yaml_dir)
+        self.assertEqual([v.building for v in report],
+                         ['building2', 'building3'])
+
     def test_sanity_check_appliances(self):
         def building(appliances):
             return {
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import unittest
+import numpy as np
+from nilm_metadata.distribution_tables import CategoricalDistributionTable
+from nilm_metadata.object_concatenation import get_appliance_type_registry
+
+
+def rooms(categories, values, distance=0, from_appliance_type=None):
+    return {'distribution_of_data': {'categories': categories,
+                                     'values': values},
+            'distance': distance,
+            'from_appliance_type': from_appliance_type}
+
+
+class TestDistributionTables(unittest.TestCase):
+
+    def setUp(self):
+        appliance_types = {
+            'cold appliance': {'distributions': {'rooms': [
+                rooms(['kitchen', 'garage'], [0.6, 0.2],
+                      from_appliance_type='cold appliance')]}},
+            'fridge': {'distributions': {'rooms': [
+                rooms(['kitchen', 'garage'], [0.6, 0.2], distance=1,
+                      from_appliance_type='cold appliance'),
+                rooms(['kitchen'], [0.5], from_appliance_type='fridge'),
+                rooms(['kitchen'], [0.5, 0.5])]}},  # malformed; ignored
+            'light': {},
+        }
+        self.table = CategoricalDistributionTable(
+            appliance_types, 'rooms',
+            categories=['kitchen', 'garage', 'lounge', 'bedroom'])
+
+    def test_nearest_distribution_is_normalised(self):
+        table = self.table
+        self.assertEqual(table.distribution('fridge'),
+                         {'bedroom': 0.5 / 3, 'garage': 0.5 / 3,
+                          'kitchen': 0.5, 'lounge': 0.5 / 3})
+        self.assertAlmostEqual(table.prior('cold appliance', 'lounge'), 0.1)
+        self.assertIsNone(table.distribution('light'))
+        self.assertEqual(list(table.distance), [0, 0, -1])
+        self.assertEqual(list(table.from_appliance_type),
+                         ['cold appliance', 'fridge', ''])
+        np.testing.assert_allclose(
+            np.nansum(table.probabilities, axis=1), [1, 1, 0])
+
+    def test_priors(self):
+        priors = self.table.priors(
+            ['fridge', 'cold appliance', 'light', 'fridge', 'blah'] * 2000,
+            ['kitchen', 'kitchen', 'kitchen', 'attic', 'kitchen'] * 2000)
+        self.assertEqual(priors.shape, (10000,))
+        np.testing.assert_allclose(priors[:5],
+                                   [0.5, 0.6, np.nan, np.nan, np.nan])
+        with self.assertRaises(ValueError):
+            self.table.priors(['fridge'], ['kitchen', 'garage'])
+
+    def test_registry_distribution_table(self):
+        registry = get_appliance_type_registry()
+        table = registry.distribution_table('rooms')
+        self.assertIs(registry.distribution_table('rooms'), table)
+        row = list(table.appliance_types).index('fridge')
+        self.assertEqual(table.from_appliance_type[row], 'cold appliance')
+        self.assertEqual(table.distance[row], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.export import export_metadata, metadata_tables
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    write_dataset, building_metadata)
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestExport(unittest.TestCase):
+
+    def test_metadata_tables(self):
+        buildings = {'building1': building_metadata(1),
+                     'building2': building_metadata(2)}
+        buildings['building2']['elec_meters'][2]['sample_period'] = 1
+        meter_devices = {'EnviR': {'sample_period': 6,
+                                   'max_sample_period': 50}}
+        tables = metadata_tables(buildings, meter_devices)
+        meters = tables['meters']
+        self.assertEqual(len(meters), 6)
+        self.assertEqual(list(meters.columns[:2]), ['building', 'meter'])
+        self.assertEqual(
+            meters.set_index(['building', 'meter'])['sample_period'].to_dict(),
+            {('building1', 1): 6, ('building1', 2): 6, ('building1', 3): 6,
+             ('building2', 1): 6, ('building2', 2): 1, ('building2', 3): 6})
+        self.assertEqual(len(tables['appliances']), 6)
+        self.assertEqual(len(tables['appliance_meters']), 6)
+        self.assertEqual(list(tables['meter_devices']['device_model']),
+                         ['EnviR'])
+
+    @unittest.skipUnless(pyarrow, 'requires pyarrow')
+    def test_export_metadata(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=2)
+        hdf_filename = os.path.join(directory, 'dataset.h5')
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename)
+
+        for fmt in ['parquet', 'feather']:
+            output_dir = os.path.join(directory, fmt)
+            filenames = export_metadata(hdf_filename, output_dir, fmt=fmt)
+            self.assertEqual(sorted(filenames), [
+                'appliance_meters', 'appliance_types', 'appliances',
+                'buildings', 'meter_devices', 'meters'])
+
+            # all fridges on meters with sample_period <= 6
+            read = (pd.read_parquet if fmt == 'parquet' else pd.read_feather)
+            links = read(filenames['appliance_meters'])
+            meters = read(filenames['meters'])
+            fridges = links[links['appliance_type'] == 'fridge'].merge(
+                meters[meters['sample_period'] <= 6],
+                on=['building', 'meter'])
+            self.assertEqual(len(fridges), 2)
+            types = read(filenames['appliance_types'])
+            self.assertIn('fridge', set(types['type']))
+
+
+if __name__ == '__main__':
+    unittest.main()
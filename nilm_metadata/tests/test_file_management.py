@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+from nilm_metadata import file_management
+from nilm_metadata.file_management import (
+    load_yaml, set_yaml_loader, get_yaml_loader,
+    get_appliance_types_from_disk, add_appliance_types_directory,
+    remove_appliance_types_directory, DuplicateApplianceTypeError,
+    _find_all_appliance_type_files, _find_all_files_with_suffix)
+from nilm_metadata.object_concatenation import ApplianceTypeRegistry
+
+
+class TestFileManagement(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(set_yaml_loader, get_yaml_loader())
+
+    def test_yaml_loaders_agree(self):
+        for filename in _find_all_appliance_type_files():
+            with open(filename, 'rb') as fh:
+                text = fh.read()
+            set_yaml_loader('python')
+            self.assertEqual(get_yaml_loader(), 'python')
+            from_python = load_yaml(text)
+            self.assertEqual(from_python, yaml.safe_load(text))
+            if file_management._LibYAMLSafeLoader is not None:
+                set_yaml_loader('libyaml')
+                self.assertEqual(get_yaml_loader(), 'libyaml')
+                self.assertEqual(load_yaml(text), from_python)
+
+    def test_set_yaml_loader(self):
+        set_yaml_loader('auto')
+        if file_management._LibYAMLSafeLoader is None:
+            self.assertEqual(get_yaml_loader(), 'python')
+            with self.assertRaises(ImportError):
+                set_yaml_loader('libyaml')
+        else:
+            self.assertEqual(get_yaml_loader(), 'libyaml')
+
+        with self.assertRaises(ValueError):
+            set_yaml_loader('blah')
+
+    def test_extra_appliance_types_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.mkdir(os.path.join(directory, 'site'))
+
+        def dump(fname, obj):
+            with open(os.path.join(directory, fname), 'w') as fh:
+                yaml.safe_dump(obj, fh)
+
+        dump(os.path.join('site', 'fridges.yaml'),
+             {'site fridge': {'parent': 'fridge'}})
+        add_appliance_types_directory(directory)
+        self.addCleanup(remove_appliance_types_directory, directory)
+        registry = ApplianceTypeRegistry(use_compiled_cache=False)
+        self.assertEqual(registry.get('site fridge')['categories']
+                         ['traditional'], 'cold')
+
+        # Loading many files in a process pool gives the same result
+        for i in range(3):
+            dump('extra{:d}.yaml'.format(i),
+                 {'extra {:d}'.format(i): {'parent': 'fridge'}})
+        with mock.patch.object(
+                file_management, '_MIN_FILES_FOR_PROCESS_POOL', 2):
+            self.assertEqual(get_appliance_types_from_disk(workers=2),
+                             get_appliance_types_from_disk(workers=1))
+            # The process pool is opt-in
+            with mock.patch.object(file_management,
+                                   'ProcessPoolExecutor') as pool:
+                get_appliance_types_from_disk()
+            pool.assert_not_called()
+
+        dump('duplicates.yaml', {'fridge': {'parent': 'cold appliance'}})
+        with self.assertRaisesRegex(DuplicateApplianceTypeError,
+                                    "'fridge' is defined in"):
+            get_appliance_types_from_disk()
+
+    def test_directory_listing_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        subdirectory = os.path.join(directory, 'a', 'b')
+        os.makedirs(subdirectory)
+        open(os.path.join(directory, 'one.yaml'), 'w').close()
+        self.assertEqual(_find_all_files_with_suffix('.yaml', directory),
+                         [os.path.join(directory, 'one.yaml')])
+
+        with mock.patch.object(os, 'scandir') as scandir:
+            _find_all_files_with_suffix('.yaml', directory)
+        scandir.assert_not_called()
+
+        filename = os.path.join(subdirectory, 'two.yaml')
+        open(filename, 'w').close()
+        # Make sure the mtime changes even on coarse-grained filesystems.
+        stat = os.stat(subdirectory)
+        os.utime(subdirectory, ns=(stat.st_atime_ns,
+                                   stat.st_mtime_ns + 10**9))
+        self.assertIn(filename,
+                      _find_all_files_with_suffix('.yaml', directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import pandas as pd
+import yaml
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.export import read_hdf5_metadata
+from nilm_metadata.interning import (
+    InternTable, RehydratingMapping, INTERN_TABLE_ATTR, REF_KEY, is_ref,
+    _digest)
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    write_dataset, building_metadata, read_metadata)
+
+convert_module = importlib.import_module('nilm_metadata.convert_yaml_to_hdf5')
+
+
+class TestInterning(unittest.TestCase):
+
+    def test_digest(self):
+        self.assertEqual(_digest({'a': 1, 'b': [2, 3]}),
+                         _digest({'b': [2, 3], 'a': 1}))
+        digests = {_digest(obj) for obj in
+                   [[1], [1.0], [True], ['1'], [(1,)], [[1]], [{1: 1}]]}
+        self.assertEqual(len(digests), 7)
+
+    def test_intern_building(self):
+        table = InternTable()
+        timeframe = {'start': '2013-01-01', 'end': '2014-01-01'}
+        building = building_metadata(1)
+        for meter in building['elec_meters'].values():
+            meter['timeframe'] = dict(timeframe)
+        interned = table.intern_building(building)
+
+        meters = interned['elec_meters']
+        self.assertTrue(is_ref(meters[1]['timeframe']))
+        self.assertIs(meters[1]['timeframe'][REF_KEY],
+                      meters[2]['timeframe'][REF_KEY])
+        # Both kettles are on meter 3
+        self.assertTrue(is_ref(interned['appliances'][1]['meters']))
+        self.assertEqual(len(table), 2)
+        # Unique values are stored inline
+        self.assertEqual(interned['appliances'][0]['meters'], [2])
+        # The input is not modified
+        self.assertEqual(building['elec_meters'][1]['timeframe'], timeframe)
+
+        rehydrated = table.rehydrate(interned)
+        self.assertEqual(rehydrated, building)
+        self.assertIsNot(rehydrated['elec_meters'][1]['timeframe'],
+                         rehydrated['elec_meters'][2]['timeframe'])
+
+        # Values already in the table are referenced even if unique now
+        building2 = building_metadata(2)
+        building2['elec_meters'][1]['timeframe'] = dict(timeframe)
+        interned2 = table.intern_building(building2)
+        self.assertTrue(is_ref(interned2['elec_meters'][1]['timeframe']))
+        self.assertEqual(len(table), 2)
+
+        with self.assertRaises(KeyError):
+            InternTable().rehydrate(interned)
+
+    def test_convert_yaml_to_hdf5(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=3)
+        with open(os.path.join(yaml_dir, 'meter_devices.yaml'), 'w') as fh:
+            measurements = [{'physical_quantity': 'power',
+                             'type': 'active'}]
+            yaml.safe_dump({'EnviR': {'measurements': measurements},
+                            'Current Cost': {'measurements': measurements}},
+                           fh)
+        plain_filename = os.path.join(directory, 'plain.h5')
+        interned_filename = os.path.join(directory, 'interned.h5')
+        convert_yaml_to_hdf5(yaml_dir, plain_filename)
+        convert_yaml_to_hdf5(yaml_dir, interned_filename, intern=True,
+                             incremental=True)
+
+        self.assertEqual(read_hdf5_metadata(interned_filename),
+                         read_hdf5_metadata(plain_filename))
+        # Buildings are only rehydrated when looked up
+        _, buildings = read_hdf5_metadata(interned_filename)
+        self.assertIsInstance(buildings, RehydratingMapping)
+        intern_table = buildings._intern_table
+        with mock.patch.object(intern_table, 'rehydrate',
+                               wraps=intern_table.rehydrate) as rehydrate:
+            self.assertEqual(sorted(buildings), ['building1', 'building2',
+                                                 'building3'])
+            rehydrate.assert_not_called()
+            buildings['building2']
+            calls = rehydrate.call_count
+            self.assertGreater(calls, 0)
+            buildings['building2']  # cached
+            self.assertEqual(rehydrate.call_count, calls)
+        raw = read_metadata(interned_filename)
+        self.assertTrue(is_ref(
+            raw['/']['meter_devices']['EnviR']['measurements']))
+        store = pd.HDFStore(plain_filename, 'r')
+        try:
+            self.assertNotIn(INTERN_TABLE_ATTR,
+                             store.root._v_attrs._f_list())
+        finally:
+            store.close()
+
+        # Changing `intern` rewrites every building
+        with mock.patch.object(
+                convert_module, '_load_building',
+                wraps=convert_module._load_building) as load_building:
+            convert_yaml_to_hdf5(yaml_dir, interned_filename,
+                                 incremental=True)
+        self.assertEqual(load_building.call_count, 3)
+        self.assertEqual(read_metadata(interned_filename),
+                         read_metadata(plain_filename))
+        store = pd.HDFStore(interned_filename, 'r')
+        try:
+            self.assertNotIn(INTERN_TABLE_ATTR,
+                             store.root._v_attrs._f_list())
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from copy import deepcopy
 from six import iteritems
-from nilm_metadata.object_concatenation import get_appliance_types
+from unittest import mock
+from nilm_metadata.object_concatenation import (
+    get_appliance_types, ApplianceTypeRegistry,
+    _concatenate_all_appliance_types)
 
 
 class TestNilmMetadata(unittest.TestCase):
@@ -49,5 +57,98 @@ class TestNilmMetadata(unittest.TestCase):
         for k, v in iteritems(freezer_answers):
             self.assertEqual(freezer[k], v)
 
+    def test_lazy_appliance_types(self):
+        eager = get_appliance_types()
+        types = get_appliance_types(lazy=True)
+        self.assertEqual(len(types), len(eager))
+        self.assertEqual(set(types), set(eager))
+        self.assertIn('fridge', types)
+        self.assertNotIn('blah', types)
+        with self.assertRaises(KeyError):
+            types['blah']
+
+        self.assertEqual(types['fridge'], eager['fridge'])
+        self.assertIs(types['fridge'], types['fridge'])
+
+        # Only fridge's ancestors and components have been concatenated
+        resolved = set(types._resolver._objects)
+        self.assertIn('cold appliance', resolved)
+        self.assertIn('compressor', resolved)
+        self.assertNotIn('kettle', resolved)
+
+    def test_registry_returns_copies(self):
+        types = get_appliance_types()
+        types['fridge']['categories']['traditional'] = 'hot'
+        del types['freezer']
+        types = get_appliance_types()
+        self.assertEqual(types['fridge']['categories']['traditional'], 'cold')
+        self.assertIn('freezer', types)
+
+    def test_registry_invalidation(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'types.yaml')
+
+        def write(text, mtime):
+            with open(filename, 'w') as fh:
+                fh.write(text)
+            os.utime(filename, (mtime, mtime))
+
+        write('appliance: {}\nkettle: {parent: appliance}\n', 1000)
+        registry = ApplianceTypeRegistry(use_compiled_cache=False)
+        self.addCleanup(mock.patch.stopall)
+        mock.patch(
+            'nilm_metadata.object_concatenation._find_all_appliance_type_files',
+            return_value=[filename]).start()
+        concatenate = mock.patch(
+            'nilm_metadata.object_concatenation._concatenate_all_appliance_types',
+            wraps=_concatenate_all_appliance_types).start()
+
+        self.assertEqual(registry.names(), {'appliance', 'kettle'})
+        self.assertEqual(registry.get('kettle')['n_ancestors'], 1)
+        self.assertEqual(concatenate.call_count, 1)
+
+        # Touching the file without changing its contents does not rebuild
+        write('appliance: {}\nkettle: {parent: appliance}\n', 2000)
+        self.assertIn('kettle', registry)
+        self.assertEqual(concatenate.call_count, 1)
+
+        # Changing the contents does
+        write('appliance: {}\ntoaster: {parent: appliance}\n', 3000)
+        self.assertEqual(registry.names(), {'appliance', 'toaster'})
+        self.assertIsNone(registry.get('kettle'))
+        self.assertEqual(concatenate.call_count, 2)
+
+    def test_compiled_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.dict(
+            os.environ, {'NILM_METADATA_CACHE_DIR': cache_dir}).start()
+
+        stale = os.path.join(cache_dir, 'appliance_types-stale.pickle')
+        open(stale, 'wb').close()
+        types = ApplianceTypeRegistry().get_appliance_types()
+        # The stale catalogue was replaced
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertFalse(os.path.exists(stale))
+
+        # A new registry (i.e. a new process) loads the compiled catalogue
+        # without parsing any YAML.
+        mock.patch(
+            'nilm_metadata.object_concatenation.get_appliance_types_from_disk',
+            side_effect=AssertionError('YAML should not be parsed')).start()
+        self.assertEqual(ApplianceTypeRegistry().get_appliance_types(), types)
+
+    def test_import_is_lazy(self):
+        code = ("import sys, nilm_metadata\n"
+                "assert 'pandas' not in sys.modules\n"
+                "from nilm_metadata import convert_yaml_to_hdf5\n"
+                "import nilm_metadata.convert_yaml_to_hdf5\n"
+                "assert 'pandas' in sys.modules\n"
+                "assert callable(nilm_metadata.convert_yaml_to_hdf5)\n")
+        subprocess.check_call([sys.executable, '-c', code])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import unittest
+from copy import deepcopy
 from nilm_metadata.object_concatenation import (
     recursively_update_dict, 
-    _concatenate_complete_object
+    _concatenate_complete_object,
+    _concatenate_all_appliance_types,
+    ObjectConcatenationError
 )
 
 
@@ -35,6 +38,20 @@ class TestObjectConcatenation(unittest.TestCase):
         recursively_update_dict(d1,d2)
         self.assertEqual(d1, {'a':1, 'b':2, 'c': {'ca':10, 'cb': 20, 'cc': 30} })
 
+    def test_recursively_update_dict_copies_and_dedupes(self):
+        d1 = {'list': ['b', 'a'], 'c': {'ca': 10}}
+        d2 = {'list': ['c', 'a', 'd', 'c'], 'c': {'cb': {'x': [1]}},
+              'dicts': [{'e': 1}]}
+        original = deepcopy(d2)
+        recursively_update_dict(d1, d2)
+        self.assertEqual(d1['list'], ['b', 'a', 'c', 'd'])
+        self.assertEqual(d2, original)
+
+        # d1 must not share any mutable objects with d2
+        d1['c']['cb']['x'].append(2)
+        d1['dicts'][0]['e'] = 2
+        self.assertEqual(d2, original)
+
     def test_distance(self):
         objects = {
             "a": {
@@ -76,5 +93,50 @@ class TestObjectConcatenation(unittest.TestCase):
         self.assertEqual(on_duration[0], {'distance':2, 'description': 'a',
                                           'from_appliance_type': 'a'})
 
+    def test_concatenate_all_appliance_types(self):
+        objects = {
+            "a": {"categories": {"size": "large"},
+                  "synonyms": ["aa"],
+                  "do_not_inherit": ["control"],
+                  "control": ["manual"]},
+            "b": {"parent": "a", "do_not_inherit": ["categories"],
+                  "components": [{"type": "c"}]},
+            "c": {"parent": "a", "categories": {"traditional": "cold"}}
+        }
+        original = deepcopy(objects)
+        types = _concatenate_all_appliance_types(objects)
+
+        # objects loaded from disk must not be modified
+        self.assertEqual(objects, original)
+
+        self.assertEqual(types['a']['n_ancestors'], 0)
+        self.assertEqual(types['c']['n_ancestors'], 1)
+        self.assertEqual(types['c']['control'], ['manual'])
+        self.assertNotIn('synonyms', types['c'])
+        self.assertNotIn('do_not_inherit', types['c'])
+        self.assertEqual(types['b']['do_not_inherit'], ['categories'])
+        self.assertEqual(types['b']['categories'], {'size': 'large',
+                                                    'traditional': 'cold'})
+        component = types['b']['components'][0]
+        self.assertEqual(component['type'], 'c')
+        self.assertEqual(component['n_ancestors'], 1)
+
+        # results must not share state
+        component['categories']['size'] = 'small'
+        self.assertEqual(types['c']['categories']['size'], 'large')
+
+    def test_concatenation_errors(self):
+        BAD_OBJECTS = [
+            {"a": {"parent": "b"}, "b": {"parent": "a"}},  # inheritance cycle
+            {"a": {"parent": "a"}},  # own parent
+            {"a": {"parent": "b"}},  # unknown parent
+            {"a": {"components": [{"type": "a"}]}},  # own component
+            {"a": {"components": [{"type": "b"}]}},  # unknown component
+        ]
+        for objects in BAD_OBJECTS:
+            with self.assertRaises(ObjectConcatenationError):
+                _concatenate_all_appliance_types(objects)
+
+
 if __name__ == '__main__':
     unittest.main()
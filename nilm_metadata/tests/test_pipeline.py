@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import threading
+import unittest
+from nilm_metadata.pipeline import Pipeline
+
+
+def double(x):
+    return 2 * x
+
+
+def check(x):
+    if x == 10:
+        raise ValueError('bad item {:d}'.format(x))
+    return x
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_order_and_stats(self):
+        pipeline = Pipeline([('double', double), ('add', lambda x: x + 1)],
+                            maxsize=2)
+        self.assertEqual(list(pipeline.run(range(100))),
+                         [2 * x + 1 for x in range(100)])
+        self.assertEqual([stats.name for stats in pipeline.stats],
+                         ['double', 'add', 'consumer'])
+        self.assertEqual([stats.items for stats in pipeline.stats],
+                         [100, 100, 100])
+
+    def test_stages_run_outside_consumer_thread(self):
+        pipeline = Pipeline([('first', lambda x: threading.get_ident()),
+                             ('last', lambda x: (x, threading.get_ident()))])
+        consumer = threading.get_ident()
+        for first, last in pipeline.run(range(10)):
+            self.assertNotEqual(first, consumer)
+            self.assertNotEqual(last, consumer)
+            self.assertNotEqual(first, last)
+
+    def test_exception_raised_in_order(self):
+        pipeline = Pipeline([('double', double), ('check', check)])
+        received = []
+        with self.assertRaisesRegex(ValueError, 'bad item 10'):
+            for x in pipeline.run(range(100)):
+                received.append(x)
+        self.assertEqual(received, [0, 2, 4, 6, 8])
+
+    def test_consumer_stops_early(self):
+        pipeline = Pipeline([('double', double), ('check', check)],
+                            maxsize=1)
+        for x in pipeline.run(range(1000)):
+            if x == 4:
+                break
+        self.assertLess(pipeline.stats[0].items, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
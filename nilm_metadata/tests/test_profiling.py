@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from nilm_metadata import profiling
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.object_concatenation import ApplianceTypeRegistry
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import write_dataset
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {profiling.PROFILE_ENV_VAR: ''}):
+            self.assertFalse(profiling.is_enabled())
+            self.assertIs(profiling.phase('parse_yaml'),
+                          profiling._NULL_PHASE)
+
+    def test_profile(self):
+        registry = ApplianceTypeRegistry(use_compiled_cache=False)
+        with profiling.profile() as profiler:
+            registry.get_appliance_types()
+        summary = profiler.summary()
+        phases = summary['phases']
+        for name in ['find_files', 'read_files', 'parse_yaml',
+                     'concatenate_appliance_types',
+                     'recursively_update_dict']:
+            self.assertGreater(phases[name]['calls'], 0, name)
+        self.assertEqual(phases['read_files']['calls'],
+                         phases['parse_yaml']['calls'])
+        self.assertGreater(phases['read_files']['bytes_read'], 0)
+        self.assertGreaterEqual(summary['wall_time'],
+                                phases['concatenate_appliance_types']
+                                ['seconds'])
+        self.assertIsNone(profiling._profiler)
+
+    def test_convert_yaml_to_hdf5_emits_summary(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=3)
+        summary_filename = os.path.join(directory, 'profile.jsonl')
+
+        summaries = []
+        profiling.add_listener(summaries.append)
+        self.addCleanup(profiling.remove_listener, summaries.append)
+        with mock.patch.dict(os.environ,
+                             {profiling.PROFILE_ENV_VAR: summary_filename}):
+            convert_yaml_to_hdf5(yaml_dir,
+                                 os.path.join(directory, 'test.h5'),
+                                 pipeline=True)
+
+        self.assertEqual(len(summaries), 1)
+        summary = summaries[0]
+        self.assertEqual(summary['name'], 'convert_yaml_to_hdf5')
+        # Once for dataset.yaml and meter_devices.yaml then per building
+        self.assertEqual(summary['phases']['validate']['calls'], 4)
+        self.assertGreater(summary['phases']['write_hdf5']['calls'], 3)
+        with open(summary_filename) as fh:
+            self.assertEqual(json.loads(fh.read())['phases'],
+                             json.loads(json.dumps(summary['phases'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import gc
+import pickle
+import tracemalloc
+import unittest
+import yaml
+from nilm_metadata.streaming import load_building
+from nilm_metadata.records import (
+    BuildingRecords, ElecMeterRecords, ApplianceRecords,
+    load_building_records)
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import building_metadata
+from nilm_metadata.tests.test_streaming import ANCHORED_BUILDING
+
+
+def traced_size(function):
+    """Bytes allocated by `function()` which are still alive."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_round_trip(self):
+        building = building_metadata(1)
+        building['elec_meters'][1].update({
+            'timeframe': {'start': '2013-01-01'}, 'sample_period': 6,
+            'max_sample_period': 6.5, 'custom': [1, 2], 'site_meter': None})
+        building['elec_meters'][2].update({
+            'submeter_of': 'one', 'sample_period': 2**60,
+            'data_location': '/elsewhere', 'disabled': False})
+        building['elec_meters'][3] = None
+        building['appliances'] += [
+            {'type': 'lamp', 'instance': True, 'meters': [1, 'x']},
+            {'type': 'lamp', 'meters': 2, 'original_name': 'lamp'},
+            'not a dict']
+        for elec_meters in [building['elec_meters'],
+                            {10: {}, 'two': {'room': 'kitchen'}, 1: {}},
+                            {}]:
+            building['elec_meters'] = elec_meters
+            records = BuildingRecords.from_dict(building, 'building1')
+            self.assertEqual(records.to_dict(), building)
+            self.assertEqual(pickle.loads(pickle.dumps(records)).to_dict(),
+                             building)
+
+        meters = ElecMeterRecords('building1', {
+            1: {'data_location': '/building1/elec/meter1'},
+            3: {'data_location': '/building1/elec/meter4'}})
+        self.assertEqual(list(meters), [1, 3])
+        self.assertNotIn(2, meters)
+        self.assertNotIn([1], meters)
+        self.assertEqual(meters[3],
+                         {'data_location': '/building1/elec/meter4'})
+        self.assertIsNone(meters.get(2))
+        with self.assertRaises(KeyError):
+            meters.append(1, {})
+
+        appliances = ApplianceRecords([{'type': 'fridge'}, 'x'])
+        self.assertEqual(appliances[-2], {'type': 'fridge'})
+        self.assertEqual(appliances[1:], ['x'])
+        with self.assertRaises(IndexError):
+            appliances[2]
+
+        # Records share nothing mutable with the dicts
+        timeframe = {'start': '2013-01-01'}
+        meters = ElecMeterRecords(None, {1: {'timeframe': timeframe},
+                                         2: {'timeframe': timeframe}})
+        meters[1]['timeframe']['start'] = None
+        timeframe['end'] = '2014-01-01'
+        self.assertEqual(meters[1]['timeframe'], {'start': '2013-01-01'})
+        self.assertIsNot(meters[1]['timeframe'], meters[2]['timeframe'])
+
+    def test_load_building_records(self):
+        text = yaml.safe_dump(building_metadata(1))
+        for stream, building in [(text, 'building1'), (text, None),
+                                 (ANCHORED_BUILDING, 'building1'),
+                                 ('instance: 1\nelec_meters: {}\n', None),
+                                 ('', None)]:
+            self.assertEqual(
+                load_building_records(stream, building).to_dict(),
+                load_building(stream, building))
+
+    def test_memory(self):
+        n_meters = 2000
+        building = {
+            'instance': 1,
+            'elec_meters': {
+                meter: {'device_model': 'EnviR', 'submeter_of': 1,
+                        'sample_period': 6,
+                        'timeframe': {'start': '2013-01-01',
+                                      'end': '2014-01-01'}}
+                for meter in range(1, n_meters + 1)}}
+        text = yaml.safe_dump(building)
+        metadata, dict_size = traced_size(
+            lambda: load_building(text, 'building1'))
+        records, records_size = traced_size(
+            lambda: load_building_records(text, 'building1'))
+        self.assertEqual(records.to_dict(), metadata)
+        # About 1000 bytes per meter as dicts and 70 as records
+        self.assertGreater(dict_size / records_size, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
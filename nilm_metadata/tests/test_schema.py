@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import unittest
+from datetime import date
+from nilm_metadata.schema import SchemaValidator
+
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        appliance_types = {
+            'fridge': {'additional_properties': {
+                'fridge_volume': {'type': 'number', 'description': 'l'}}},
+            'boiler': {'additional_properties': {
+                'fuel': {'enum': ['gas', 'oil']}}},
+            'kettle': {}}
+        self.validator = SchemaValidator(appliance_types)
+
+    def test_valid(self):
+        building = {
+            'instance': 1,
+            'timeframe': {'start': '2013-01-01', 'end': date(2014, 1, 1)},
+            'elec_meters': {1: {'site_meter': True, 'sample_period': 6,
+                                'phase': 'A', 'room': None},
+                            2: {'submeter_of': 1, 'phase': 2}},
+            'appliances': [{'type': 'fridge', 'instance': 1, 'meters': [2],
+                            'fridge_volume': 120.5},
+                           {'type': 'boiler', 'instance': 1, 'meters': [1],
+                            'fuel': 'gas'}],
+            'rooms': [{'name': 'kitchen', 'instance': 1}],
+            'extra key': object()}
+        self.assertEqual(self.validator.check_building(building), [])
+        self.assertEqual(self.validator.check_dataset(
+            {'name': 'TEST', 'creators': ['Kelly, Jack']}), [])
+        self.assertEqual(self.validator.check_meter_devices(
+            {'EnviR': {'sample_period': 6, 'max_sample_period': 50}}), [])
+
+    def test_invalid(self):
+        building = {
+            'instance': True,
+            'elec_meters': {1: {'sample_period': '6',
+                                'timeframe': {'start': 2013}},
+                            'two': {}},
+            'appliances': [{'type': 'fridge', 'instance': 1,
+                            'meters': [1, 'x'], 'fridge_volume': 'big'},
+                           {'type': 'boiler', 'fuel': 'coal'},
+                           {'type': 'kettle', 'fridge_volume': 'big'}],
+            'rooms': [{'name': 1}],
+            'ownership': 'leased'}
+        self.assertEqual(sorted(self.validator.check_building(
+            building, 'building1')), [
+            "building1.appliances[0].fridge_volume must be a number,"
+            " not 'big'.",
+            "building1.appliances[0].meters[1] must be an integer,"
+            " not 'x'.",
+            "building1.appliances[1].fuel must be one of ['gas', 'oil'],"
+            " not 'coal'.",
+            "building1.elec_meters['two'] key must be an integer,"
+            " not 'two'.",
+            "building1.elec_meters[1].sample_period must be a number,"
+            " not '6'.",
+            "building1.elec_meters[1].timeframe.start must be a timestamp,"
+            " not 2013.",
+            "building1.instance must be an integer, not True.",
+            "building1.ownership must be one of ['rented', 'bought'],"
+            " not 'leased'.",
+            "building1.rooms[0].name must be a string, not 1."])
+        self.assertEqual(
+            self.validator.check_meter_devices({'EnviR': []}),
+            ["meter_devices['EnviR'] must be an object, not []."])
+
+    def test_awkward_property_names(self):
+        awkward = ["it's", 'say "hi"', 'back\\slash', "new\nline"]
+        validator = SchemaValidator({'fridge': {'additional_properties': {
+            key: {'type': 'number'} for key in awkward}}})
+        appliance = {'type': 'fridge', 'instance': 1, 'meters': [1]}
+        appliance.update({key: 'x' for key in awkward})
+        self.assertEqual(
+            sorted(validator.check_building({'appliances': [appliance]},
+                                            'building1')),
+            sorted("building1.appliances[0].{} must be a number,"
+                   " not 'x'.".format(key) for key in awkward))
+
+
+if __name__ == '__main__':
+    unittest.main()
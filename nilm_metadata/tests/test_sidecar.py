@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.sidecar import (
+    MetadataSidecar, get_sidecar_filename, remove_metadata_sidecar)
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    write_dataset, read_metadata)
+
+
+class TestSidecar(unittest.TestCase):
+
+    def test_sidecar(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=11)
+        hdf_filename = os.path.join(directory, 'dataset.h5')
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, sidecar=True)
+        self.assertTrue(os.path.isfile(get_sidecar_filename(hdf_filename)))
+        metadata = read_metadata(hdf_filename)
+
+        with MetadataSidecar(hdf_filename) as sidecar:
+            self.assertEqual(sidecar.dataset(), metadata['/'])
+            self.assertEqual(len(sidecar.buildings()), 11)
+            self.assertEqual(sidecar.meter_ids('building10'), [1, 2, 3])
+            self.assertEqual(sidecar.meter('building10', 2),
+                             metadata['/building10']['elec_meters'][2])
+
+            building = sidecar.building('building3')
+            self.assertEqual(building.pop('meter_ids'), [1, 2, 3])
+            self.assertEqual(building, metadata['/building3'])
+            self.assertNotIn('elec_meters', sidecar.building(
+                'building3', include_meters=False))
+            self.assertEqual(sidecar.building_records('building3').to_dict(),
+                             metadata['/building3'])
+
+            with self.assertRaises(KeyError):
+                sidecar.meter('building3', 99)
+
+    def test_stale_sidecar_is_removed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=2)
+        hdf_filename = os.path.join(directory, 'dataset.h5')
+        sidecar_filename = get_sidecar_filename(hdf_filename)
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, sidecar=True)
+        self.assertTrue(os.path.isfile(sidecar_filename))
+
+        write_dataset(yaml_dir, n_buildings=3)
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, incremental=True)
+        self.assertFalse(os.path.exists(sidecar_filename))
+        self.assertFalse(remove_metadata_sidecar(hdf_filename))
+
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, incremental=True,
+                             sidecar=True)
+        with MetadataSidecar(hdf_filename) as sidecar:
+            self.assertEqual(len(sidecar.buildings()), 3)
+        self.assertTrue(remove_metadata_sidecar(hdf_filename))
+
+    def test_not_a_sidecar(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'blah.nmmeta')
+        with open(filename, 'wb') as fh:
+            fh.write(b'x' * 100)
+        with self.assertRaises(IOError):
+            MetadataSidecar(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+from nilm_metadata import file_management
+from nilm_metadata.file_management import set_yaml_loader, get_yaml_loader
+from nilm_metadata.streaming import (
+    iter_building, load_building, ELEC_METER, APPLIANCE, BUILDING)
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    building_metadata, write_dataset, read_metadata)
+
+ANCHORED_BUILDING = b"""
+instance: 1
+elec_meters:
+  1: &site_meter
+    device_model: EnviR
+    site_meter: true
+    timeframe: {start: 2013-01-01}
+  2:
+    <<: *site_meter
+    site_meter: false
+    submeter_of: 1
+  3: *site_meter
+appliances:
+- {type: fridge, instance: 1, meters: [2]}
+- {type: kettle, instance: 1, meters: [3]}
+original_name: house_1
+"""
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(set_yaml_loader, get_yaml_loader())
+
+    def loaders(self):
+        loaders = ['python']
+        if file_management._LibYAMLSafeLoader is not None:
+            loaders.append('libyaml')
+        return loaders
+
+    def test_iter_building(self):
+        for loader in self.loaders():
+            set_yaml_loader(loader)
+            records = list(iter_building(ANCHORED_BUILDING))
+            self.assertEqual([(kind, key) for kind, key, _ in records],
+                             [(BUILDING, 'instance'),
+                              (BUILDING, 'elec_meters'),
+                              (ELEC_METER, 1), (ELEC_METER, 2),
+                              (ELEC_METER, 3), (BUILDING, 'appliances'),
+                              (APPLIANCE, 0),
+                              (APPLIANCE, 1), (BUILDING, 'original_name')])
+            meters = {key: value for kind, key, value in records
+                      if kind == ELEC_METER}
+            self.assertEqual(meters[2]['device_model'], 'EnviR')
+            self.assertEqual(meters[2]['submeter_of'], 1)
+            self.assertFalse(meters[2]['site_meter'])
+            # Aliased meters are separate objects
+            self.assertEqual(meters[3], meters[1])
+            self.assertIsNot(meters[3], meters[1])
+            self.assertIsNot(meters[3]['timeframe'], meters[1]['timeframe'])
+
+    def test_load_building_matches_safe_load(self):
+        metadata = building_metadata(1)
+        metadata['appliances'] *= 3
+        text = yaml.safe_dump(metadata)
+        for loader in self.loaders():
+            set_yaml_loader(loader)
+            self.assertEqual(load_building(io.StringIO(text)), metadata)
+            self.assertEqual(load_building(ANCHORED_BUILDING),
+                             yaml.safe_load(ANCHORED_BUILDING))
+
+        loaded = load_building(text, 'building1')
+        for meter_instance, meter in loaded['elec_meters'].items():
+            self.assertEqual(meter['data_location'],
+                             '/building1/elec/meter{:d}'.format(
+                                 meter_instance))
+        self.assertEqual(load_building(''), {})
+
+    def test_empty_collections(self):
+        text = "instance: 1\nelec_meters: {}\nappliances: []\n"
+        for loader in self.loaders():
+            set_yaml_loader(loader)
+            self.assertEqual(load_building(text), yaml.safe_load(text))
+            self.assertEqual(load_building(text, 'building1'),
+                             yaml.safe_load(text))
+
+    def test_convert_building_without_meters(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        write_dataset(directory, n_buildings=0)
+        with open(os.path.join(directory, 'building1.yaml'), 'w') as fh:
+            fh.write("instance: 1\nelec_meters: {}\nappliances: []\n")
+        hdf_filename = os.path.join(directory, 'test.h5')
+        convert_yaml_to_hdf5(directory, hdf_filename)
+        self.assertEqual(read_metadata(hdf_filename)['/building1'],
+                         {'instance': 1, 'elec_meters': {},
+                          'appliances': []})
+
+    def test_errors(self):
+        with self.assertRaises(yaml.YAMLError):
+            load_building("- not a mapping")
+        with self.assertRaises(yaml.YAMLError):
+            load_building("elec_meters: {1: *undefined}")
+        with self.assertRaises(yaml.YAMLError):
+            load_building("a: 1\n---\nb: 2\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import yaml
+from nilm_metadata.convert_yaml_to_hdf5 import convert_yaml_to_hdf5
+from nilm_metadata.timeframe_index import (
+    IntervalIndex, TimeframeIndex, read_timeframe_index,
+    TIMEFRAME_INDEX_KEY, MAX_TIMESTAMP)
+from nilm_metadata.tests.test_convert_yaml_to_hdf5 import (
+    write_dataset, building_metadata)
+
+
+def buildings():
+    building1 = building_metadata(1)
+    building1['timeframe'] = {'start': '2013-01-01', 'end': '2013-02-01'}
+    meters = building1['elec_meters']
+    meters[2]['timeframe'] = {'start': '2013-01-05', 'end': '2013-01-10'}
+    meters[3]['timeframe'] = {'start': '2013-01-15'}
+    building2 = building_metadata(2)
+    meters = building2['elec_meters']
+    meters[1]['timeframe'] = {'start': '2013-01-01', 'end': '2013-01-02'}
+    meters[2]['timeframe'] = {'start': '2013-01-03', 'end': '2013-01-04'}
+    meters[3]['timeframe'] = {'start': '2013-01-04T00:00:00+00:00',
+                              'end': '2013-01-05T00:00:00+00:00'}
+    return {'building1': building1, 'building2': building2}
+
+
+class TestTimeframeIndex(unittest.TestCase):
+
+    def test_interval_index(self):
+        rng = np.random.RandomState(0)
+        starts = rng.randint(0, 1000, size=500)
+        ends = starts + rng.randint(-5, 100, size=500)
+        index = IntervalIndex(starts, ends)
+        for _ in range(200):
+            start = rng.randint(-50, 1100)
+            end = start + rng.randint(-5, 200)
+            expected = np.flatnonzero((starts < end) & (ends > start) &
+                                      (ends > starts) & (end > start))
+            np.testing.assert_array_equal(index.overlapping(start, end),
+                                          expected)
+        self.assertEqual(len(IntervalIndex([], []).overlapping(0, 1)), 0)
+
+    def test_timeframe_index(self):
+        index = TimeframeIndex(buildings(), {'timezone': 'Europe/London'})
+        meters = index.meters.set_index(['building', 'meter'])
+        # Meter 1 inherits the building's timeframe and meter 3 its end
+        self.assertEqual(meters.loc[('building1', 1), 'end'],
+                         pd.Timestamp('2013-02-01', tz='UTC').value)
+        self.assertEqual(meters.loc[('building1', 3), 'end'],
+                         pd.Timestamp('2013-02-01', tz='UTC').value)
+        # building2 has no timeframe so its meters' are used as they are
+        self.assertEqual(index.buildings.set_index('building')
+                         .loc['building2', 'end'], MAX_TIMESTAMP)
+
+        self.assertEqual(index.active_meters('2013-01-02', '2013-01-03'),
+                         [('building1', 1)])
+        self.assertEqual(
+            index.active_meters(pd.Timestamp('2013-01-09 23:00'),
+                                '2013-01-15'),
+            [('building1', 1), ('building1', 2)])
+        self.assertEqual(index.active_buildings('2014-01-01', '2014-01-02'),
+                         ['building2'])
+
+        statistics = index.statistics
+        self.assertEqual(statistics.loc['building1', 'overlap'],
+                         pd.Timedelta(days=22))
+        self.assertEqual(statistics.loc['building1', 'max_active'], 2)
+        self.assertEqual(statistics.loc['building1', 'n_gaps'], 0)
+        # Back-to-back meters neither overlap nor leave a gap
+        self.assertEqual(statistics.loc['building2', 'n_gaps'], 1)
+        self.assertEqual(statistics.loc['building2', 'total_gap'],
+                         pd.Timedelta(days=1))
+        self.assertEqual(statistics.loc['building2', 'overlap'],
+                         pd.Timedelta(0))
+        self.assertEqual(statistics.loc['building2', 'covered'],
+                         pd.Timedelta(days=3))
+
+    def test_convert_yaml_to_hdf5(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        yaml_dir = os.path.join(directory, 'metadata')
+        os.mkdir(yaml_dir)
+        write_dataset(yaml_dir, n_buildings=0)
+        for building, metadata in buildings().items():
+            with open(os.path.join(yaml_dir, building + '.yaml'), 'w') as fh:
+                yaml.safe_dump(metadata, fh)
+        hdf_filename = os.path.join(directory, 'test.h5')
+
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, index_timeframes=True,
+                             intern=True)
+        index = read_timeframe_index(hdf_filename)
+        expected = TimeframeIndex(buildings())
+        pd.testing.assert_frame_equal(index.meters, expected.meters)
+        pd.testing.assert_frame_equal(index.statistics, expected.statistics)
+
+        convert_yaml_to_hdf5(yaml_dir, hdf_filename, incremental=True,
+                             intern=True)
+        store = pd.HDFStore(hdf_filename, 'r')
+        try:
+            self.assertNotIn(TIMEFRAME_INDEX_KEY, store)
+        finally:
+            store.close()
+        with self.assertRaises(KeyError):
+            read_timeframe_index(hdf_filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
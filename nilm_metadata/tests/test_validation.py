@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import unittest
+from nilm_metadata.validation import (
+    validate_buildings, NilmMetadataError)
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_validate_buildings(self):
+        meter_devices = {'EnviR': {}}
+        good = {
+            'instance': 1,
+            'elec_meters': {1: {'device_model': 'EnviR'},
+                            2: {'device_model': 'EnviR'}},
+            'appliances': [
+                {'type': 'kettle', 'instance': 1, 'meters': [1]},
+                {'type': 'kettle', 'instance': 2, 'meters': [2]},
+                {'type': 'fridge', 'instance': 1, 'meters': [0]}]
+        }
+        bad = {
+            'instance': 2,
+            'elec_meters': {1: {'device_model': 'blah'}},
+            'appliances': [
+                {'type': 'kettle', 'instance': 1, 'meters': [1, 1]},
+                {'type': 'kettle', 'instance': 3, 'meters': [2]},
+                {'type': 'blah', 'instance': 1, 'meters': [1]},
+                {'type': 'fridge', 'meters': [1]},
+                'not a dict']
+        }
+        report = validate_buildings({'building1': good},
+                                    meter_devices)
+        self.assertTrue(report)
+        report.raise_if_invalid()
+
+        report = validate_buildings({'building1': good, 'building2': bad},
+                                    meter_devices)
+        self.assertFalse(report)
+        self.assertEqual({v.building for v in report}, {'building2'})
+        self.assertEqual(sorted(v.rule for v in report),
+                         ['appliance_is_dict', 'appliance_type',
+                          'device_model', 'instances', 'meter_exists',
+                          'required_key', 'schema', 'unique_meters'])
+        self.assertEqual(len(report.to_frame()), 8)
+        with self.assertRaisesRegex(NilmMetadataError, '8 violation'):
+            report.raise_if_invalid()
+
+    def test_single_building_matches_vectorized(self):
+        meter_devices = {'EnviR': {}}
+        other = {'instance': 9, 'elec_meters': {1: {'device_model': 'EnviR'}},
+                 'appliances': [{'type': 'kettle', 'instance': 1,
+                                 'meters': [1]}]}
+        buildings = [
+            {'instance': 2,
+             'elec_meters': {1: {'device_model': 'blah'}, 2: None,
+                             3: {'device_model': 'EnviR'}},
+             'appliances': [
+                 {'type': 'kettle', 'instance': 1, 'meters': [1, 1, 5, 5]},
+                 {'type': 'kettle', 'instance': 3, 'meters': 2},
+                 {'type': 'blah', 'instance': 1, 'meters': [1, '1', 0]},
+                 {'type': 'fridge', 'meters': [1]},
+                 {'type': 'fridge', 'instance': 1},
+                 {'type': None, 'instance': 1, 'meters': [[1]]},
+                 {'instance': 1, 'meters': [3]},
+                 'not a dict']},
+            {'instance': 3, 'elec_meters': {1: {}},
+             'appliances': [
+                 {'type': 'kettle', 'instance': '1', 'meters': [1]},
+                 {'type': 'fridge', 'instance': 1.5, 'meters': [1]},
+                 {'type': 'toaster', 'instance': 2.0, 'meters': [1]},
+                 {'type': 'toaster', 'instance': 1.0, 'meters': [1]},
+                 {'type': 'lamp', 'instance': [1], 'meters': [1]},
+                 {'type': 'lamp', 'instance': 2, 'meters': [1]}]},
+            {'instance': 4}]
+        for building in buildings:
+            single = validate_buildings({'building1': building},
+                                        meter_devices)
+            vectorized = validate_buildings(
+                {'building1': building, 'building2': other}, meter_devices)
+            self.assertEqual(single.violations, [
+                v for v in vectorized if v.building == 'building1'])
+
+    def test_meter_ids_of_the_wrong_type(self):
+        building = {
+            'instance': 1,
+            'elec_meters': {1: {'device_model': 'EnviR'}},
+            'appliances': [{'type': 'fridge', 'instance': 1,
+                            'meters': ['1']}]}
+        report = validate_buildings({'building1': building},
+                                    {'EnviR': {}})
+        rules = sorted(v.rule for v in report)
+        self.assertIn('meter_exists', rules)
+        self.assertIn('schema', rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
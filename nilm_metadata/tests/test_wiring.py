@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import unittest
+from nilm_metadata.wiring import (
+    WiringTree, WiringError, wiring_errors, SITE_METERS)
+
+
+class TestWiring(unittest.TestCase):
+
+    def test_wiring_tree(self):
+        elec_meters = {
+            1: {'site_meter': True},
+            2: {'site_meter': True},
+            3: {'site_meter': True, 'submeter_of': 1, 'disabled': True},
+            4: {'submeter_of': 0},
+            5: {'submeter_of': 4},
+            6: {'submeter_of': 5},
+            7: {'submeter_of': 1},
+            8: {'submeter_of': 3, 'upstream_meter_in_building': 2}
+        }
+        tree = WiringTree(elec_meters, building_instance=1)
+        self.assertEqual(wiring_errors(elec_meters, 1), [])
+        self.assertEqual(tree.parent(4), SITE_METERS)
+        self.assertEqual(tree.parent(1), None)
+        self.assertEqual(tree.parent(8), None)
+        self.assertEqual(tree.children(1), [3, 7])
+        self.assertEqual(tree.depth(6), 3)
+        self.assertEqual(tree.depth(1), 0)
+        self.assertEqual(tree.site_meter(6), SITE_METERS)
+        self.assertEqual(tree.site_meter(7), 1)
+        self.assertEqual(tree.site_meter(3), 3)
+        self.assertEqual(tree.site_meter(8), None)
+        self.assertEqual(sorted(tree.downstream(SITE_METERS)), [4, 5, 6])
+        self.assertEqual(sorted(tree.downstream(1)), [3, 7])
+        self.assertEqual(tree.downstream(6), [])
+        self.assertEqual(tree.upstream(6), [5, 4, SITE_METERS])
+        self.assertTrue(tree.is_downstream_of(6, 4))
+        self.assertFalse(tree.is_downstream_of(4, 6))
+
+        copy = WiringTree.from_dict(tree.to_dict())
+        self.assertEqual(copy.downstream(4), tree.downstream(4))
+
+    def test_wiring_errors(self):
+        BAD_WIRING = [
+            {1: {'submeter_of': 0}},  # no site meters
+            {1: {'site_meter': True, 'submeter_of': 0}},
+            {1: {'site_meter': True}, 2: {'submeter_of': 3}},  # dangling
+            {1: {'submeter_of': 2}, 2: {'site_meter': True,
+                                        'submeter_of': 1}},
+            {1: {'submeter_of': 2}, 2: {'submeter_of': 1}},  # cycle
+            {1: {'submeter_of': 1}},  # own parent
+        ]
+        for elec_meters in BAD_WIRING:
+            self.assertEqual(len(wiring_errors(elec_meters)), 1)
+            with self.assertRaises(WiringError):
+                WiringTree(elec_meters)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,345 @@
+"""Interval index over the timeframes of buildings and ElecMeters.
+
+Timeframes are stored as ISO 8601 strings inside each record's metadata,
+so finding the meters which were recording during a window otherwise
+means parsing every timeframe.  `TimeframeIndex` converts them once into
+int64 nanosecond arrays and answers window queries with an
+`IntervalIndex`.
+
+`convert_yaml_to_hdf5(..., index_timeframes=True)` stores the index in
+the HDF5 file under `TIMEFRAME_INDEX_KEY`; read it back with
+`read_timeframe_index`.
+"""
+from __future__ import print_function, division
+import numpy as np
+import pandas as pd
+from six import iteritems
+
+TIMEFRAME_INDEX_KEY = '/nilm_metadata/timeframe_index'
+
+# Used for the start or end of a timeframe which is open (absent from the
+# meter, its building and the dataset).
+MIN_TIMESTAMP = np.iinfo(np.int64).min
+MAX_TIMESTAMP = np.iinfo(np.int64).max
+
+
+class IntervalIndex(object):
+    """A static index of half-open intervals [start, end) of int64s.
+
+    Intervals which overlap a query window [start, end) are those which
+    contain `start` plus those which start within (start, end).  The
+    first are found with a centred interval tree (each node holds the
+    intervals containing its centre, sorted both by start and by end)
+    and the second with a binary search of all the intervals sorted by
+    start, so a query takes O(log n + k) for k results.  Empty intervals
+    (end <= start) are never returned.
+
+    Parameters
+    ----------
+    starts, ends : array-like of int64, same length
+    """
+
+    def __init__(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        if self.starts.shape != self.ends.shape:
+            raise ValueError("starts and ends must have the same length.")
+        ids = np.flatnonzero(self.ends > self.starts)
+        self._ids_by_start = ids[np.argsort(self.starts[ids], kind='stable')]
+        self._sorted_starts = self.starts[self._ids_by_start]
+        self._nodes = []
+        self._root = self._build(self._ids_by_start)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _build(self, ids_by_start):
+        """Adds the subtree for `ids_by_start` (ids of non-empty intervals,
+        sorted by start) to `self._nodes`.
+
+        Returns
+        -------
+        The node's position in `self._nodes`, or -1 if `ids` is empty.
+        """
+        if not len(ids_by_start):
+            return -1
+        starts = self.starts[ids_by_start]
+        ends = self.ends[ids_by_start]
+        # The median start is always contained by its own interval, so
+        # every node holds at least one interval and both children hold
+        # at most half of the intervals.
+        center = starts[len(starts) // 2]
+        here = ends > center
+        here &= starts <= center
+        node_ids = ids_by_start[here]
+        node_ids_by_end = node_ids[np.argsort(self.ends[node_ids],
+                                              kind='stable')]
+        position = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(ids_by_start[ends <= center])
+        right = self._build(ids_by_start[starts > center])
+        self._nodes[position] = (
+            center, node_ids, self.starts[node_ids],
+            node_ids_by_end, self.ends[node_ids_by_end], left, right)
+        return position
+
+    def containing(self, point):
+        """
+        Returns
+        -------
+        np.ndarray of the (unsorted) ids of intervals which contain
+        `point`, i.e. start <= point < end.
+        """
+        found = []
+        node = self._root
+        while node != -1:
+            (center, ids_by_start, starts, ids_by_end, ends,
+             left, right) = self._nodes[node]
+            if point < center:
+                # Every interval here ends after the centre.
+                found.append(
+                    ids_by_start[:np.searchsorted(starts, point, 'right')])
+                node = left
+            else:
+                # Every interval here starts at or before the centre.
+                found.append(
+                    ids_by_end[np.searchsorted(ends, point, 'right'):])
+                node = right
+        return _concatenate(found)
+
+    def overlapping(self, start, end):
+        """
+        Returns
+        -------
+        np.ndarray of the sorted ids of intervals which overlap the
+        window [start, end), i.e. interval start < end and interval
+        end > start.
+        """
+        if end <= start:
+            return np.array([], dtype=np.int64)
+        lo = np.searchsorted(self._sorted_starts, start, 'right')
+        hi = np.searchsorted(self._sorted_starts, end, 'left')
+        ids = _concatenate([self.containing(start),
+                            self._ids_by_start[lo:hi]])
+        ids.sort()
+        return ids
+
+
+class TimeframeIndex(object):
+    """Interval indexes of the timeframes of every building and ElecMeter
+    in a dataset.
+
+    As the schema describes, a missing timeframe start or end is taken
+    from the building's timeframe, then from the dataset's.  If it is
+    absent from all three then the timeframe is open at that end.
+    Timestamps without a timezone are taken to be in the dataset's
+    `timezone` (UTC if none is given).
+
+    Building the index also computes `statistics`.
+
+    Parameters
+    ----------
+    buildings : dict
+        Maps a building identifier (e.g. 'building1') to building metadata.
+    dataset_metadata : dict, optional
+
+    Attributes
+    ----------
+    meters : pd.DataFrame with columns building, meter, start and end
+        (int64 nanoseconds since the epoch, UTC).
+    buildings : pd.DataFrame with columns building, start and end.
+    statistics : pd.DataFrame indexed by building (see
+        `timeframe_statistics`).
+    """
+
+    def __init__(self, buildings, dataset_metadata=None):
+        dataset_metadata = dataset_metadata or {}
+        tz = dataset_metadata.get('timezone')
+        dataset_timeframe = _timeframe_ns(
+            dataset_metadata.get('timeframe'), (MIN_TIMESTAMP, MAX_TIMESTAMP),
+            tz)
+        building_rows = []
+        meter_rows = []
+        for building, building_metadata in sorted(iteritems(buildings)):
+            building_timeframe = _timeframe_ns(
+                building_metadata.get('timeframe'), dataset_timeframe, tz)
+            building_rows.append((building,) + building_timeframe)
+            elec_meters = building_metadata.get('elec_meters') or {}
+            for meter, meter_metadata in sorted(iteritems(elec_meters)):
+                meter_rows.append((building, meter) + _timeframe_ns(
+                    meter_metadata.get('timeframe'), building_timeframe, tz))
+        self._set_frames(
+            pd.DataFrame(meter_rows,
+                         columns=['building', 'meter', 'start', 'end']),
+            pd.DataFrame(building_rows,
+                         columns=['building', 'start', 'end']))
+
+    @classmethod
+    def from_frames(cls, meters, buildings):
+        """Inverse of `to_frames`."""
+        index = cls.__new__(cls)
+        index._set_frames(meters, buildings)
+        return index
+
+    def to_frames(self):
+        """
+        Returns
+        -------
+        (meters, buildings) DataFrames.
+        """
+        return self.meters, self.buildings
+
+    def _set_frames(self, meters, buildings):
+        self.meters = meters.astype({'meter': np.int64, 'start': np.int64,
+                                     'end': np.int64})
+        self.buildings = buildings.astype({'start': np.int64,
+                                           'end': np.int64})
+        self._meter_index = IntervalIndex(self.meters['start'].values,
+                                          self.meters['end'].values)
+        self._building_index = IntervalIndex(self.buildings['start'].values,
+                                             self.buildings['end'].values)
+        self.statistics = timeframe_statistics(self.meters)
+
+    def active_meters(self, start, end):
+        """
+        Parameters
+        ----------
+        start, end : anything accepted by pd.Timestamp, or int64
+            nanoseconds.  Naive timestamps are taken to be UTC.
+
+        Returns
+        -------
+        list of (building, meter instance) tuples for every meter whose
+        timeframe overlaps [start, end), in the order of `meters`.
+        """
+        ids = self._meter_index.overlapping(_to_ns(start), _to_ns(end))
+        rows = self.meters.iloc[ids]
+        return list(zip(rows['building'].tolist(), rows['meter'].tolist()))
+
+    def active_buildings(self, start, end):
+        """
+        Returns
+        -------
+        list of the buildings whose timeframe overlaps [start, end).
+        """
+        ids = self._building_index.overlapping(_to_ns(start), _to_ns(end))
+        return self.buildings['building'].iloc[ids].tolist()
+
+    def write(self, store):
+        """Stores the index in an open pd.HDFStore under
+        `TIMEFRAME_INDEX_KEY`."""
+        store.put(TIMEFRAME_INDEX_KEY + '/meters', self.meters)
+        store.put(TIMEFRAME_INDEX_KEY + '/buildings', self.buildings)
+
+
+def read_timeframe_index(hdf_filename):
+    """
+    Returns
+    -------
+    TimeframeIndex stored by `convert_yaml_to_hdf5(...,
+    index_timeframes=True)`.
+
+    Raises
+    ------
+    KeyError if the file has no timeframe index.
+    """
+    store = pd.HDFStore(hdf_filename, 'r')
+    try:
+        return TimeframeIndex.from_frames(
+            store[TIMEFRAME_INDEX_KEY + '/meters'],
+            store[TIMEFRAME_INDEX_KEY + '/buildings'])
+    finally:
+        store.close()
+
+
+def timeframe_statistics(meters):
+    """Overlap and gap statistics of the meter timeframes of each building,
+    found by sweeping over the sorted start and end times.
+
+    Open ends are clipped to the building's earliest and latest finite
+    timestamps.
+
+    Parameters
+    ----------
+    meters : pd.DataFrame with columns building, start and end (int64 ns)
+
+    Returns
+    -------
+    pd.DataFrame indexed by building with columns:
+    * n_meters
+    * start, end : the earliest start and latest end (pd.Timestamp, UTC)
+    * covered : time during which at least one meter was recording
+    * n_gaps, total_gap, longest_gap : periods between `start` and `end`
+      when no meter was recording
+    * overlap : time during which more than one meter was recording
+    * max_active : the largest number of meters recording at once
+    """
+    columns = ['n_meters', 'start', 'end', 'covered', 'n_gaps', 'total_gap',
+               'longest_gap', 'overlap', 'max_active']
+    rows = []
+    for building, group in meters.groupby('building', sort=True):
+        starts = group['start'].values
+        ends = group['end'].values
+        finite = np.concatenate([starts[starts != MIN_TIMESTAMP],
+                                 ends[ends != MAX_TIMESTAMP]])
+        valid = ends > starts
+        if not len(finite) or not valid.any():
+            rows.append((building, len(group), pd.NaT, pd.NaT, pd.NaT, 0,
+                         pd.NaT, pd.NaT, pd.NaT, 0))
+            continue
+        lo, hi = finite.min(), finite.max()
+        starts = np.clip(starts[valid], lo, hi)
+        ends = np.clip(ends[valid], lo, hi)
+        # Ends sort before starts at the same time: timeframes are
+        # half-open, so back-to-back meters neither overlap nor leave a gap.
+        times = np.concatenate([ends, starts])
+        deltas = np.concatenate([np.full(len(ends), -1),
+                                 np.ones(len(starts), dtype=np.int64)])
+        order = np.lexsort((deltas, times))
+        times = times[order]
+        active = np.cumsum(deltas[order])
+        durations = np.diff(times)
+        active = active[:-1]
+        gaps = durations[(active == 0) & (durations > 0)]
+        rows.append((
+            building, len(group),
+            pd.Timestamp(int(times[0]), tz='UTC'),
+            pd.Timestamp(int(times[-1]), tz='UTC'),
+            pd.Timedelta(int(durations[active > 0].sum())),
+            len(gaps),
+            pd.Timedelta(int(gaps.sum())),
+            pd.Timedelta(int(gaps.max())) if len(gaps) else pd.Timedelta(0),
+            pd.Timedelta(int(durations[active > 1].sum())),
+            int(active.max()) if len(active) else 0))
+    return pd.DataFrame(
+        [row[1:] for row in rows], columns=columns,
+        index=pd.Index([row[0] for row in rows], name='building'))
+
+
+def _timeframe_ns(timeframe, default, tz):
+    """
+    Returns
+    -------
+    (start, end) in int64 nanoseconds, defaulting to `default`.
+    """
+    timeframe = timeframe or {}
+    start = timeframe.get('start')
+    end = timeframe.get('end')
+    return (default[0] if start is None else _to_ns(start, tz),
+            default[1] if end is None else _to_ns(end, tz))
+
+
+def _to_ns(timestamp, tz=None):
+    if isinstance(timestamp, (int, np.integer)):
+        return int(timestamp)
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize(tz or 'UTC')
+    return timestamp.value
+
+
+def _concatenate(arrays):
+    arrays = [array for array in arrays if len(array)]
+    if not arrays:
+        return np.array([], dtype=np.int64)
+    return np.concatenate(arrays)
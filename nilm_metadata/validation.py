@@ -0,0 +1,498 @@
+from __future__ import print_function, division
+from collections import namedtuple
+from numbers import Number
+import pandas as pd
+from six import iteritems
+from nilm_metadata.object_concatenation import get_appliance_type_registry
+from nilm_metadata.wiring import wiring_errors
+from nilm_metadata.records import as_building_dict
+from nilm_metadata.profiling import phase
+
+
+class NilmMetadataError(Exception):
+    pass
+
+
+REQUIRED_APPLIANCE_KEYS = ['type', 'instance', 'meters']
+
+Violation = namedtuple('Violation', ['building', 'rule', 'message'])
+
+
+class ValidationReport(object):
+    """Every violation found by `validate_buildings`.
+
+    Attributes
+    ----------
+    violations : list of Violation namedtuples (building, rule, message)
+    """
+
+    def __init__(self, violations=None):
+        self.violations = list(violations or [])
+
+    def __bool__(self):
+        """True if there are no violations."""
+        return not self.violations
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        return len(self.violations)
+
+    def __iter__(self):
+        return iter(self.violations)
+
+    def __str__(self):
+        if not self.violations:
+            return "No violations."
+        lines = ["{:d} violation(s):".format(len(self.violations))]
+        lines.extend("* [{}] {}".format(v.building, v.message)
+                     for v in self.violations)
+        return '\n'.join(lines)
+
+    def to_frame(self):
+        """
+        Returns
+        -------
+        pd.DataFrame with columns building, rule and message.
+        """
+        return pd.DataFrame(self.violations, columns=Violation._fields)
+
+    def raise_if_invalid(self):
+        """
+        Raises
+        ------
+        NilmMetadataError listing every violation.
+        """
+        if len(self.violations) == 1:
+            raise NilmMetadataError(self.violations[0].message)
+        elif self.violations:
+            raise NilmMetadataError(str(self))
+
+
+def validate_buildings(buildings, meter_devices=None,
+                       appliance_type_names=None):
+    """Checks the metadata of any number of buildings in one pass.
+
+    The buildings are first flattened into columnar tables (see
+    `building_tables`) and then each rule is checked with a single
+    vectorized pandas operation over all buildings.  Building the tables
+    has a fixed cost which outweighs the vectorization for one building
+    (as checked during conversion), so a single building's records are
+    checked one by one instead, giving the same violations.  Every
+    violation is collected rather than stopping at the first.
+
+    Checks:
+    * every appliance is a dict with 'type', 'instance' and 'meters'
+    * every appliance type is a recognised NILM Metadata appliance type
+    * each appliance's meters are unique and exist in the building's
+      elec_meters (meter 0 is allowed)
+    * the instances of each appliance type in a building are 1..N
+    * every meter's device_model is in `meter_devices`
+    * the submeter_of wiring tree is valid (see `wiring.wiring_errors`)
+    * field types match the schema, including each appliance type's
+      `additional_properties` (see `schema.SchemaValidator`)
+
+    Parameters
+    ----------
+    buildings : dict
+        Maps a building identifier (e.g. 'building1') to building
+        metadata, as a dict or as `records.BuildingRecords`.
+    meter_devices : dict, optional
+        If None then device models are not checked.
+    appliance_type_names : set of strings, optional
+        Defaults to every appliance type in the central metadata.
+
+    Returns
+    -------
+    ValidationReport
+    """
+    registry = get_appliance_type_registry()
+    if appliance_type_names is None:
+        appliance_type_names = registry.names()
+    schema_validator = registry.schema_validator()
+    with phase('validate'):
+        if len(buildings) == 1:
+            (building, building_metadata), = iteritems(buildings)
+            building_metadata = as_building_dict(building_metadata)
+            violations = _check_single_building(
+                building, building_metadata, appliance_type_names,
+                meter_devices)
+            violations.extend(_check_wiring_and_schema(
+                building, building_metadata, schema_validator))
+        else:
+            # Each building is only made into a dict once, while its rows
+            # are added to the tables.
+            per_building_violations = []
+
+            def checked_buildings():
+                for building, building_metadata in iteritems(buildings):
+                    building_metadata = as_building_dict(building_metadata)
+                    per_building_violations.extend(_check_wiring_and_schema(
+                        building, building_metadata, schema_validator))
+                    yield building, building_metadata
+
+            tables = _building_tables(checked_buildings())
+            violations = list(tables['violations'])
+            violations.extend(
+                _check_appliances(tables, appliance_type_names))
+            if meter_devices is not None:
+                violations.extend(
+                    _check_device_models(tables, meter_devices))
+            violations.extend(per_building_violations)
+    return ValidationReport(violations)
+
+
+def _check_wiring_and_schema(building, building_metadata, schema_validator):
+    violations = []
+    elec_meters = building_metadata.get('elec_meters') or {}
+    for message in wiring_errors(elec_meters,
+                                 building_metadata.get('instance')):
+        violations.append(Violation(building, 'wiring', message))
+    for message in schema_validator.check_building(
+            building_metadata, str(building)):
+        violations.append(Violation(building, 'schema', message))
+    return violations
+
+
+def validate_dataset_metadata(dataset_metadata, meter_devices=None):
+    """Checks the field types of the dataset metadata and meter devices
+    against the schema (see `schema.SchemaValidator`).
+
+    Returns
+    -------
+    ValidationReport.  Violations are attributed to 'dataset' or
+    'meter_devices' rather than to a building.
+    """
+    schema_validator = get_appliance_type_registry().schema_validator()
+    violations = []
+    with phase('validate'):
+        if dataset_metadata is not None:
+            violations.extend(
+                Violation('dataset', 'schema', message) for message
+                in schema_validator.check_dataset(dataset_metadata))
+        if meter_devices is not None:
+            violations.extend(
+                Violation('meter_devices', 'schema', message) for message
+                in schema_validator.check_meter_devices(meter_devices))
+    return ValidationReport(violations)
+
+
+def building_tables(buildings):
+    """Flattens building metadata into columnar tables.
+
+    Parameters
+    ----------
+    buildings : dict
+        Maps a building identifier (e.g. 'building1') to building
+        metadata, as a dict or as `records.BuildingRecords`.
+
+    Returns
+    -------
+    dict with keys:
+    * 'meters' : pd.DataFrame with columns building, meter, device_model
+    * 'appliances' : pd.DataFrame with one row per appliance and columns
+      building, building_instance, position (index into the building's
+      list of appliances), type, instance and has_<key> for each
+      required key
+    * 'appliance_meters' : pd.DataFrame with columns building, position
+      and meter; one row per meter per appliance
+    * 'violations' : list of Violations for records which could not be
+      flattened (e.g. appliances which are not dicts)
+    """
+    return _building_tables(
+        (building, as_building_dict(building_metadata))
+        for building, building_metadata in iteritems(buildings))
+
+
+def _building_tables(buildings):
+    """`building_tables` of an iterable of (building, building metadata
+    dict) pairs."""
+    meters = {'building': [], 'meter': [], 'device_model': []}
+    appliances = {'building': [], 'building_instance': [], 'position': [],
+                  'type': [], 'instance': []}
+    for key in REQUIRED_APPLIANCE_KEYS:
+        appliances['has_' + key] = []
+    appliance_meters = {'building': [], 'position': [], 'meter': []}
+    violations = []
+
+    for building, building_metadata in buildings:
+        building_instance = building_metadata.get('instance')
+        for meter, meter_metadata in iteritems(
+                building_metadata.get('elec_meters') or {}):
+            meters['building'].append(building)
+            meters['meter'].append(meter)
+            meters['device_model'].append(
+                (meter_metadata or {}).get('device_model'))
+
+        for position, appliance in enumerate(
+                building_metadata.get('appliances') or []):
+            if not isinstance(appliance, dict):
+                violations.append(Violation(
+                    building, 'appliance_is_dict',
+                    "Appliance '{}' is {} when it should be a dict."
+                    .format(appliance, type(appliance))))
+                continue
+            appliances['building'].append(building)
+            appliances['building_instance'].append(building_instance)
+            appliances['position'].append(position)
+            appliances['type'].append(appliance.get('type'))
+            appliances['instance'].append(appliance.get('instance'))
+            for key in REQUIRED_APPLIANCE_KEYS:
+                appliances['has_' + key].append(key in appliance)
+            appliance_meter_list = appliance.get('meters') or []
+            if not isinstance(appliance_meter_list, list):
+                appliance_meter_list = [appliance_meter_list]
+            for meter in filter(_is_hashable, appliance_meter_list):
+                appliance_meters['building'].append(building)
+                appliance_meters['position'].append(position)
+                appliance_meters['meter'].append(meter)
+
+    # Object columns keep values as given (e.g. None rather than NaN and
+    # 1 rather than 1.0 next to a missing instance) for error messages.
+    appliances = pd.DataFrame(
+        {key: pd.Series(values, dtype=object)
+         if key in ['building_instance', 'type', 'instance'] else values
+         for key, values in iteritems(appliances)})
+    return {'meters': pd.DataFrame(meters),
+            'appliances': appliances,
+            'appliance_meters': pd.DataFrame(appliance_meters),
+            'violations': violations}
+
+
+def _appliance_string(appl_type, instance, building_instance):
+    """A string identifying an appliance, for error messages."""
+    return ("ApplianceType '{}', instance '{}', in building {}"
+            .format(appl_type, instance, building_instance))
+
+
+def _appliance_strings(appliances):
+    return [_appliance_string(appl_type, instance, building_instance)
+            for appl_type, instance, building_instance in zip(
+                appliances['type'], appliances['instance'],
+                appliances['building_instance'])]
+
+
+def _instances_message(building_instance, appliance_type, instance_list):
+    try:
+        instance_list.sort()
+    except TypeError:
+        instance_list.sort(key=str)
+    correct_instances = list(range(1, len(instance_list)+1))
+    return ("In building {}, appliance '{}' appears {:d} time(s)."
+            " Yet the list of instances is '{}'.  The list of instances"
+            " should be '{}'."
+            .format(building_instance, appliance_type, len(instance_list),
+                    instance_list, correct_instances))
+
+
+def _contains(collection, value):
+    try:
+        return value in collection
+    except TypeError:  # unhashable
+        return False
+
+
+def _is_hashable(value):
+    """Unhashable meter IDs (e.g. lists) cannot be looked up, so are left
+    to the schema check, which reports their type."""
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _check_single_building(building, building_metadata,
+                            appliance_type_names, meter_devices=None):
+    """The checks of `building_tables`, `_check_appliances` and
+    `_check_device_models` for a single building, one record at a time.
+
+    Returns
+    -------
+    list of Violations, in the same order as the vectorized checks.
+    """
+    violations = []
+    building_instance = building_metadata.get('instance')
+    elec_meters = building_metadata.get('elec_meters') or {}
+    appliances = []
+    for appliance in building_metadata.get('appliances') or []:
+        if not isinstance(appliance, dict):
+            violations.append(Violation(
+                building, 'appliance_is_dict',
+                "Appliance '{}' is {} when it should be a dict."
+                .format(appliance, type(appliance))))
+            continue
+        meters = appliance.get('meters') or []
+        if not isinstance(meters, list):
+            meters = [meters]
+        meters = list(filter(_is_hashable, meters))
+        appliances.append((appliance, meters, _appliance_string(
+            appliance.get('type'), appliance.get('instance'),
+            building_instance)))
+
+    # Check required keys are all present
+    for key in REQUIRED_APPLIANCE_KEYS:
+        for appliance, _, appl_string in appliances:
+            if key not in appliance:
+                violations.append(Violation(
+                    building, 'required_key',
+                    "key '{}' missing for {}".format(key, appl_string)))
+
+    # Check all appliance names are valid
+    for appliance, _, appl_string in appliances:
+        if 'type' in appliance and not _contains(appliance_type_names,
+                                                 appliance['type']):
+            violations.append(Violation(
+                building, 'appliance_type',
+                appl_string + " not in appliance_types."
+                "  In other words, '{}' is not a recognised appliance type."
+                .format(appliance['type'])))
+
+    # Check appliances reference valid meters
+    for _, meters, appl_string in appliances:
+        if len(set(meters)) != len(meters):
+            violations.append(Violation(
+                building, 'unique_meters',
+                "In {}, meters '{}' not unique.".format(appl_string,
+                                                        meters)))
+    for _, meters, appl_string in appliances:
+        for meter in meters:
+            if meter != 0 and not _contains(elec_meters, meter):
+                violations.append(Violation(
+                    building, 'meter_exists',
+                    "In ({}), meter '{}' is not in this building's"
+                    " 'elec_meters'".format(appl_string, meter)))
+
+    # Check list of instances for each appliance is valid.  Appliances
+    # without a type have already been reported.
+    appliance_instances = {}
+    for appliance, _, _ in appliances:
+        if ('type' in appliance and 'instance' in appliance and
+                appliance['type'] is not None):
+            appliance_instances.setdefault(appliance['type'], []).append(
+                appliance['instance'])
+    for appliance_type, instance_list in iteritems(appliance_instances):
+        if not _is_one_to_n(instance_list):
+            violations.append(Violation(
+                building, 'instances', _instances_message(
+                    building_instance, appliance_type, instance_list)))
+
+    if meter_devices is not None:
+        for meter, meter_metadata in iteritems(elec_meters):
+            device_model = (meter_metadata or {}).get('device_model')
+            if not _contains(meter_devices, device_model):
+                violations.append(Violation(
+                    building, 'device_model',
+                    "Meter {} has device_model '{}' which is not in"
+                    " meter_devices.".format(meter, device_model)))
+    return violations
+
+
+def _is_one_to_n(instance_list):
+    """True if `instance_list` holds the numbers 1 to N in any order."""
+    if not all(isinstance(instance, Number) for instance in instance_list):
+        return False
+    return sorted(instance_list) == list(range(1, len(instance_list)+1))
+
+
+def _check_appliances(tables, appliance_type_names):
+    appliances = tables['appliances']
+    appliance_meters = tables['appliance_meters']
+    violations = []
+    if appliances.empty:
+        return violations
+
+    appl_strings = pd.Series(_appliance_strings(appliances),
+                             index=appliances.index)
+
+    # Check required keys are all present
+    for key in REQUIRED_APPLIANCE_KEYS:
+        missing = ~appliances['has_' + key]
+        for building, appl_string in zip(appliances.loc[missing, 'building'],
+                                         appl_strings[missing]):
+            violations.append(Violation(
+                building, 'required_key',
+                "key '{}' missing for {}".format(key, appl_string)))
+
+    # Check all appliance names are valid
+    unknown = appliances['has_type'] & ~appliances['type'].isin(
+        list(appliance_type_names))
+    for building, appl_type, appl_string in zip(
+            appliances.loc[unknown, 'building'],
+            appliances.loc[unknown, 'type'], appl_strings[unknown]):
+        violations.append(Violation(
+            building, 'appliance_type',
+            appl_string + " not in appliance_types."
+            "  In other words, '{}' is not a recognised appliance type."
+            .format(appl_type)))
+
+    # Check appliances reference valid meters
+    if not appliance_meters.empty:
+        key = ['building', 'position']
+        appl_strings_by_key = pd.Series(
+            appl_strings.values,
+            index=pd.MultiIndex.from_frame(appliances[key]))
+
+        duplicated = appliance_meters.duplicated(key + ['meter'])
+        for building, position in (appliance_meters.loc[duplicated, key]
+                                   .drop_duplicates().itertuples(index=False)):
+            meters = appliance_meters.loc[
+                (appliance_meters['building'] == building) &
+                (appliance_meters['position'] == position), 'meter']
+            violations.append(Violation(
+                building, 'unique_meters',
+                "In {}, meters '{}' not unique.".format(
+                    appl_strings_by_key[(building, position)],
+                    list(meters))))
+
+        # Compare meter IDs as objects so that IDs of the wrong type (e.g.
+        # '1' when elec_meters has int keys) are reported, not a dtype
+        # mismatch raised by merge.
+        known_meters = tables['meters'][['building', 'meter']].astype(
+            {'meter': object})
+        merged = appliance_meters[appliance_meters['meter'] != 0].astype(
+            {'meter': object}).merge(
+                known_meters, on=['building', 'meter'], how='left',
+                indicator=True)
+        unknown = merged[merged['_merge'] == 'left_only']
+        for building, position, meter in unknown[key + ['meter']].itertuples(
+                index=False):
+            violations.append(Violation(
+                building, 'meter_exists',
+                "In ({}), meter '{}' is not in this building's 'elec_meters'"
+                .format(appl_strings_by_key[(building, position)], meter)))
+
+    # Check list of instances for each appliance is valid.
+    with_instances = appliances[appliances['has_type'] &
+                                appliances['has_instance']]
+    # Anything but a whole number (e.g. the string '1') is invalid
+    instances = pd.to_numeric(with_instances['instance'].map(
+        lambda instance: instance if isinstance(instance, Number) else None),
+        errors='coerce')
+    instances = instances.where(instances % 1 == 0)
+    grouped = instances.groupby(
+        [with_instances['building'], with_instances['type']], sort=False)
+    stats = grouped.agg(['count', 'size', 'min', 'max', 'nunique'])
+    valid = ((stats['count'] == stats['size']) & (stats['min'] == 1) &
+             (stats['max'] == stats['size']) &
+             (stats['nunique'] == stats['size']))
+    for building, appliance_type in stats.index[~valid]:
+        rows = with_instances[(with_instances['building'] == building) &
+                              (with_instances['type'] == appliance_type)]
+        violations.append(Violation(
+            building, 'instances', _instances_message(
+                rows['building_instance'].iloc[0], appliance_type,
+                list(rows['instance']))))
+
+    return violations
+
+
+def _check_device_models(tables, meter_devices):
+    meters = tables['meters']
+    unknown = ~meters['device_model'].isin(list(meter_devices or {}))
+    return [Violation(building, 'device_model',
+                      "Meter {} has device_model '{}' which is not in"
+                      " meter_devices.".format(meter, device_model))
+            for building, meter, device_model in meters.loc[
+                unknown, ['building', 'meter', 'device_model']].itertuples(
+                    index=False)]
@@ -0,0 +1,230 @@
+from __future__ import print_function, division
+from six import iteritems
+
+# Parent of every meter with submeter_of=0, i.e. "all the site meters".
+SITE_METERS = 0
+
+
+class WiringError(Exception):
+    pass
+
+
+class WiringTree(object):
+    """Index over the mains wiring hierarchy of one building's ElecMeters.
+
+    Built from `submeter_of`, `site_meter` and
+    `upstream_meter_in_building` in linear time.  Meters with
+    `submeter_of=0` hang off a virtual node, `SITE_METERS` (0), which
+    represents all the site meters summed together.
+
+    Meters are numbered in depth-first preorder, so every meter's
+    downstream meters form one contiguous slice of `preorder` and
+    `downstream(meter)` costs O(k) for k downstream meters.
+
+    Parameters
+    ----------
+    elec_meters : dict
+        Maps meter instance to ElecMeter metadata.
+    building_instance : int, optional
+        Used to recognise meters whose upstream meter is in another
+        building (these become roots of the tree).
+
+    Raises
+    ------
+    WiringError if the wiring is invalid (see `wiring_errors`).
+    """
+
+    def __init__(self, elec_meters=None, building_instance=None):
+        if elec_meters is None:
+            return
+        errors, parents, site_meters = _parse(elec_meters, building_instance)
+        if errors:
+            raise WiringError('\n'.join(errors))
+        self._build(parents, site_meters)
+
+    def _build(self, parents, site_meters):
+        children = {}
+        roots = []
+        for meter in sorted(parents):
+            parent = parents[meter]
+            if parent is None:
+                roots.append(meter)
+            else:
+                children.setdefault(parent, []).append(meter)
+        if SITE_METERS in children:
+            roots.insert(0, SITE_METERS)
+
+        parent_of = dict(parents)
+        depth = {}
+        site_meter = {}
+        preorder = []
+        subtree_end = {}
+        stack = [(root, 0, None, False) for root in reversed(roots)]
+        while stack:
+            meter, meter_depth, upstream_site_meter, done = stack.pop()
+            if done:
+                subtree_end[meter] = len(preorder)
+                continue
+            if meter == SITE_METERS:
+                upstream_site_meter = SITE_METERS
+            elif meter in site_meters:
+                upstream_site_meter = meter
+            subtree_end[meter] = None
+            depth[meter] = meter_depth
+            site_meter[meter] = upstream_site_meter
+            preorder.append(meter)
+            stack.append((meter, meter_depth, upstream_site_meter, True))
+            child_depth = meter_depth + 1
+            for child in reversed(children.get(meter, [])):
+                stack.append((child, child_depth, upstream_site_meter, False))
+
+        unreached = sorted(set(parents) - set(depth))
+        if unreached:
+            raise WiringError("Meters {} form a submeter_of cycle."
+                              .format(unreached))
+
+        position = {meter: i for i, meter in enumerate(preorder)}
+        self._parent = parent_of
+        self._children = children
+        self._depth = depth
+        self._site_meter = site_meter
+        self._preorder = preorder
+        self._subtree = {meter: (position[meter], subtree_end[meter])
+                         for meter in preorder}
+        self._roots = roots
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict of plain Python objects, suitable for storing in HDF5 attrs.
+        """
+        return {'parent': dict(self._parent),
+                'children': {meter: list(children) for meter, children
+                             in iteritems(self._children)},
+                'depth': dict(self._depth),
+                'site_meter': dict(self._site_meter),
+                'preorder': list(self._preorder),
+                'subtree': dict(self._subtree),
+                'roots': list(self._roots)}
+
+    @classmethod
+    def from_dict(cls, wiring):
+        """Inverse of `to_dict`."""
+        tree = cls()
+        tree._parent = wiring['parent']
+        tree._children = wiring['children']
+        tree._depth = wiring['depth']
+        tree._site_meter = wiring['site_meter']
+        tree._preorder = wiring['preorder']
+        tree._subtree = wiring['subtree']
+        tree._roots = wiring['roots']
+        return tree
+
+    def meters(self):
+        """All meters (including SITE_METERS if used) in preorder."""
+        return list(self._preorder)
+
+    def roots(self):
+        return list(self._roots)
+
+    def parent(self, meter):
+        """Upstream meter, SITE_METERS, or None for roots."""
+        return self._parent.get(meter)
+
+    def children(self, meter):
+        """Meters directly downstream of `meter`."""
+        return list(self._children.get(meter, []))
+
+    def depth(self, meter):
+        """Number of meters upstream of `meter`.  Roots (including
+        site meters and SITE_METERS) have depth 0."""
+        return self._depth[meter]
+
+    def site_meter(self, meter):
+        """The nearest site meter upstream of (or equal to) `meter`;
+        SITE_METERS if that is all the site meters; None if no site meter
+        is upstream."""
+        return self._site_meter[meter]
+
+    def downstream(self, meter):
+        """All meters directly or indirectly downstream of `meter`."""
+        start, end = self._subtree[meter]
+        return self._preorder[start+1:end]
+
+    def upstream(self, meter):
+        """All meters upstream of `meter`, nearest first."""
+        upstream = []
+        meter = self._parent.get(meter)
+        while meter is not None:
+            upstream.append(meter)
+            meter = self._parent.get(meter)
+        return upstream
+
+    def is_downstream_of(self, meter, upstream_meter):
+        start, end = self._subtree[upstream_meter]
+        position = self._subtree[meter][0]
+        return start < position < end
+
+
+def wiring_errors(elec_meters, building_instance=None):
+    """
+    Checks, in linear time:
+    * submeter_of refers to a meter in this building (no dangling parents)
+    * submeter_of=0 is only used if the building has site meters
+    * site meters are only downstream of other site meters
+    * there are no cycles
+
+    Returns
+    -------
+    list of error message strings.
+    """
+    errors, parents, site_meters = _parse(elec_meters, building_instance)
+    if not errors:
+        try:
+            WiringTree()._build(parents, site_meters)
+        except WiringError as e:
+            errors.append(str(e))
+    return errors
+
+
+def _parse(elec_meters, building_instance):
+    """
+    Returns
+    -------
+    errors : list of strings
+    parents : dict mapping each meter to its parent (None for roots)
+    site_meters : set of site meter instances
+    """
+    errors = []
+    parents = {}
+    site_meters = {meter for meter, metadata in iteritems(elec_meters)
+                   if (metadata or {}).get('site_meter')}
+    for meter, metadata in iteritems(elec_meters):
+        metadata = metadata or {}
+        submeter_of = metadata.get('submeter_of')
+        upstream_building = metadata.get('upstream_meter_in_building')
+        parents[meter] = None
+        if submeter_of is None:
+            continue
+        elif (upstream_building is not None and
+              upstream_building != building_instance):
+            continue  # upstream meter is in another building
+        elif submeter_of == SITE_METERS:
+            if meter in site_meters:
+                errors.append("Site meter {} cannot have submeter_of=0."
+                              .format(meter))
+            elif not site_meters:
+                errors.append("Meter {} has submeter_of=0 but there are no"
+                              " site meters.".format(meter))
+            else:
+                parents[meter] = SITE_METERS
+        elif submeter_of not in elec_meters:
+            errors.append("Meter {} is a submeter of meter {} which does"
+                          " not exist.".format(meter, submeter_of))
+        elif meter in site_meters and submeter_of not in site_meters:
+            errors.append("Site meter {} is a submeter of meter {} which is"
+                          " not a site meter.".format(meter, submeter_of))
+        else:
+            parents[meter] = submeter_of
+    return errors, parents, site_meters